@@ -26,6 +26,18 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+# Full-text search structures are created by DDL events in models.py rather
+# than declared on the models, so autogenerate must not propose dropping them.
+# notes_fts_* are the FTS5 table's shadow tables on SQLite.
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == "column" and name == "search_vector" and object.table.name == "notes":
+        return False
+    if type_ == "index" and name == "ix_notes_search_vector":
+        return False
+    if type_ == "table" and (name == "notes_fts" or name.startswith("notes_fts_")):
+        return False
+    return True
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -48,6 +60,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -71,7 +84,8 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_object=include_object
         )
 
         with context.begin_transaction():
@@ -0,0 +1,36 @@
+"""Add rate limit buckets table
+
+Revision ID: 0c9e4b7d2a51
+Revises: f5a8c3e1d962
+Create Date: 2026-10-18 20:26:08.912374
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c9e4b7d2a51'
+down_revision: Union[str, None] = 'f5a8c3e1d962'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_limit_buckets',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.Column('full_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_rate_limit_buckets_full_at'), 'rate_limit_buckets', ['full_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_rate_limit_buckets_full_at'), table_name='rate_limit_buckets')
+    op.drop_table('rate_limit_buckets')
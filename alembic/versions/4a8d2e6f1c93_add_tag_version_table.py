@@ -0,0 +1,32 @@
+"""Add tag version table
+
+Revision ID: 4a8d2e6f1c93
+Revises: 7e3f1b9a6c08
+Create Date: 2026-10-18 23:12:40.518274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4a8d2e6f1c93'
+down_revision: Union[str, None] = '7e3f1b9a6c08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tag_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('tag_version')
@@ -0,0 +1,28 @@
+"""Add notes keyset pagination index
+
+Revision ID: 5d1e8a9c4b27
+Revises: 2067b4a326b3
+Create Date: 2026-10-18 10:40:12.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d1e8a9c4b27'
+down_revision: Union[str, None] = '2067b4a326b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_notes_user_id_updated_at_id', 'notes', ['user_id', 'updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notes_user_id_updated_at_id', table_name='notes')
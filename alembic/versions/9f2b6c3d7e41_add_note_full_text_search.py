@@ -0,0 +1,47 @@
+"""Add note full-text search
+
+Revision ID: 9f2b6c3d7e41
+Revises: 5d1e8a9c4b27
+Create Date: 2026-10-18 11:02:47.905113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f2b6c3d7e41'
+down_revision: Union[str, None] = '5d1e8a9c4b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "ALTER TABLE notes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(content, '')), 'B')) STORED"
+        )
+        op.create_index('ix_notes_search_vector', 'notes', ['search_vector'], unique=False, postgresql_using='gin')
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts "
+            "USING fts5(title, content, user_id UNINDEXED, tokenize='unicode61')"
+        )
+        op.execute(
+            "INSERT INTO notes_fts (rowid, title, content, user_id) "
+            "SELECT id, coalesce(title, ''), coalesce(content, ''), user_id FROM notes"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_notes_search_vector', table_name='notes', postgresql_using='gin')
+        op.drop_column('notes', 'search_vector')
+    else:
+        op.execute("DROP TABLE IF EXISTS notes_fts")
@@ -0,0 +1,28 @@
+"""Add note_tags (tag_id, note_id) index
+
+Revision ID: a3d94f7c2e18
+Revises: c47a1d0e6b93
+Create Date: 2026-10-18 14:05:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d94f7c2e18'
+down_revision: Union[str, None] = 'c47a1d0e6b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_note_tags_tag_id_note_id', 'note_tags', ['tag_id', 'note_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_note_tags_tag_id_note_id', table_name='note_tags')
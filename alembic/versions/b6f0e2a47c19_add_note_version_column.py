@@ -0,0 +1,28 @@
+"""Add note version column
+
+Revision ID: b6f0e2a47c19
+Revises: e81b5c9d3f27
+Create Date: 2026-10-18 16:48:31.557902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6f0e2a47c19'
+down_revision: Union[str, None] = 'e81b5c9d3f27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notes', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('notes', 'version')
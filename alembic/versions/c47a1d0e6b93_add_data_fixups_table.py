@@ -0,0 +1,32 @@
+"""Add data fixups table
+
+Revision ID: c47a1d0e6b93
+Revises: 9f2b6c3d7e41
+Create Date: 2026-10-18 12:14:55.204671
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c47a1d0e6b93'
+down_revision: Union[str, None] = '9f2b6c3d7e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('data_fixups',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('data_fixups')
@@ -0,0 +1,50 @@
+"""Add note change sequence and tombstones
+
+Revision ID: d2c7a91e5b04
+Revises: b6f0e2a47c19
+Create Date: 2026-10-18 18:03:19.640285
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2c7a91e5b04'
+down_revision: Union[str, None] = 'b6f0e2a47c19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_change_seqs',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.add_column('notes', sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('notes', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    # Existing notes get sequence numbers in the order they were last written.
+    op.execute(
+        "UPDATE notes SET change_seq = ranked.seq "
+        "FROM (SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY updated_at, id) AS seq FROM notes) AS ranked "
+        "WHERE notes.id = ranked.id"
+    )
+    op.execute(
+        "INSERT INTO user_change_seqs (user_id, seq) "
+        "SELECT user_id, max(change_seq) FROM notes WHERE user_id IS NOT NULL GROUP BY user_id"
+    )
+    op.create_index('ix_notes_user_id_change_seq', 'notes', ['user_id', 'change_seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notes_user_id_change_seq', table_name='notes')
+    op.execute("DELETE FROM notes WHERE deleted_at IS NOT NULL")
+    op.drop_column('notes', 'deleted_at')
+    op.drop_column('notes', 'change_seq')
+    op.drop_table('user_change_seqs')
@@ -0,0 +1,42 @@
+"""Add user tag counts table
+
+Revision ID: e81b5c9d3f27
+Revises: a3d94f7c2e18
+Create Date: 2026-10-18 15:22:08.471630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81b5c9d3f27'
+down_revision: Union[str, None] = 'a3d94f7c2e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_tag_counts',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'tag_id')
+    )
+    op.execute(
+        "INSERT INTO user_tag_counts (user_id, tag_id, count) "
+        "SELECT notes.user_id, note_tags.tag_id, count(*) "
+        "FROM note_tags JOIN notes ON notes.id = note_tags.note_id "
+        "WHERE notes.user_id IS NOT NULL "
+        "GROUP BY notes.user_id, note_tags.tag_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_tag_counts')
@@ -0,0 +1,71 @@
+"""Maintain note search vector in the application
+
+Revision ID: f5a8c3e1d962
+Revises: d2c7a91e5b04
+Create Date: 2026-10-18 19:12:47.305118
+
+"""
+import base64
+import zlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a8c3e1d962'
+down_revision: Union[str, None] = 'd2c7a91e5b04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(content, '')), 'B')"
+)
+
+# Frozen copy of the stored-content format as of this revision, so replaying
+# it does not depend on the current models module.
+FORMAT_MARKER = "\x01"
+ZLIB_PREFIX = FORMAT_MARKER + "z"
+RAW_PREFIX = FORMAT_MARKER + "r"
+
+
+def decompress_text(value: str) -> str:
+    if value.startswith(ZLIB_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(ZLIB_PREFIX):])).decode("utf-8")
+    if value.startswith(RAW_PREFIX):
+        return value[len(RAW_PREFIX):]
+    return value
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # notes.content is about to be stored compressed, which a generated column
+    # would index as-is. Content is still plain here; the notes_compress_content
+    # data fixup converts it once the application starts.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_notes_search_vector', table_name='notes', postgresql_using='gin')
+        op.drop_column('notes', 'search_vector')
+        op.execute("ALTER TABLE notes ADD COLUMN search_vector tsvector")
+        op.execute(f"UPDATE notes SET search_vector = {SEARCH_VECTOR_SQL} WHERE deleted_at IS NULL")
+        op.create_index('ix_notes_search_vector', 'notes', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Earlier revisions only read plain content, so compressed rows are
+    # expanded again before anything else.
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT id, content FROM notes WHERE substr(content, 1, 1) = :marker"), {"marker": FORMAT_MARKER}).all()
+    if rows:
+        bind.execute(
+            sa.text("UPDATE notes SET content = :content WHERE id = :id"),
+            [{"id": note_id, "content": decompress_text(content)} for note_id, content in rows],
+        )
+    op.execute("DELETE FROM data_fixups WHERE name = 'notes_compress_content'")
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('ix_notes_search_vector', table_name='notes', postgresql_using='gin')
+        op.drop_column('notes', 'search_vector')
+        op.execute(f"ALTER TABLE notes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR_SQL}) STORED")
+        op.create_index('ix_notes_search_vector', 'notes', ['search_vector'], unique=False, postgresql_using='gin')
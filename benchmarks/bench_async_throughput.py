@@ -0,0 +1,80 @@
+"""Throughput of the note read endpoints on the sync stack vs the async stack.
+
+    python -m benchmarks.bench_async_throughput [--db-url postgresql://...] [--concurrency 64]
+
+The sync stack mirrors the previous routers: plain `def` endpoints on
+get_db/get_current_user, each holding a threadpool thread for the whole
+request. The async stack is the application's own router.
+"""
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from fastapi import FastAPI, Depends
+from sqlalchemy.orm import Session
+from main import app
+from database import get_db
+from services.auth import get_current_user, principal_cache
+from services.notes import get_note_by_id, get_notes_page, note_to_response
+from benchmarks.common import BenchDatabase, bench_client, register
+
+
+def build_sync_app():
+    sync_app = FastAPI()
+
+    @sync_app.get("/api/notes/")
+    def list_notes(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+        notes, next_cursor = get_notes_page(db, current_user["id"], 50)
+        return {"items": [note_to_response(note) for note in notes], "nextCursor": next_cursor}
+
+    @sync_app.get("/api/notes/{id}")
+    def get_note(id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+        return note_to_response(get_note_by_id(db, id, current_user["id"]))
+
+    return sync_app
+
+
+async def _throughput(target_app, path: str, headers, requests: int, concurrency: int):
+    transport = httpx.ASGITransport(app=target_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                response = await client.get(path, headers=headers)
+                assert response.status_code == 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"requests": requests, "seconds": elapsed, "requests_per_second": requests / elapsed}
+
+
+async def run(db_url: str, notes: int, requests: int, concurrency: int):
+    database = BenchDatabase(db_url)
+    sync_app = build_sync_app()
+    database.install(sync_app)
+    results = {}
+    async with bench_client(app, database) as client:
+        headers = await register(client, "bench")
+        for i in range(notes):
+            response = await client.post("/api/notes/", json={"title": f"Note {i}", "content": "Content"}, headers=headers)
+        note_id = response.json()["id"]
+        for path in ("/api/notes/", f"/api/notes/{note_id}"):
+            principal_cache.clear()
+            results[path] = {
+                "sync": await _throughput(sync_app, path, headers, requests, concurrency),
+                "async": await _throughput(app, path, headers, requests, concurrency),
+            }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--notes", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.db_url, args.notes, args.requests, args.concurrency)), indent=2))
@@ -0,0 +1,114 @@
+"""Storage saved by compressing large note bodies, and what it costs in CPU.
+
+    python -m benchmarks.bench_compression [--notes 2000] [--large-share 0.2] [--large-kb 32]
+
+Loads the same notes into two SQLite databases, one with compression
+disabled, and compares stored content bytes, file size and the time to write
+and read every note body.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import zlib
+from sqlalchemy import insert, select, text
+import config
+from models import Note, compress_text, decompress_text
+from benchmarks.common import make_engine, temp_sqlite_url, summarize, timed
+from database import Base
+
+WORDS = (
+    "meeting roadmap budget review draft quarterly release customer feedback design "
+    "the a of to and in for with on is was be this that from by at as are it we "
+    "migration latency index cache deploy rollback incident follow-up owner deadline"
+).split()
+
+
+def _body(rng: random.Random, size: int) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+
+def _notes(count: int, large_share: float, large_kb: int):
+    rng = random.Random(42)
+    return [
+        {"title": f"Note {i}", "user_id": 1, "locked": False,
+         "content": _body(rng, large_kb * 1024 if rng.random() < large_share else rng.randint(200, 2000))}
+        for i in range(count)
+    ]
+
+
+def _load(rows, threshold: int):
+    config.NOTE_COMPRESS_THRESHOLD_BYTES = threshold
+    url = temp_sqlite_url()
+    engine = make_engine(url)
+    Base.metadata.create_all(engine)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(insert(Note), rows)
+    write = time.perf_counter() - started
+    with engine.begin() as conn:
+        stored = conn.execute(text("SELECT sum(length(CAST(content AS BLOB))) FROM notes")).scalar()
+        conn.execute(text("VACUUM"))
+
+    def read_all():
+        with engine.connect() as conn:
+            return conn.execute(select(Note.content)).scalars().all()
+
+    assert read_all() == [row["content"] for row in rows]
+    result = {
+        "content_bytes": stored,
+        "file_bytes": os.path.getsize(url[len("sqlite:///"):]),
+        "write_ms": write * 1000,
+        "read_all": summarize(timed(read_all, 5)),
+    }
+    engine.dispose()
+    return result
+
+
+def _codec(rows, threshold: int, iterations: int):
+    bodies = [row["content"] for row in rows]
+    stored = [compress_text(body, threshold) for body in bodies]
+    megabytes = sum(len(body.encode()) for body in bodies) / 2**20
+    compress = summarize(timed(lambda: [compress_text(body, threshold) for body in bodies], iterations))
+    decompress = summarize(timed(lambda: [decompress_text(value) for value in stored], iterations))
+    return {
+        "megabytes": megabytes,
+        "compress_ms_per_mb": compress["p50_ms"] / megabytes,
+        "decompress_ms_per_mb": decompress["p50_ms"] / megabytes,
+    }
+
+
+def run(notes: int, large_share: float, large_kb: int, iterations: int):
+    rows = _notes(notes, large_share, large_kb)
+    threshold = config.NOTE_COMPRESS_THRESHOLD_BYTES
+    plain = _load(rows, 2**62)
+    compressed = _load(rows, threshold)
+    config.NOTE_COMPRESS_THRESHOLD_BYTES = threshold
+    return {
+        "notes": notes,
+        "threshold_bytes": threshold,
+        "level": config.NOTE_COMPRESS_LEVEL,
+        "zlib": zlib.ZLIB_RUNTIME_VERSION,
+        "plain": plain,
+        "compressed": compressed,
+        "content_saved_pct": 100 * (1 - compressed["content_bytes"] / plain["content_bytes"]),
+        "file_saved_pct": 100 * (1 - compressed["file_bytes"] / plain["file_bytes"]),
+        "codec": _codec(rows, threshold, iterations),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--large-share", type=float, default=0.2)
+    parser.add_argument("--large-kb", type=int, default=32)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.notes, args.large_share, args.large_kb, args.iterations), indent=2))
@@ -0,0 +1,61 @@
+"""Cost of catching up after a small edit: full re-download vs the change feed.
+
+    python -m benchmarks.bench_delta_sync [--notes 50000] [--edits 5]
+"""
+import argparse
+import json
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from models import Note, UserChangeSeq
+from schemas import NoteCreate
+from services.changes import get_changes, render_changes
+from services.notes import get_notes_page, render_note_page, update_note
+from benchmarks.common import make_engine, temp_sqlite_url, QueryCounter, summarize, timed
+from database import Base
+
+
+def _full_download(db: Session, user_id: int):
+    pages, cursor = 0, None
+    while True:
+        notes, cursor = get_notes_page(db, user_id, 200, cursor)
+        render_note_page(notes, cursor)
+        pages += 1
+        if cursor is None:
+            return pages
+
+
+def run(notes: int, edits: int, iterations: int):
+    engine = make_engine(temp_sqlite_url())
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Note), [
+            {"title": f"Note {i}", "content": "Lorem ipsum " * 20, "user_id": 1, "locked": False, "change_seq": i + 1}
+            for i in range(notes)
+        ])
+        conn.execute(insert(UserChangeSeq), [{"user_id": 1, "seq": notes}])
+    counter = QueryCounter(engine)
+    results = {"notes": notes, "edits": edits}
+    with Session(engine) as db:
+        cursor = get_changes(db, 1, limit=notes)["cursor"]
+        for note_id in range(1, edits + 1):
+            update_note(db, note_id, 1, NoteCreate(title=f"Edited {note_id}", content="changed"))
+
+        with counter.counting():
+            pages = _full_download(db, 1)
+        results["full_download"] = {"pages": pages, "queries": counter.count, **summarize(timed(lambda: _full_download(db, 1), iterations))}
+
+        delta = lambda: render_changes(get_changes(db, 1, cursor))
+        assert len(get_changes(db, 1, cursor)["items"]) == edits
+        with counter.counting():
+            delta()
+        results["change_feed"] = {"queries": counter.count, **summarize(timed(delta, iterations * 10))}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=50000)
+    parser.add_argument("--edits", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.notes, args.edits, args.iterations), indent=2))
@@ -0,0 +1,257 @@
+"""Throughput and latency of every API endpoint against a seeded dataset.
+
+    python -m benchmarks.bench_endpoints [--db-url postgresql://...] [--users 10] [--notes 100] [--tags 50]
+        [--requests 500] [--concurrency 8] [--output results.json]
+        [--baseline previous.json --threshold 0.2 --metric p95_ms]
+
+Drives the application in-process through httpx's ASGI transport. Each
+scenario issues --requests requests (--auth-requests for the bcrypt-bound
+register and login) from --concurrency workers, each request acting as a
+random seeded user. With --baseline the run exits with status 1 when a
+scenario's metric is worse than the baseline's by more than --threshold.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+from sqlalchemy import select, func
+from main import app
+from models import Note
+from schemas import NoteCreate
+from services.auth import principal_cache
+from services.notes import create_note
+from services.rate_limit import auth_limiter
+from services.tags import tag_list_cache
+from services.suggest import tag_suggest_index
+from benchmarks.common import BenchDatabase, bench_client, register, summarize
+from benchmarks.bench_compression import WORDS, _body
+
+# Metrics where a larger value is the better one.
+HIGHER_IS_BETTER = {"requests_per_second"}
+
+
+class Dataset:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.users = []  # (user_id, username, headers)
+        self.notes = {}  # user_id -> seeded note ids
+        self.created = []  # (headers, note id) left by notes.create for notes.delete
+        self.tags = []
+        self.sequence = itertools.count()
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def note(self):
+        user_id, _, headers = self.user()
+        return headers, self.rng.choice(self.notes[user_id])
+
+
+async def seed(client, database: BenchDatabase, rng: random.Random, users: int, notes: int, tags: int):
+    data = Dataset(rng)
+    data.tags = [f"tag-{i:04d}" for i in range(tags)]
+    for i in range(users):
+        username = f"bench-{i}"
+        headers = await register(client, username)
+        data.users.append((i + 1, username, headers))
+    with database.SessionLocal() as db:
+        for user_id, _, _ in data.users:
+            for i in range(notes):
+                note = NoteCreate(
+                    title=f"Note {i} " + " ".join(rng.sample(WORDS, 3)),
+                    content=_body(rng, rng.randint(200, 4000)),
+                    tags=rng.sample(data.tags, min(len(data.tags), rng.randint(0, 3))),
+                )
+                create_note(db, note, user_id)
+        rows = db.execute(select(Note.user_id, Note.id)).all()
+        assert db.scalar(select(func.count(Note.id))) == users * notes
+    for user_id, note_id in rows:
+        data.notes.setdefault(user_id, []).append(note_id)
+    return data
+
+
+def _note_body(data: Dataset):
+    return {
+        "title": f"Bench {next(data.sequence)}",
+        "content": _body(data.rng, data.rng.randint(200, 4000)),
+        "tags": data.rng.sample(data.tags, min(len(data.tags), 2)),
+    }
+
+
+async def _register(client, data):
+    username = f"bench-new-{next(data.sequence)}"
+    return await client.post("/api/auth/register", json={"name": username, "username": username, "password": "bench-password"})
+
+async def _login(client, data):
+    _, username, _ = data.user()
+    return await client.post("/api/auth/login", json={"username": username, "password": "bench-password"})
+
+async def _create_note(client, data):
+    _, _, headers = data.user()
+    response = await client.post("/api/notes/", json=_note_body(data), headers=headers)
+    if response.status_code == 200:
+        data.created.append((headers, response.json()["id"]))
+    return response
+
+async def _get_note(client, data):
+    headers, note_id = data.note()
+    return await client.get(f"/api/notes/{note_id}", headers=headers)
+
+async def _update_note(client, data):
+    headers, note_id = data.note()
+    return await client.put(f"/api/notes/{note_id}", json=_note_body(data), headers=headers)
+
+async def _delete_note(client, data):
+    headers, note_id = data.created.pop()
+    return await client.delete(f"/api/notes/{note_id}", headers=headers)
+
+async def _list_notes(client, data):
+    return await client.get("/api/notes/", params={"limit": 50}, headers=data.user()[2])
+
+async def _list_note_titles(client, data):
+    return await client.get("/api/notes/", params={"limit": 50, "fields": "id,title,updatedAt,tags"}, headers=data.user()[2])
+
+async def _list_tagged_notes(client, data):
+    params = {"tags": ",".join(data.rng.sample(data.tags, 2)), "match": "any"}
+    return await client.get("/api/notes/", params=params, headers=data.user()[2])
+
+async def _search_notes(client, data):
+    return await client.get("/api/notes/search", params={"q": data.rng.choice(WORDS)}, headers=data.user()[2])
+
+async def _note_changes(client, data):
+    return await client.get("/api/notes/changes", params={"limit": 100}, headers=data.user()[2])
+
+async def _tag_facets(client, data):
+    return await client.get("/api/notes/facets", headers=data.user()[2])
+
+async def _list_tags(client, data):
+    return await client.get("/tags/", headers=data.user()[2])
+
+async def _suggest_tags(client, data):
+    return await client.get("/tags/suggest", params={"prefix": "tag-0", "limit": 10}, headers=data.user()[2])
+
+async def _create_tag(client, data):
+    return await client.post("/tags/", json={"name": f"bench-tag-{next(data.sequence)}"}, headers=data.user()[2])
+
+# name -> (request, expected status, bcrypt bound). Order matters: notes.delete
+# removes the notes left behind by notes.create.
+SCENARIOS = {
+    "auth.register": (_register, 200, True),
+    "auth.login": (_login, 200, True),
+    "notes.create": (_create_note, 200, False),
+    "notes.get": (_get_note, 200, False),
+    "notes.update": (_update_note, 200, False),
+    "notes.list": (_list_notes, 200, False),
+    "notes.list_fields": (_list_note_titles, 200, False),
+    "notes.list_tagged": (_list_tagged_notes, 200, False),
+    "notes.search": (_search_notes, 200, False),
+    "notes.changes": (_note_changes, 200, False),
+    "notes.facets": (_tag_facets, 200, False),
+    "notes.delete": (_delete_note, 200, False),
+    "tags.list": (_list_tags, 200, False),
+    "tags.suggest": (_suggest_tags, 200, False),
+    "tags.create": (_create_tag, 200, False),
+}
+
+
+async def drive(client, data: Dataset, request, expected: int, count: int, concurrency: int):
+    samples = []
+    statuses = {}
+    remaining = iter(range(count))
+
+    async def worker():
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await request(client, data)
+            samples.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": count / elapsed,
+        "errors": count - statuses.get(expected, 0),
+        "statuses": {str(code): n for code, n in sorted(statuses.items())},
+        **summarize(samples),
+    }
+
+
+async def run(db_url: str, users: int, notes: int, tags: int, requests: int, auth_requests: int,
+              concurrency: int, seed_value: int, only=None):
+    for cache in (principal_cache, tag_list_cache, tag_suggest_index):
+        cache.clear()
+    # Every simulated user shares one client address; the limiter would turn
+    # the auth scenarios into a measurement of 429s.
+    auth_limiter.enabled = False
+    rng = random.Random(seed_value)
+    database = BenchDatabase(db_url)
+    results = {
+        "config": {
+            "database": database.engine.dialect.name, "users": users, "notes_per_user": notes, "tags": tags,
+            "requests": requests, "auth_requests": auth_requests, "concurrency": concurrency, "seed": seed_value,
+        },
+        "scenarios": {},
+    }
+    async with bench_client(app, database) as client:
+        started = time.perf_counter()
+        data = await seed(client, database, rng, users, notes, tags)
+        results["config"]["seed_seconds"] = time.perf_counter() - started
+        for name, (request, expected, bcrypt_bound) in SCENARIOS.items():
+            if only and name not in only:
+                continue
+            count = auth_requests if bcrypt_bound else requests
+            if name == "notes.delete":
+                count = len(data.created)
+            if count:
+                results["scenarios"][name] = await drive(client, data, request, expected, count, concurrency)
+    return results
+
+
+def compare(results, baseline, metric: str, threshold: float):
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None or not previous.get(metric):
+            continue
+        ratio = current[metric] / previous[metric]
+        worse = ratio < 1 - threshold if metric in HIGHER_IS_BETTER else ratio > 1 + threshold
+        if worse:
+            regressions.append({"scenario": name, "metric": metric, "baseline": previous[metric],
+                                "current": current[metric], "ratio": ratio})
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--notes", type=int, default=100, help="notes per user")
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--auth-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", default=None, help="comma-separated scenario names")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--metric", default="p95_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms", "requests_per_second"])
+    args = parser.parse_args()
+    only = set(args.only.split(",")) if args.only else None
+    results = asyncio.run(run(args.db_url, args.users, args.notes, args.tags, args.requests, args.auth_requests,
+                              args.concurrency, args.seed, only))
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(results, json.load(f), args.metric, args.threshold)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if results.get("regressions"):
+        print(f"{len(results['regressions'])} scenario(s) regressed beyond {args.threshold:.0%} on {args.metric}", file=sys.stderr)
+        sys.exit(1)
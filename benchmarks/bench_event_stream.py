@@ -0,0 +1,116 @@
+"""Idle WebSocket connections on one worker: memory per connection and the
+time to fan an event out to all of them.
+
+    python -m benchmarks.bench_event_stream [--connections 5000] [--users 100]
+
+Starts uvicorn on a temporary SQLite database in a subprocess, opens the
+connections from this process, then measures delivery of a tag event
+(broadcast to every connection) and of a note event (one user's connections).
+"""
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+import httpx
+import websockets
+from sqlalchemy import create_engine
+import models  # noqa: F401  registers the tables on Base
+from database import Base
+from benchmarks.common import temp_sqlite_url, percentile
+
+INTERNAL_TOKEN = secrets.token_hex(16)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _rss_mib(pid: int):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+
+async def _wait_until_up(base_url: str):
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"{base_url}/internal/events")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+async def _deliveries(sockets, started: float):
+    async def receive(websocket):
+        await websocket.recv()
+        return time.perf_counter() - started
+    return await asyncio.gather(*(receive(websocket) for websocket in sockets))
+
+
+async def run(connections: int, users: int, server_args=()):
+    url = temp_sqlite_url()
+    Base.metadata.create_all(create_engine(url))
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "DB_URL": url, "BCRYPT_POOL_WORKERS": "0", "INTERNAL_TOKEN": INTERNAL_TOKEN}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", *server_args],
+        env=env,
+    )
+    try:
+        await _wait_until_up(base_url)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+            tokens = []
+            for user in range(users):
+                response = await client.post("/api/auth/register", json={"name": f"u{user}", "username": f"u{user}", "password": "bench-password"})
+                tokens.append(response.json()["access_token"])
+            rss_before = _rss_mib(server.pid)
+
+            sockets = []
+            for index in range(connections):
+                sockets.append(await websockets.connect(f"ws://127.0.0.1:{port}/api/notes/stream?token={tokens[index % users]}"))
+            await asyncio.sleep(1)
+            rss_after = _rss_mib(server.pid)
+            stats = (await client.get("/internal/events", headers={"X-Internal-Token": INTERNAL_TOKEN})).json()
+
+            started = time.perf_counter()
+            waiting = asyncio.create_task(_deliveries(sockets, started))
+            await client.post("/tags/", json={"name": "broadcast"})
+            broadcast = await waiting
+
+            own = sockets[0::users]
+            started = time.perf_counter()
+            waiting = asyncio.create_task(_deliveries(own, started))
+            await client.post("/api/notes/", json={"title": "x", "content": "y"}, headers={"Authorization": f"Bearer {tokens[0]}"})
+            targeted = await waiting
+
+            for websocket in sockets:
+                await websocket.close()
+        return {
+            "connections": stats["connections"],
+            "rss_mib_before": rss_before,
+            "rss_mib_after": rss_after,
+            "kib_per_connection": (rss_after - rss_before) * 1024 / connections,
+            "broadcast_ms": {"p50": percentile(broadcast, 50) * 1000, "p99": percentile(broadcast, 99) * 1000, "max": max(broadcast) * 1000},
+            "user_event_ms": {"receivers": len(own), "p50": percentile(targeted, 50) * 1000, "max": max(targeted) * 1000},
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--no-deflate", action="store_true", help="run uvicorn with --ws-per-message-deflate false")
+    args = parser.parse_args()
+    server_args = ["--ws-per-message-deflate", "false"] if args.no_deflate else []
+    print(json.dumps(asyncio.run(run(args.connections, args.users, server_args)), indent=2))
@@ -0,0 +1,73 @@
+"""Notes-endpoint latency during a burst of logins: bcrypt inline, in the
+worker pool, and in the pool behind the login rate limiter.
+
+    python -m benchmarks.bench_login_storm [--logins 200] [--reads 200]
+
+All requests share one event loop (and therefore one anyio threadpool), the
+way they do behind uvicorn.
+"""
+import argparse
+import asyncio
+import json
+import time
+import services.password_pool as password_pool_module
+from main import app
+from services.password_pool import PasswordPool
+from services.rate_limit import auth_limiter
+from benchmarks.common import BenchDatabase, bench_client, register, summarize
+
+
+async def _timed_get(client, headers, note_id):
+    started = time.perf_counter()
+    response = await client.get(f"/api/notes/{note_id}", headers=headers)
+    assert response.status_code == 200
+    return time.perf_counter() - started
+
+
+async def _storm(client, headers, note_id, logins: int, reads: int):
+    async def login():
+        response = await client.post("/api/auth/login", json={"username": "bench", "password": "bench-password"})
+        return response.status_code
+
+    async def reader():
+        samples = []
+        for _ in range(reads):
+            samples.append(await _timed_get(client, headers, note_id))
+            await asyncio.sleep(0.005)
+        return samples
+
+    login_tasks = [asyncio.create_task(login()) for _ in range(logins)]
+    samples = await reader()
+    statuses = await asyncio.gather(*login_tasks)
+    return samples, {str(code): statuses.count(code) for code in set(statuses)}
+
+
+async def _run_mode(pool, logins: int, reads: int, rate_limited: bool = False):
+    password_pool_module.password_pool = pool
+    auth_limiter.clear()
+    auth_limiter.enabled = rate_limited
+    async with bench_client(app, BenchDatabase()) as client:
+        headers = await register(client, "bench")
+        note_id = (await client.post("/api/notes/", json={"title": "Note", "content": "Content"}, headers=headers)).json()["id"]
+        idle = [await _timed_get(client, headers, note_id) for _ in range(reads)]
+        storm, statuses = await _storm(client, headers, note_id, logins, reads)
+    pool.shutdown()
+    return {"idle": summarize(idle), "storm": summarize(storm), "login_statuses": statuses, "rejected": pool.rejected}
+
+
+def run(logins: int, reads: int, workers: int, queue_depth: int):
+    return {
+        "inline": asyncio.run(_run_mode(PasswordPool(0, logins + 1), logins, reads)),
+        "pool": asyncio.run(_run_mode(PasswordPool(workers, queue_depth), logins, reads)),
+        "pool_rate_limited": asyncio.run(_run_mode(PasswordPool(workers, queue_depth), logins, reads, rate_limited=True)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue-depth", type=int, default=8)
+    args = parser.parse_args()
+    print(json.dumps(run(args.logins, args.reads, args.workers, args.queue_depth), indent=2))
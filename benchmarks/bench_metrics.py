@@ -0,0 +1,94 @@
+"""Overhead of the request metrics middleware and SQL accounting.
+
+    python -m benchmarks.bench_metrics [--requests 2000] [--statements 20000]
+
+Compares the note read endpoints with request_metrics switched off and on,
+a bare route with and without the middleware, and cursor execution on an
+engine with and without the query hooks.
+"""
+import argparse
+import asyncio
+import json
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from main import app
+from monitoring import MetricsMiddleware, RequestMetrics, request_metrics, instrument_queries, current_queries
+from benchmarks.common import BenchDatabase, bench_client, register, summarize, timed, timed_async
+
+
+async def _endpoints(requests: int):
+    database = BenchDatabase()
+    instrument_queries(database.async_engine.sync_engine)
+    results = {}
+    async with bench_client(app, database) as client:
+        headers = await register(client, "bench")
+        for i in range(50):
+            response = await client.post("/api/notes/", json={"title": f"Note {i}", "content": "Content"}, headers=headers)
+        note_id = response.json()["id"]
+        for path in (f"/api/notes/{note_id}", "/api/notes/"):
+            runs = {False: [], True: []}
+            # Alternate so drift in the machine affects both sides alike.
+            for _ in range(4):
+                for enabled in (False, True):
+                    request_metrics.enabled = enabled
+                    runs[enabled] += await timed_async(lambda: client.get(path, headers=headers), requests // 4)
+            request_metrics.enabled = True
+            off, on = summarize(runs[False]), summarize(runs[True])
+            results[path] = {"off": off, "on": on, "overhead_us_p50": (on["p50_ms"] - off["p50_ms"]) * 1000}
+    return results
+
+
+async def _bare_route(requests: int):
+    results = {}
+    for name, wrap in (("without", False), ("with", True)):
+        bare = FastAPI()
+        if wrap:
+            bare.add_middleware(MetricsMiddleware, metrics=RequestMetrics())
+
+        @bare.get("/ping")
+        async def ping():
+            return {}
+
+        transport = httpx.ASGITransport(app=bare)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await timed_async(lambda: client.get("/ping"), 200)
+            results[name] = summarize(await timed_async(lambda: client.get("/ping"), requests))
+    results["overhead_us_p50"] = (results["with"]["p50_ms"] - results["without"]["p50_ms"]) * 1000
+    return results
+
+
+def _statements(statements: int):
+    engines = {"without_hooks": create_engine("sqlite://"), "with_hooks": create_engine("sqlite://")}
+    instrument_queries(engines["with_hooks"])
+    select_one = text("SELECT 1")
+    samples = {name: [] for name in engines}
+    token = current_queries.set([0, 0.0])
+    try:
+        for _ in range(4):
+            for name, engine in engines.items():
+                with engine.connect() as conn:
+                    timed(lambda: conn.execute(select_one), 1000)
+                    samples[name] += timed(lambda: conn.execute(select_one), statements // 4)
+    finally:
+        current_queries.reset(token)
+    results = {name: {"us_per_statement": summarize(values)["p50_ms"] * 1000} for name, values in samples.items()}
+    results["overhead_us_per_statement"] = results["with_hooks"]["us_per_statement"] - results["without_hooks"]["us_per_statement"]
+    return results
+
+
+async def run(requests: int, statements: int):
+    return {
+        "endpoints": await _endpoints(requests),
+        "bare_route": await _bare_route(requests),
+        "statements": _statements(statements),
+        "render_ms": summarize(timed(lambda: request_metrics.render(), 100))["p50_ms"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--statements", type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.requests, args.statements)), indent=2))
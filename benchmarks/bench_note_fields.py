@@ -0,0 +1,53 @@
+"""List page cost with full notes vs ?fields= projections and ?snippet=.
+
+    python -m benchmarks.bench_note_fields [--notes 200] [--content-kb 64]
+"""
+import argparse
+import json
+import random
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from models import Note
+from services.notes import get_notes_page, render_note_page, render_projected_page, parse_note_fields
+from benchmarks.common import make_engine, temp_sqlite_url, summarize, timed
+from benchmarks.bench_compression import _body
+from database import Base
+
+PROJECTIONS = {
+    "full": (None, None),
+    "titles": (parse_note_fields("id,title,updatedAt,tags"), None),
+    "titles_snippet": (parse_note_fields("id,title,updatedAt,tags"), 120),
+}
+
+
+def _page(engine, fields, snippet, limit: int):
+    # A fresh session per page, as a request would have.
+    with Session(engine) as db:
+        if fields is None:
+            return render_note_page(*get_notes_page(db, 1, limit))
+        return render_projected_page(*get_notes_page(db, 1, limit, fields=fields, snippet=snippet), fields, snippet)
+
+
+def run(notes: int, content_kb: int, iterations: int):
+    engine = make_engine(temp_sqlite_url())
+    Base.metadata.create_all(engine)
+    rng = random.Random(7)
+    with engine.begin() as conn:
+        conn.execute(insert(Note), [
+            {"title": f"Note {i}", "content": _body(rng, content_kb * 1024), "user_id": 1, "locked": False}
+            for i in range(notes)
+        ])
+    results = {"notes": notes, "content_kb": content_kb}
+    for name, (fields, snippet) in PROJECTIONS.items():
+        page = lambda: _page(engine, fields, snippet, notes)
+        results[name] = {"body_bytes": len(page()), **summarize(timed(page, iterations))}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--content-kb", type=int, default=64)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.notes, args.content_kb, args.iterations), indent=2))
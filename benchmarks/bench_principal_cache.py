@@ -0,0 +1,43 @@
+"""Per-request DB queries for GET /api/notes/{id} with and without the principal cache.
+
+    python -m benchmarks.bench_principal_cache [--requests 500]
+"""
+import argparse
+import asyncio
+import json
+from main import app
+from services.auth import principal_cache
+from benchmarks.common import BenchDatabase, bench_client, register, QueryCounter, summarize, timed_async
+
+
+async def run(requests: int):
+    database = BenchDatabase()
+    counter = QueryCounter(database.async_engine.sync_engine)
+    async with bench_client(app, database) as client:
+        headers = await register(client, "bench")
+        note_id = (await client.post("/api/notes/", json={"title": "Note", "content": "Content"}, headers=headers)).json()["id"]
+
+        async def fetch():
+            assert (await client.get(f"/api/notes/{note_id}", headers=headers)).status_code == 200
+
+        async def fetch_uncached():
+            principal_cache.clear()
+            await fetch()
+
+        results = {}
+        for name, fn in (("uncached", fetch_uncached), ("cached", fetch)):
+            principal_cache.clear()
+            await fetch()
+            with counter.counting():
+                await fn()
+            queries = counter.count
+            results[name] = {"queries_per_request": queries, **summarize(await timed_async(fn, requests))}
+    results["cache"] = principal_cache.stats()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.requests)), indent=2))
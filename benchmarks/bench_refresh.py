@@ -0,0 +1,46 @@
+"""Cost of renewing an access token: a password login vs a refresh-token exchange.
+
+    python -m benchmarks.bench_refresh [--iterations 50]
+
+Both run sequentially through the app, so the numbers are per-request latency
+without queueing.
+"""
+import argparse
+import asyncio
+import json
+import time
+from main import app
+from services.rate_limit import auth_limiter
+from benchmarks.common import BenchDatabase, bench_client, register, summarize
+
+
+async def _timed_post(client, path: str, body: dict):
+    started = time.perf_counter()
+    response = await client.post(path, json=body)
+    response.raise_for_status()
+    return time.perf_counter() - started, response.json()
+
+
+async def _run(iterations: int):
+    auth_limiter.enabled = False
+    async with bench_client(app, BenchDatabase()) as client:
+        await register(client, "bench")
+        credentials = {"username": "bench", "password": "bench-password"}
+        logins = []
+        for _ in range(iterations):
+            elapsed, body = await _timed_post(client, "/api/auth/login", credentials)
+            logins.append(elapsed)
+        refresh_token = body["refresh_token"]
+        refreshes = []
+        for _ in range(iterations):
+            elapsed, body = await _timed_post(client, "/api/auth/refresh", {"refresh_token": refresh_token})
+            refresh_token = body["refresh_token"]
+            refreshes.append(elapsed)
+    return {"login": summarize(logins), "refresh": summarize(refreshes)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_run(args.iterations)), indent=2))
@@ -0,0 +1,68 @@
+"""CPU time and peak memory to serialize a page of notes, old path vs TypeAdapter path.
+
+    python -m benchmarks.bench_serialization [--notes 10000]
+
+"dict" reproduces the previous router: a dict per note, FastAPI validation
+of List[NoteResponse], dump to JSON-compatible python, then json.dumps.
+"adapter" is render_note_page: validation from ORM attributes and JSON
+bytes produced by pydantic-core in one pass each.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, selectinload
+from database import Base
+from models import Note, Tag, NoteTags
+from services.notes import render_note_page, note_page_adapter
+from benchmarks.common import make_engine, temp_sqlite_url
+
+
+def _dict_path(notes):
+    items = [
+        {"id": note.id, "title": note.title, "content": note.content, "locked": note.locked,
+         "tags": [tag.name for tag in note.tags], "createdAt": note.created_at, "updatedAt": note.updated_at}
+        for note in notes
+    ]
+    page = note_page_adapter.validate_python({"items": items, "nextCursor": None})
+    content = note_page_adapter.dump_python(page, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def _adapter_path(notes):
+    return render_note_page(notes, None)
+
+def _measure(fn, notes, repeats: int):
+    fn(notes)
+    cpu = []
+    for _ in range(repeats):
+        started = time.process_time()
+        body = fn(notes)
+        cpu.append(time.process_time() - started)
+    tracemalloc.start()
+    fn(notes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_ms_min": min(cpu) * 1000, "cpu_ms_mean": sum(cpu) / len(cpu) * 1000,
+            "peak_mib": peak / 2 ** 20, "bytes": len(body)}
+
+
+def run(notes: int, repeats: int):
+    engine = make_engine(temp_sqlite_url())
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.execute(insert(Tag), [{"name": f"tag-{i}"} for i in range(20)])
+        db.execute(insert(Note), [{"title": f"Note {i}", "content": "Lorem ipsum dolor sit amet " * 8, "user_id": 1, "locked": False} for i in range(notes)])
+        db.execute(insert(NoteTags), [{"note_id": i + 1, "tag_id": i % 20 + 1} for i in range(notes)])
+        db.commit()
+        loaded = db.query(Note).options(selectinload(Note.tags)).all()
+        assert json.loads(_dict_path(loaded[:10])) == json.loads(_adapter_path(loaded[:10]))
+        return {"notes": notes, "dict": _measure(_dict_path, loaded, repeats), "adapter": _measure(_adapter_path, loaded, repeats)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.notes, args.repeats), indent=2))
@@ -0,0 +1,75 @@
+"""GET /api/notes?tags= query latency on a 1M-row note_tags table, with and
+without the (tag_id, note_id) index.
+
+    python -m benchmarks.bench_tag_filter [--notes 200000] [--tags-per-note 5] [--users 10]
+
+With many small users the planner starts from the user's notes and the index
+matters little; with few large users, rare tags are only fast through it.
+"""
+import argparse
+import json
+import random
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+from models import Note, Tag, NoteTags
+from services.notes import get_notes, tagged_note_ids
+from benchmarks.common import make_engine, temp_sqlite_url, summarize, timed
+from database import Base
+
+TAGS = 2000
+
+
+def _seed(engine, notes: int, tags_per_note: int, users: int, rng: random.Random):
+    with engine.begin() as conn:
+        conn.execute(insert(Tag), [{"name": f"tag-{i}"} for i in range(TAGS)])
+        conn.execute(insert(Note), [{"title": f"Note {i}", "content": "", "user_id": i % users + 1, "locked": False} for i in range(notes)])
+        # Skewed so that a few tags are common, as real tag usage is.
+        weights = [1 / (rank + 1) for rank in range(TAGS)]
+        rows = []
+        for note_id in range(1, notes + 1):
+            for tag_id in set(rng.choices(range(1, TAGS + 1), weights=weights, k=tags_per_note)):
+                rows.append({"note_id": note_id, "tag_id": tag_id})
+        for start in range(0, len(rows), 100000):
+            conn.execute(insert(NoteTags), rows[start:start + 100000])
+        # Planner statistics, so SQLite can pick between starting from the
+        # user's notes and starting from the tag index as PostgreSQL would.
+        conn.execute(text("ANALYZE"))
+    return len(rows)
+
+
+def run(notes: int, tags_per_note: int, users: int, iterations: int):
+    rng = random.Random(14)
+    engine = make_engine(temp_sqlite_url())
+    Base.metadata.create_all(engine)
+    results = {"note_tags_rows": _seed(engine, notes, tags_per_note, users, rng)}
+    cases = {
+        "all_common": (["tag-0", "tag-1"], "all"),
+        "all_rare": (["tag-0", "tag-1500"], "all"),
+        "any_rare": (["tag-1200", "tag-1500"], "any"),
+    }
+    with Session(engine) as db:
+        for variant in ("indexed", "unindexed"):
+            if variant == "unindexed":
+                db.execute(text("DROP INDEX ix_note_tags_tag_id_note_id"))
+                db.commit()
+                db.close()
+                engine.dispose()
+            statement = tagged_note_ids(1, ["tag-0", "tag-1"]).compile(engine, compile_kwargs={"literal_binds": True})
+            with engine.connect() as conn:
+                plan = conn.execute(text(f"EXPLAIN QUERY PLAN {statement}")).all()
+            results[variant] = {"plan": [row[-1] for row in plan]}
+            for name, (names, match) in cases.items():
+                user_ids = iter(rng.choices(range(1, users + 1), k=iterations))
+                samples = timed(lambda: get_notes(db, next(user_ids), limit=50, tags=names, match=match), iterations)
+                results[variant][name] = summarize(samples)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=200000)
+    parser.add_argument("--tags-per-note", type=int, default=5)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.notes, args.tags_per_note, args.users, args.iterations), indent=2))
@@ -0,0 +1,45 @@
+"""GET /tags/ latency and DB queries with the tag list cache warm vs rebuilt per request.
+
+    python -m benchmarks.bench_tag_list [--tags 5000] [--requests 300]
+"""
+import argparse
+import asyncio
+import json
+from sqlalchemy import insert
+from main import app
+from models import Tag
+from services.tags import tag_list_cache
+from benchmarks.common import BenchDatabase, bench_client, QueryCounter, summarize, timed_async
+
+
+async def run(tags: int, requests: int):
+    database = BenchDatabase()
+    with database.engine.begin() as conn:
+        conn.execute(insert(Tag), [{"name": f"tag-{i}"} for i in range(tags)])
+    counter = QueryCounter(database.async_engine.sync_engine)
+    async with bench_client(app, database) as client:
+        async def fetch():
+            assert (await client.get("/tags/")).status_code == 200
+
+        async def fetch_uncached():
+            tag_list_cache.clear()
+            await fetch()
+
+        results = {}
+        for name, fn in (("uncached", fetch_uncached), ("cached", fetch)):
+            tag_list_cache.clear()
+            await fetch()
+            with counter.counting():
+                await fn()
+            queries = counter.count
+            results[name] = {"queries_per_request": queries, **summarize(await timed_async(fn, requests))}
+    results["cache"] = tag_list_cache.stats()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tags", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.tags, args.requests)), indent=2))
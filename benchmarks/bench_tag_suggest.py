@@ -0,0 +1,70 @@
+"""Tag suggestion latency at 100k tags, in the index and through GET /tags/suggest.
+
+    python -m benchmarks.bench_tag_suggest [--tags 100000] [--lookups 20000]
+
+Prefixes of 1-6 characters are drawn from existing tag names, so short
+prefixes exercise the memoized top-N path and longer ones the bisect scan.
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from main import app
+from models import Tag, NoteTags, Note
+from services.suggest import tag_suggest_index
+from benchmarks.common import BenchDatabase, bench_client, summarize, timed_async
+
+
+def _seed(database: BenchDatabase, tags: int, rng: random.Random):
+    names = set()
+    while len(names) < tags:
+        names.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 12))))
+    names = sorted(names)
+    with database.engine.begin() as conn:
+        conn.execute(insert(Tag), [{"name": name} for name in names])
+        conn.execute(insert(Note), [{"title": f"n{i}", "content": "", "user_id": 1} for i in range(2000)])
+        links = {(rng.randint(1, 2000), int(rng.paretovariate(1.2)) % tags + 1) for _ in range(50000)}
+        conn.execute(insert(NoteTags), [{"note_id": note_id, "tag_id": tag_id} for note_id, tag_id in links])
+    return names
+
+
+async def run(tags: int, lookups: int, requests: int):
+    rng = random.Random(13)
+    database = BenchDatabase()
+    names = _seed(database, tags, rng)
+    prefixes = [name[:rng.randint(1, 6)] for name in rng.choices(names, k=lookups)]
+
+    tag_suggest_index.clear()
+    started = time.perf_counter()
+    with Session(database.engine) as db:
+        tag_suggest_index.load(db)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    samples = []
+    for prefix in prefixes:
+        started = time.perf_counter()
+        tag_suggest_index.suggest(prefix, 10)
+        samples.append(time.perf_counter() - started)
+    results = {"tags": tags, "load_ms": load_ms, "index": summarize(samples)}
+
+    async with bench_client(app, database) as client:
+        it = iter(prefixes)
+
+        async def fetch():
+            assert (await client.get("/tags/suggest", params={"prefix": next(it), "limit": 10})).status_code == 200
+
+        results["endpoint"] = summarize(await timed_async(fetch, requests))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tags", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.tags, args.lookups, args.requests)), indent=2))
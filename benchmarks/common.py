@@ -0,0 +1,134 @@
+import atexit
+import os
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+import httpx
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from config import to_async_url
+from database import Base, get_db, get_async_db
+
+
+def remove_sqlite_files(path: str):
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+# The file is removed when the process exits (BenchDatabase removes its own
+# earlier, on dispose), so runs do not leave databases behind in /tmp.
+def temp_sqlite_url():
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="notes-bench-")
+    os.close(fd)
+    atexit.register(remove_sqlite_files, path)
+    return f"sqlite:///{path}"
+
+def make_engine(url: str):
+    if url.startswith("sqlite"):
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return create_engine(url)
+
+
+class BenchDatabase:
+    # Sync and async engines on the same database, wired into the app's
+    # get_db / get_async_db dependencies.
+    def __init__(self, url: str = None):
+        self.temporary = url is None
+        self.url = url or temp_sqlite_url()
+        self.engine = make_engine(self.url)
+        self.async_engine = create_async_engine(to_async_url(self.url))
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.AsyncSessionLocal = async_sessionmaker(autoflush=False, bind=self.async_engine)
+        Base.metadata.drop_all(bind=self.engine)
+        Base.metadata.create_all(bind=self.engine)
+
+    def install(self, app):
+        def override_get_db():
+            db = self.SessionLocal()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def override_get_async_db():
+            async with self.AsyncSessionLocal() as db:
+                yield db
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_async_db] = override_get_async_db
+
+    async def dispose(self):
+        await self.async_engine.dispose()
+        self.engine.dispose()
+        if self.temporary:
+            remove_sqlite_files(self.engine.url.database)
+
+
+@asynccontextmanager
+async def bench_client(app, database: BenchDatabase):
+    database.install(app)
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+    finally:
+        app.dependency_overrides.clear()
+        await database.dispose()
+
+async def register(client, username: str, password: str = "bench-password"):
+    response = await client.post("/api/auth/register", json={"name": username, "username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    @contextmanager
+    def counting(self):
+        self.count = 0
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        try:
+            yield self
+        finally:
+            event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def percentile(samples, pct: float):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+def timed(fn, iterations: int):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+async def timed_async(fn, iterations: int):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - started)
+    return samples
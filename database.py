@@ -1,9 +1,37 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
-from config import DATABASE_URL
-engine = create_engine(DATABASE_URL)
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+import config
+from config import DATABASE_URL, ASYNC_DATABASE_URL
+from monitoring import pool_stats, instrumented_pool_class, instrument_engine, instrument_queries, instrument_statement_shapes
+
+def pool_options(url: str, pool_class, stats):
+    # SQLite keeps SQLAlchemy's own pool choice (SingletonThreadPool for :memory:).
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": instrumented_pool_class(pool_class, stats),
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL, QueuePool, pool_stats["sync"]))
+instrument_engine(engine, pool_stats["sync"])
+instrument_queries(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options(ASYNC_DATABASE_URL, AsyncAdaptedQueuePool, pool_stats["async"]))
+instrument_engine(async_engine.sync_engine, pool_stats["async"])
+instrument_queries(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, bind=async_engine)
+if config.DEV_MODE:
+    instrument_statement_shapes(engine)
+    instrument_statement_shapes(async_engine.sync_engine)
 Base = declarative_base()
 
 def get_db():
@@ -11,4 +39,13 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# insert() with on_conflict_do_nothing / on_conflict_do_update for the
+# session's dialect.
+def dialect_insert(db):
+    return postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
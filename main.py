@@ -1,8 +1,15 @@
-from fastapi import FastAPI
-from routers import auth, notes, tags
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from routers import auth, notes, tags, internal
 from fastapi.middleware.cors import CORSMiddleware
 from services.notes import initialize_db
+from services.password_pool import PasswordPoolBusy, password_pool, dummy_hash_async
+from services.events import event_hub
+from services.refresh_tokens import refresh_token_sweeper
+from services.migrations import background_fixup_runner
 from database import get_db
+import config
+from monitoring import RequestContextMiddleware, MetricsMiddleware, RepeatedQueryMiddleware, request_metrics, render_pool_metrics, pool_stats
 
 app = FastAPI()
 
@@ -18,12 +25,41 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],  
 )
+if config.DEV_MODE:
+    app.add_middleware(RepeatedQueryMiddleware, threshold=config.QUERY_REPEAT_THRESHOLD)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestContextMiddleware)
 
 @app.on_event("startup")
 async def startup_event():
     db = next(get_db())
     initialize_db(db)
+    await dummy_hash_async()
+    await event_hub.start()
+    refresh_token_sweeper.start()
+    background_fixup_runner.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    password_pool.shutdown()
+    await event_hub.stop()
+    await refresh_token_sweeper.stop()
+    await background_fixup_runner.stop()
+
+@app.exception_handler(PasswordPoolBusy)
+async def password_pool_busy_handler(request: Request, exc: PasswordPoolBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servicio de autenticación saturado, intenta nuevamente"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body = request_metrics.render() + render_pool_metrics(pool_stats)
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(notes.router, prefix="/api/notes")
 app.include_router(tags.router, prefix="/tags", tags=["tags"])
+app.include_router(internal.router, prefix="/internal", include_in_schema=False)
@@ -1,13 +1,103 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, DateTime, Table
-from sqlalchemy.orm import relationship
+import base64
+import zlib
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, Text, DateTime, Float, Table, Index, DDL, event
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import relationship, query_expression
 from datetime import datetime, UTC
 from database import Base
+import config
+
+def utcnow():
+    return datetime.now(UTC)
+
+# Columns are TIMESTAMP WITHOUT TIME ZONE holding UTC. psycopg2 and SQLite
+# accept aware datetimes there, asyncpg rejects them, so binds are stored
+# as naive UTC.
+class UTCDateTime(TypeDecorator):
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(UTC).replace(tzinfo=None)
+        return value
+
+# Stored values that start with FORMAT_MARKER carry a format tag: "z" is
+# base64 zlib data, "r" is the raw text. Short values are stored as they are
+# unless they happen to start with the marker themselves.
+FORMAT_MARKER = "\x01"
+ZLIB_PREFIX = FORMAT_MARKER + "z"
+RAW_PREFIX = FORMAT_MARKER + "r"
+
+def compress_text(value: str, threshold: int = None, level: int = None) -> str:
+    if value is None:
+        return None
+    threshold = config.NOTE_COMPRESS_THRESHOLD_BYTES if threshold is None else threshold
+    raw = value.encode("utf-8")
+    if len(raw) <= threshold:
+        return RAW_PREFIX + value if value.startswith(FORMAT_MARKER) else value
+    level = config.NOTE_COMPRESS_LEVEL if level is None else level
+    packed = ZLIB_PREFIX + base64.b64encode(zlib.compress(raw, level)).decode("ascii")
+    # Oversized values always get a tag, so the backfill never picks them up again.
+    return packed if len(packed) < len(raw) else RAW_PREFIX + value
+
+def decompress_text(value: str) -> str:
+    if value is None or not value.startswith(FORMAT_MARKER):
+        return value
+    if value.startswith(ZLIB_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(ZLIB_PREFIX):])).decode("utf-8")
+    if value.startswith(RAW_PREFIX):
+        return value[len(RAW_PREFIX):]
+    return value
+
+def preview_text(value: str, length: int) -> str:
+    # First length characters of a stored value, inflating no more of a
+    # compressed one than those characters can take up.
+    if value is None:
+        return None
+    if value.startswith(ZLIB_PREFIX):
+        data = base64.b64decode(value[len(ZLIB_PREFIX):])
+        return zlib.decompressobj().decompress(data, length * 4).decode("utf-8", "ignore")[:length]
+    return decompress_text(value)[:length]
+
+class CompressedText(TypeDecorator):
+    # Text column holding compress_text() output; Python only ever sees the
+    # plain value. Comparisons bind plain text, since SQL on this column sees
+    # the stored form.
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+    def coerce_compared_value(self, op, value):
+        return Text()
+
+class TextPreview(TypeDecorator):
+    # Result type for SQL that returns either a plain prefix of notes.content
+    # or a whole stored value carrying the format marker.
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, length: int):
+        super().__init__()
+        self.length = length
+
+    def process_result_value(self, value, dialect):
+        return preview_text(value, self.length)
 
 class NoteTags(Base):
     __tablename__ = "note_tags"
 
     note_id = Column(Integer, ForeignKey("notes.id"), primary_key=True)
     tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True)
+
+    # The primary key leads with note_id; tag filters need tag_id first.
+    __table_args__ = (Index("ix_note_tags_tag_id_note_id", "tag_id", "note_id"),)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -15,8 +105,8 @@ class User(Base):
     name = Column(String)
     username = Column(String, unique=True, index=True)
     password = Column(String)
-    created_at = Column(DateTime, default=datetime.now(UTC))
-    updated_at = Column(DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
+    created_at = Column(UTCDateTime, default=utcnow)
+    updated_at = Column(UTCDateTime, default=utcnow, onupdate=utcnow)
 
 class Tag(Base):
     __tablename__ = "tags"
@@ -24,19 +114,112 @@ class Tag(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
     notes = relationship("Note", secondary="note_tags", back_populates="tags")
-    created_at = Column(DateTime, default=datetime.now(UTC))
-    updated_at = Column(DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
+    created_at = Column(UTCDateTime, default=utcnow)
+    updated_at = Column(UTCDateTime, default=utcnow, onupdate=utcnow)
 
 class Note(Base):
     __tablename__ = "notes"
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    content = Column(Text)
+    content = Column(CompressedText)
     user_id = Column(Integer, ForeignKey("users.id"))
     locked = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.now(UTC))
-    updated_at = Column(DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
+    created_at = Column(UTCDateTime, default=utcnow)
+    updated_at = Column(UTCDateTime, default=utcnow, onupdate=utcnow)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Position in the owner's change sequence; deleted notes stay behind as
+    # tombstones with deleted_at set so delta sync can report them.
+    change_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    deleted_at = Column(UTCDateTime, nullable=True)
+    # Content preview, filled only by queries that ask for one with with_expression().
+    snippet = query_expression()
 
     owner = relationship("User")
     tags = relationship("Tag", secondary="note_tags", back_populates="notes")
+
+    __table_args__ = (
+        Index("ix_notes_user_id_updated_at_id", "user_id", "updated_at", "id"),
+        Index("ix_notes_user_id_change_seq", "user_id", "change_seq"),
+    )
+    __mapper_args__ = {"version_id_col": version}
+
+# Per-user note counts for each tag, kept in step with note_tags by the notes
+# and tags services so facet reads never aggregate note_tags.
+class UserTagCount(Base):
+    __tablename__ = "user_tag_counts"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# Last change sequence number handed out per user.
+class UserChangeSeq(Base):
+    __tablename__ = "user_change_seqs"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+
+# One row (id 1) counting tag renames and deletes, the tag writes that change
+# how existing notes render. Note ETags include it instead of scanning tags.
+class TagVersion(Base):
+    __tablename__ = "tag_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+# Token buckets of services.rate_limit's database store. Times are epoch
+# seconds; full_at is when the bucket will have refilled completely, after
+# which the row can be dropped.
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+    full_at = Column(Float, nullable=False, index=True)
+
+# Rotating refresh tokens (services.refresh_tokens). Only the SHA-256 of a
+# token is stored. Tokens handed out by one login share a family_id; a token
+# that has been exchanged keeps its row, marked used, until it expires so that
+# presenting it again can be recognised as reuse.
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), unique=True, index=True, nullable=False)
+    family_id = Column(String(32), index=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    created_at = Column(UTCDateTime, default=utcnow)
+    expires_at = Column(UTCDateTime, nullable=False, index=True)
+    used_at = Column(UTCDateTime, nullable=True)
+    revoked_at = Column(UTCDateTime, nullable=True)
+
+class DataFixup(Base):
+    __tablename__ = "data_fixups"
+
+    name = Column(String, primary_key=True)
+    completed_at = Column(UTCDateTime, default=utcnow)
+
+# Full-text search structures live outside the ORM model: a tsvector column
+# with a GIN index on PostgreSQL and an FTS5 table on SQLite. Both are filled
+# by services.search.index_note, since notes.content may be stored compressed.
+event.listen(
+    Note.__table__, "after_create",
+    DDL("ALTER TABLE notes ADD COLUMN search_vector tsvector").execute_if(dialect="postgresql"),
+)
+event.listen(
+    Note.__table__, "after_create",
+    DDL("CREATE INDEX ix_notes_search_vector ON notes USING gin (search_vector)").execute_if(dialect="postgresql"),
+)
+event.listen(
+    Note.__table__, "after_create",
+    DDL(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts "
+        "USING fts5(title, content, user_id UNINDEXED, tokenize='unicode61')"
+    ).execute_if(dialect="sqlite"),
+)
+event.listen(
+    Note.__table__, "before_drop",
+    DDL("DROP TABLE IF EXISTS notes_fts").execute_if(dialect="sqlite"),
+)
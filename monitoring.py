@@ -0,0 +1,374 @@
+import contextvars
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+import config
+
+logger = logging.getLogger("notes.pool")
+query_logger = logging.getLogger("notes.queries")
+
+# ASGI scope of the request being served; FastAPI stores the matched route in
+# scope["route"] once routing has happened.
+current_request = contextvars.ContextVar("current_request", default=None)
+
+def current_route():
+    scope = current_request.get()
+    if scope is None:
+        return None
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path")
+
+
+class RequestContextMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = current_request.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request.reset(token)
+
+
+# Per-request SQL accounting: a [statements, seconds] pair that the cursor
+# events below add to while MetricsMiddleware is serving the request.
+current_queries = contextvars.ContextVar("current_queries", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{bound:g}", cumulative
+        yield "+Inf", self.count
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.db_seconds = 0.0
+        self.statuses = {}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class RequestMetrics:
+    # Routes are keyed by their template (/api/notes/{id}), never the raw
+    # path, so the number of series stays bounded.
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.in_flight = 0
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, route: str, status: int, seconds: float, queries: int, db_seconds: float):
+        with self._lock:
+            metrics = self._routes.get((method, route))
+            if metrics is None:
+                metrics = self._routes[(method, route)] = RouteMetrics()
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(queries)
+            metrics.db_seconds += db_seconds
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._routes = {}
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = [
+                "# HELP notes_http_requests_in_flight Requests currently being served.",
+                "# TYPE notes_http_requests_in_flight gauge",
+                f"notes_http_requests_in_flight {self.in_flight}",
+                "# HELP notes_http_requests_total Requests served, by route and status.",
+                "# TYPE notes_http_requests_total counter",
+            ]
+            for (method, route), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f"notes_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+            for name, attribute, help_text in (
+                ("notes_http_request_duration_seconds", "latency", "Request latency."),
+                ("notes_http_request_db_queries", "queries", "SQL statements issued per request."),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), metrics in routes:
+                    histogram = getattr(metrics, attribute)
+                    for bound, count in histogram.samples():
+                        lines.append(f"{name}_bucket{_labels(method=method, route=route, le=bound)} {count}")
+                    lines.append(f"{name}_sum{_labels(method=method, route=route)} {histogram.sum:g}")
+                    lines.append(f"{name}_count{_labels(method=method, route=route)} {histogram.count}")
+            lines += [
+                "# HELP notes_http_request_db_seconds_total Time spent in SQL statements, by route.",
+                "# TYPE notes_http_request_db_seconds_total counter",
+            ]
+            for (method, route), metrics in routes:
+                lines.append(f"notes_http_request_db_seconds_total{_labels(method=method, route=route)} {metrics.db_seconds:g}")
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics(config.METRICS_ENABLED)
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: RequestMetrics = None):
+        self.app = app
+        self.metrics = metrics or request_metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        queries = [0, 0.0]
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        token = current_queries.set(queries)
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.in_flight -= 1
+            current_queries.reset(token)
+            route = scope.get("route")
+            self.metrics.observe(
+                scope["method"], getattr(route, "path", "<unmatched>"), status, elapsed, queries[0], queries[1],
+            )
+
+def instrument_queries(engine):
+    # The start time rides on the statement's execution context, so statements
+    # running at the same time on other connections do not mix.
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and current_queries.get() is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is not None:
+            queries = current_queries.get()
+            queries[0] += 1
+            queries[1] += time.perf_counter() - started
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+@contextmanager
+def query_budget(engine, max_statements: int):
+    # Fails the block when it issues more than max_statements statements on
+    # engine (sync or async). Yields the list of statements seen so far.
+    engine = getattr(engine, "sync_engine", engine)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    if len(statements) > max_statements:
+        listing = "\n".join(f"  {i}. {statement}" for i, statement in enumerate(statements, 1))
+        raise QueryBudgetExceeded(f"{len(statements)} statements issued, budget is {max_statements}:\n{listing}")
+
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|\$\d+|(?<!:):\w+|\?")
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+
+def statement_shape(statement: str) -> str:
+    # Same statement whatever its parameters, including expanded IN lists.
+    shape = _PLACEHOLDER.sub("?", " ".join(statement.split()))
+    return _PLACEHOLDER_LIST.sub("?", shape)
+
+# Statement shape -> executions in the request being served, while
+# RepeatedQueryMiddleware is installed.
+current_statement_shapes = contextvars.ContextVar("current_statement_shapes", default=None)
+
+class RepeatedQueryMiddleware:
+    # Development aid: warns when one request runs the same statement shape
+    # more than threshold times, which is how N+1 query patterns look.
+    def __init__(self, app, threshold: int):
+        self.app = app
+        self.threshold = threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        shapes = {}
+        token = current_statement_shapes.set(shapes)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_statement_shapes.reset(token)
+            route = scope.get("route")
+            for shape, count in shapes.items():
+                if count > self.threshold:
+                    query_logger.warning(
+                        "event=db.repeated_statement method=%s route=%s count=%d statement=%s",
+                        scope["method"], getattr(route, "path", scope.get("path")), count, shape,
+                    )
+
+def instrument_statement_shapes(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_shape(conn, cursor, statement, parameters, context, executemany):
+        shapes = current_statement_shapes.get()
+        if shapes is not None:
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + 1
+
+
+def render_pool_metrics(stats_by_name):
+    lines = [
+        "# HELP notes_db_pool_checked_out Connections currently checked out.",
+        "# TYPE notes_db_pool_checked_out gauge",
+    ]
+    snapshots = [stats.snapshot() for stats in stats_by_name.values() if stats.pool is not None]
+    for snapshot in snapshots:
+        if snapshot["checked_out"] is not None:
+            lines.append(f"notes_db_pool_checked_out{_labels(pool=snapshot['pool'])} {snapshot['checked_out']}")
+    for name, key, help_text in (
+        ("notes_db_pool_checkouts_total", "checkouts", "Connection checkouts."),
+        ("notes_db_pool_checkout_timeouts_total", "checkout_timeouts", "Checkouts that timed out waiting for a connection."),
+    ):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_labels(pool=snapshot['pool'])} {snapshot[key]}" for snapshot in snapshots]
+    return "\n".join(lines) + "\n"
+
+
+class PoolStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            slow = seconds * 1000 >= config.DB_SLOW_CHECKOUT_MS
+            if slow:
+                self.slow_checkouts += 1
+        if slow:
+            logger.warning(
+                "event=db.pool.slow_checkout pool=%s route=%s wait_ms=%.1f checked_out=%s overflow=%s",
+                self.name, current_route(), seconds * 1000, self._checked_out(), self._overflow(),
+            )
+
+    def record_timeout(self, seconds: float):
+        with self._lock:
+            self.timeouts += 1
+        logger.error(
+            "event=db.pool.checkout_timeout pool=%s route=%s wait_ms=%.1f checked_out=%s overflow=%s",
+            self.name, current_route(), seconds * 1000, self._checked_out(), self._overflow(),
+        )
+
+    def _checked_out(self):
+        return self.pool.checkedout() if hasattr(self.pool, "checkedout") else None
+
+    def _overflow(self):
+        # QueuePool counts from -pool_size until the base pool is full.
+        return max(self.pool.overflow(), 0) if hasattr(self.pool, "overflow") else None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pool": self.name,
+                "size": self.pool.size() if hasattr(self.pool, "size") else None,
+                "checked_out": self._checked_out(),
+                "overflow": self._overflow(),
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "checkout_timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "checkout_wait_total_ms": self.wait_total * 1000,
+                "checkout_wait_max_ms": self.wait_max * 1000,
+            }
+
+
+class _TimedCheckoutMixin:
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_timeout(time.perf_counter() - started)
+            raise
+        self.stats.record_wait(time.perf_counter() - started)
+        return connection
+
+def instrumented_pool_class(pool_class, stats: PoolStats):
+    return type(f"Instrumented{pool_class.__name__}", (_TimedCheckoutMixin, pool_class), {"stats": stats})
+
+def instrument_engine(engine, stats: PoolStats):
+    stats.pool = engine.pool
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checkouts += 1
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        stats.checkins += 1
+
+    @event.listens_for(engine, "engine_disposed")
+    def _on_disposed(disposed_engine):
+        stats.pool = disposed_engine.pool
+
+    return stats
+
+pool_stats = {"sync": PoolStats("sync"), "async": PoolStats("async")}
@@ -1,40 +1,63 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from services.auth import create_access_token, hash_password, authenticate_user
-from schemas import UserCreate, UserResponse, UserLogin
-from database import get_db
-from models import User
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.auth import create_access_token, register_user_async, authenticate_user_async
+from services.refresh_tokens import issue_refresh_token_async, rotate_refresh_token_async, revoke_refresh_token_async
+from schemas import UserCreate, UserResponse, UserLogin, RefreshRequest
+from services.rate_limit import auth_limiter, client_ip, LOGIN_BY_IP, LOGIN_BY_USERNAME, REGISTER_BY_IP
+from database import get_async_db
 from datetime import timedelta
+import config
 
 router = APIRouter()
 
+def token_response(username: str, refresh_token: str):
+    access_token = create_access_token({"sub": username}, timedelta(minutes=config.ACCESS_TOKEN_EXPIRE_MINUTES))
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": config.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
 @router.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    existing_user = db.query(User).filter(User.username == user.username).first()
-    if existing_user:
+async def register(user: UserCreate, request: Request, db: AsyncSession = Depends(get_async_db)):
+    await auth_limiter.check_async((REGISTER_BY_IP, client_ip(request)))
+    try:
+        new_user = await register_user_async(db, user)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed_password = hash_password(user.password)
-    new_user = User(
-        name=user.name, 
-        username=user.username, 
-        password=hashed_password
-        )
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    access_token = create_access_token({"sub": new_user.username}, timedelta(minutes=60))
+    user_id, username, name = new_user.id, new_user.username, new_user.name
+    refresh_token = await issue_refresh_token_async(db, user_id)
     return {
-        "id": new_user.id,
-        "username": new_user.username,
-        "name": new_user.name,
-        "access_token": access_token,
-        "token_type": "bearer"
+        "id": user_id,
+        "username": username,
+        "name": name,
+        **token_response(username, refresh_token),
     }
 
 @router.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = authenticate_user(db, user.username, user.password)
+async def login(user: UserLogin, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Limits run before any bcrypt work: per client first, then per account
+    # so one address cannot lock out a user on its own budget alone.
+    await auth_limiter.check_async((LOGIN_BY_IP, client_ip(request)), (LOGIN_BY_USERNAME, user.username.casefold()))
+    db_user = await authenticate_user_async(db, user.username, user.password)
     if not db_user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
-    access_token = create_access_token({"sub": db_user.username}, timedelta(minutes=60))
-    return {"access_token": access_token, "token_type": "bearer"}
+    username = db_user.username
+    refresh_token = await issue_refresh_token_async(db, db_user.id)
+    return token_response(username, refresh_token)
+
+# Trades a refresh token for a new access token and a new refresh token; the
+# old one stops working. No password check, so no bcrypt and no rate limit.
+@router.post("/refresh")
+async def refresh(body: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    try:
+        username, refresh_token = await rotate_refresh_token_async(db, body.refresh_token)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return token_response(username, refresh_token)
+
+@router.post("/logout", status_code=204)
+async def logout(body: RefreshRequest, db: AsyncSession = Depends(get_async_db)):
+    await revoke_refresh_token_async(db, body.refresh_token)
+    return Response(status_code=204)
@@ -0,0 +1,41 @@
+import secrets
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+import config
+from monitoring import pool_stats
+from services.auth import principal_cache
+from services.tags import tag_list_cache
+from services.events import event_hub
+from services.rate_limit import auth_limiter
+from services.refresh_tokens import refresh_token_sweeper
+
+# Operational state (pool, caches, connections, sessions) for operators only:
+# every request must carry INTERNAL_TOKEN in X-Internal-Token. Without a
+# configured token the endpoints do not exist.
+def require_internal_token(x_internal_token: Optional[str] = Header(None)):
+    if not config.INTERNAL_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_internal_token is None or not secrets.compare_digest(x_internal_token, config.INTERNAL_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+router = APIRouter(dependencies=[Depends(require_internal_token)])
+
+@router.get("/pool")
+async def pool_status():
+    return {name: stats.snapshot() for name, stats in pool_stats.items()}
+
+@router.get("/caches")
+async def cache_status():
+    return {
+        "tag_list": tag_list_cache.stats(),
+        "principals": principal_cache.stats(),
+        "rate_limits": auth_limiter.stats(),
+    }
+
+@router.get("/events")
+async def event_status():
+    return event_hub.stats()
+
+@router.get("/sessions")
+async def session_status():
+    return refresh_token_sweeper.stats()
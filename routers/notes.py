@@ -1,46 +1,153 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from services.notes import create_note, get_notes, get_note_by_id, update_note, delete_note
-from schemas import NoteCreate, NoteResponse
-from database import get_db
-from services.auth import get_current_user
+import asyncio
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.notes import (
+    create_note_async, get_notes_page_async, get_note_by_id_async, update_note_async,
+    delete_note_async, search_notes_async
+)
+from services.facets import get_tag_facets_async
+from services.changes import get_changes_async
+from services.events import event_hub, Subscription, RESYNC
+from services.etags import notes_list_etag_async, note_etag_async, not_modified, etag_headers
+from schemas import NoteCreate, NoteResponse, NotePage, NoteChanges, SearchPage, TagFacet
+from database import get_async_db
+from services.auth import get_current_user_async
 
 router = APIRouter()
 
-@router.post("/")
-def add_note(note: NoteCreate, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
+# Note bodies arrive already serialized; returning a Response skips FastAPI's
+# response_model re-validation, which stays declared for the OpenAPI schema.
+def json_response(body: bytes, headers: dict = None):
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.post("/", response_model=NoteResponse)
+async def add_note(note: NoteCreate, db: AsyncSession = Depends(get_async_db), current_user: dict = Depends(get_current_user_async)):
     user_id = current_user["id"]
-    return create_note(db, note, user_id)
+    return json_response(await create_note_async(db, note, user_id))
 
-@router.get("/", response_model=List[NoteResponse])
-def list_notes(
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+@router.get("/", response_model=NotePage)
+async def list_notes(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    tags: Optional[str] = Query(None, description="Comma-separated tag names"),
+    match: Literal["all", "any"] = "all",
+    fields: Optional[str] = Query(None, description="Comma-separated note fields to return"),
+    snippet: Optional[int] = Query(None, ge=1, le=1000, description="Add the first N characters of content as snippet"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user_async)
 ):
     user_id = current_user["id"]
-    notes = get_notes(db, user_id)
-    return [{"id": note.id, "title": note.title, "content": note.content, "createdAt": note.created_at, "updatedAt": note.updated_at} for note in notes]
+    tag_names = tags.split(",") if tags else []
+    etag = await notes_list_etag_async(db, user_id, limit, cursor, tags, match, fields, snippet)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    try:
+        body = await get_notes_page_async(db, user_id, limit, cursor, tag_names, match, fields, snippet)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return json_response(body, etag_headers(etag))
+
+@router.get("/search", response_model=SearchPage)
+async def search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user_async)
+):
+    user_id = current_user["id"]
+    results = await search_notes_async(db, user_id, q, limit + 1, offset)
+    next_offset = offset + limit if len(results) > limit else None
+    return {"items": results[:limit], "nextOffset": next_offset}
+
+@router.get("/changes", response_model=NoteChanges)
+async def list_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user_async)
+):
+    try:
+        body = await get_changes_async(db, current_user["id"], since, limit)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return json_response(body)
+
+async def _send_events(websocket: WebSocket, subscription: Subscription):
+    while True:
+        message = await subscription.get()
+        await websocket.send_json(message)
+        if message is RESYNC:
+            # The client fell behind; it catches up through /changes.
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+# Browsers cannot set headers on a WebSocket handshake, so the access token
+# comes in the query string.
+@router.websocket("/stream")
+async def stream(websocket: WebSocket, token: str = Query(...), db: AsyncSession = Depends(get_async_db)):
+    try:
+        current_user = await get_current_user_async(token, db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    finally:
+        # An idle stream must not keep a pooled connection checked out.
+        await db.close()
+    await websocket.accept()
+    subscription = await event_hub.subscribe(current_user["id"])
+    tasks = [
+        asyncio.create_task(_send_events(websocket, subscription)),
+        asyncio.create_task(_wait_for_disconnect(websocket)),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        event_hub.unsubscribe(subscription)
+
+@router.get("/facets", response_model=List[TagFacet])
+async def tag_facets(db: AsyncSession = Depends(get_async_db), current_user: dict = Depends(get_current_user_async)):
+    return await get_tag_facets_async(db, current_user["id"])
 
-@router.get("/{id}")
-def get_note(
-    id: int, db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+@router.get("/{id}", response_model=NoteResponse)
+async def get_note(
+    id: int, request: Request, db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user_async)
 ):
     user_id = current_user["id"]
-    note = get_note_by_id(db, id, user_id)
-    return {"id": note.id, "title": note.title, "content": note.content, "createdAt": note.created_at, "updatedAt": note.updated_at}
+    etag = await note_etag_async(db, id, user_id)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return json_response(await get_note_by_id_async(db, id, user_id), etag_headers(etag))
 
-@router.put("/{id}")
-def modify_note(id: int, note: NoteCreate, db: Session = Depends(get_db),
-                current_user: dict = Depends(get_current_user)
-                ):
+@router.put("/{id}", response_model=NoteResponse)
+async def modify_note(id: int, note: NoteCreate, if_match: Optional[str] = Header(None),
+                      db: AsyncSession = Depends(get_async_db),
+                      current_user: dict = Depends(get_current_user_async)
+                      ):
     user_id = current_user["id"]
-    return update_note(db, id, user_id, note)
+    body, etag = await update_note_async(db, id, user_id, note, if_match)
+    return json_response(body, etag_headers(etag))
 
 @router.delete("/{id}")
-def remove_note(id: int, db: Session = Depends(get_db),
-                current_user: dict = Depends(get_current_user)
-                ):
+async def remove_note(id: int, if_match: Optional[str] = Header(None),
+                      db: AsyncSession = Depends(get_async_db),
+                      current_user: dict = Depends(get_current_user_async)
+                      ):
     user_id = current_user["id"]
-    return delete_note(db, id, user_id)
\ No newline at end of file
+    return await delete_note_async(db, id, user_id, if_match)
@@ -1,30 +1,46 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from services.tags import create_tag, get_tags, get_tag_by_id, update_tag, delete_tag
-from schemas import TagCreate, Tag
-from database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.tags import create_tag_async, get_tag_list_async, get_tag_by_id_async, update_tag_async, delete_tag_async
+from services.etags import not_modified, etag_headers
+from services.suggest import suggest_tags_async
+from schemas import TagCreate, Tag, TagSuggestion
+import config
+from database import get_async_db
 
 router = APIRouter()
 
 @router.post("/", response_model=Tag)
-def add_tag(tag: TagCreate, db: Session = Depends(get_db)):
-    return create_tag(db, tag)
+async def add_tag(tag: TagCreate, db: AsyncSession = Depends(get_async_db)):
+    return await create_tag_async(db, tag)
 
 @router.get("/", response_model=List[Tag])
-def list_tags(db: Session = Depends(get_db)):
-    return get_tags(db)
+async def list_tags(request: Request, db: AsyncSession = Depends(get_async_db)):
+    # The session only checks out a connection if the cached list is stale.
+    body, etag = await get_tag_list_async(db)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    return Response(content=body, media_type="application/json", headers=etag_headers(etag))
+
+@router.get("/suggest", response_model=List[TagSuggestion])
+async def suggest(
+    prefix: str = Query("", max_length=100),
+    limit: int = Query(10, ge=1, le=config.TAG_SUGGEST_MAX_LIMIT),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await suggest_tags_async(db, prefix, limit)
 
 @router.get("/{id}", response_model=Tag)
-def get_tag(id: int, db: Session = Depends(get_db)):
-    return get_tag_by_id(db, id)
+async def get_tag(id: int, db: AsyncSession = Depends(get_async_db)):
+    return await get_tag_by_id_async(db, id)
 
 @router.put("/{id}", response_model=Tag)
-def modify_tag(id: int, tag: TagCreate, db: Session = Depends(get_db)):
-    return update_tag(db, id, tag)
+async def modify_tag(id: int, tag: TagCreate, db: AsyncSession = Depends(get_async_db)):
+    return await update_tag_async(db, id, tag)
 
 @router.delete("/{id}")
-def remove_tag(id: int, db: Session = Depends(get_db)):
-    if delete_tag(db, id):
+async def remove_tag(id: int, db: AsyncSession = Depends(get_async_db)):
+    if await delete_tag_async(db, id):
         return {"detail": "Tag deleted successfully"}
     raise HTTPException(status_code=404, detail="Tag not found")
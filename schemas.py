@@ -1,5 +1,5 @@
-import datetime
-from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field, AliasChoices, field_validator
 from typing import Optional, List
 
 class UserCreate(BaseModel):
@@ -23,20 +23,50 @@ class NoteCreate(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+def tag_names(tags):
+    return [tag if isinstance(tag, str) else tag.name for tag in tags]
+
 class NoteResponse(NoteCreate):
     id: int
     title: str
     content: str
-    createdAt: datetime
-    updatedAt: datetime
+    createdAt: datetime = Field(validation_alias=AliasChoices("createdAt", "created_at"))
+    updatedAt: datetime = Field(validation_alias=AliasChoices("updatedAt", "updated_at"))
 
-    class Config:
-        orm_mode = True
-        arbitrary_types_allowed = True
+    model_config = ConfigDict(from_attributes=True)
+
+    @field_validator("tags", mode="before")
+    @classmethod
+    def tag_names(cls, tags):
+        return tag_names(tags)
+
+class NotePage(BaseModel):
+    items: List[NoteResponse]
+    nextCursor: Optional[str] = None
+
+class NoteChanges(BaseModel):
+    items: List[NoteResponse]
+    deleted: List[int]
+    cursor: str
+    hasMore: bool
+
+class SearchResult(BaseModel):
+    id: int
+    title: str
+    snippet: str
+    rank: float
+
+class SearchPage(BaseModel):
+    items: List[SearchResult]
+    nextOffset: Optional[int] = None
 
 class UserLogin(BaseModel):
     username: str
     password: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class TagBase(BaseModel):
     name: str
 
@@ -47,4 +77,9 @@ class Tag(TagBase):
     id: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+class TagSuggestion(Tag):
+    noteCount: int
+
+class TagFacet(Tag):
+    count: int
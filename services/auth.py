@@ -1,14 +1,19 @@
+import threading
+import time
+from collections import OrderedDict
 from fastapi import Depends, HTTPException, Security
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta, UTC
+from sqlalchemy import event, select
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import User
-from database import get_db
+from database import get_db, get_async_db
 
 import config
 from schemas import UserCreate
+from .password_pool import hash_password, verify_password, hash_password_async, verify_password_async, dummy_hash, dummy_hash_async
 
 
 def register_user(db: Session, user_data: UserCreate):
@@ -29,13 +34,22 @@ def register_user(db: Session, user_data: UserCreate):
 
     return db_user
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+async def register_user_async(db: AsyncSession, user_data: UserCreate):
+    if await db.scalar(select(User.id).where(User.username == user_data.username)):
+        raise ValueError("Username already registered")
+
+    hashed_password = await hash_password_async(user_data.password)
+    db_user = User(
+        username=user_data.username,
+        password=hashed_password,
+        name=user_data.name
+    )
 
-def hash_password(password: str):
-    return pwd_context.hash(password)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return db_user
 
 def create_access_token(data: dict, expires_delta: timedelta):
     to_encode = data.copy()
@@ -45,13 +59,96 @@ def create_access_token(data: dict, expires_delta: timedelta):
 
 def authenticate_user(db: Session, username: str, password: str):
     user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.password):
+    if not user:
+        verify_password(password, dummy_hash())
+        return None
+    if not verify_password(password, user.password):
+        return None
+    return user
+
+async def authenticate_user_async(db: AsyncSession, username: str, password: str):
+    user = await db.scalar(select(User).where(User.username == username))
+    if not user:
+        await verify_password_async(password, await dummy_hash_async())
+        return None
+    if not await verify_password_async(password, user.password):
         return None
     return user
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
-def get_current_user(token: str = Security(oauth2_scheme), db: Session = Depends(get_db)):
+
+class PrincipalCache:
+    def __init__(self, ttl_seconds: int, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.time():
+                self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return dict(principal)
+
+    def put(self, token: str, principal: dict, token_exp=None):
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        if expires_at <= time.time() or self.max_size <= 0:
+            return
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (expires_at, dict(principal))
+            self._tokens_by_user.setdefault(principal["id"], set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        user_id = entry[1]["id"]
+        tokens = self._tokens_by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user_id]
+
+principal_cache = PrincipalCache(config.PRINCIPAL_CACHE_TTL_SECONDS, config.PRINCIPAL_CACHE_MAX_SIZE)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_principal(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+def _decode_token(token: str):
     try:
         payload = jwt.decode(token, config.SECRET_KEY,
                             algorithms=[config.ALGORITHM])
@@ -61,13 +158,34 @@ def get_current_user(token: str = Security(oauth2_scheme), db: Session = Depends
     except JWTError:
         raise HTTPException(
             status_code=401, detail="No se pudo validar el token")
+    return username, payload.get("exp")
 
-    user = db.query(User).filter(User.username == username).first()
+def _cache_principal(token: str, user: User, exp):
     if user is None:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
 
-    return {
+    principal = {
         "id": user.id,
         "name": user.name,
         "username": user.username
     }
+    principal_cache.put(token, principal, exp)
+    return principal
+
+def get_current_user(token: str = Security(oauth2_scheme), db: Session = Depends(get_db)):
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    username, exp = _decode_token(token)
+    user = db.query(User).filter(User.username == username).first()
+    return _cache_principal(token, user, exp)
+
+async def get_current_user_async(token: str = Security(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    username, exp = _decode_token(token)
+    user = await db.scalar(select(User).where(User.username == username))
+    return _cache_principal(token, user, exp)
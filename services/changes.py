@@ -0,0 +1,101 @@
+import base64
+import json
+from collections import Counter
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import TypeAdapter
+from models import Note, NoteTags, UserChangeSeq
+from schemas import NoteChanges
+from database import dialect_insert
+
+note_changes_adapter = TypeAdapter(NoteChanges)
+
+# Hands out the user's next change sequence number. The upsert locks the
+# user's counter row until the caller commits, so a user's sequence numbers
+# become visible in order and a cursor never skips an earlier, slower write.
+def next_change_seq(db: Session, user_id: int) -> int:
+    statement = (
+        dialect_insert(db)(UserChangeSeq)
+        .values(user_id=user_id, seq=1)
+        .on_conflict_do_update(index_elements=["user_id"], set_={"seq": UserChangeSeq.seq + 1})
+        .returning(UserChangeSeq.seq)
+    )
+    return db.execute(statement).scalar_one()
+
+# Gives every live note carrying tag_id a new change sequence number, so delta
+# sync picks up a tag rename or delete. One upsert advances each owner's
+# counter by their number of affected notes, locking the counters in user_id
+# order before the notes, as note writes do. updated_at is left alone: the
+# note's own fields did not change.
+def touch_tagged_notes(db: Session, tag_id: int):
+    rows = db.execute(
+        select(Note.id, Note.user_id)
+        .join(NoteTags, NoteTags.note_id == Note.id)
+        .where(NoteTags.tag_id == tag_id, Note.deleted_at.is_(None))
+        .order_by(Note.user_id, Note.id)
+    ).all()
+    if not rows:
+        return
+    counts = Counter(user_id for _, user_id in rows)
+    statement = dialect_insert(db)(UserChangeSeq).values([{"user_id": user_id, "seq": count} for user_id, count in counts.items()])
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id"], set_={"seq": UserChangeSeq.seq + statement.excluded.seq}
+    ).returning(UserChangeSeq.user_id, UserChangeSeq.seq)
+    last_seq = dict(db.execute(statement).all())
+    seq = {user_id: last_seq[user_id] - count for user_id, count in counts.items()}
+    changes = []
+    for note_id, user_id in rows:
+        seq[user_id] += 1
+        changes.append({"note_id": note_id, "note_seq": seq[user_id]})
+    notes = Note.__table__
+    db.execute(
+        update(notes)
+        .where(notes.c.id == bindparam("note_id"))
+        .values(change_seq=bindparam("note_seq"), updated_at=notes.c.updated_at),
+        changes,
+    )
+
+def current_change_seq(db: Session, user_id: int) -> int:
+    return db.scalar(select(UserChangeSeq.seq).where(UserChangeSeq.user_id == user_id)) or 0
+
+def encode_change_cursor(seq: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps(["seq", seq]).encode()).decode().rstrip("=")
+
+def decode_change_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        kind, seq = json.loads(raw)
+        if kind != "seq":
+            raise ValueError
+        return int(seq)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+# Notes created, updated or deleted after `since`, oldest change first. Reads
+# only the (user_id, change_seq) index range past the cursor.
+def get_changes(db: Session, user_id: int, since: str = None, limit: int = 500):
+    after = decode_change_cursor(since) if since else 0
+    notes = (
+        db.query(Note)
+        .options(selectinload(Note.tags))
+        .filter(Note.user_id == user_id, Note.change_seq > after)
+        .order_by(Note.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(notes) > limit
+    notes = notes[:limit]
+    last_seq = notes[-1].change_seq if notes else after
+    return {
+        "items": [note for note in notes if note.deleted_at is None],
+        "deleted": [note.id for note in notes if note.deleted_at is not None],
+        "cursor": encode_change_cursor(last_seq),
+        "hasMore": has_more,
+    }
+
+def render_changes(changes: dict) -> bytes:
+    return note_changes_adapter.dump_json(note_changes_adapter.validate_python(changes, from_attributes=True))
+
+async def get_changes_async(db: AsyncSession, user_id: int, since: str = None, limit: int = 500):
+    return await db.run_sync(lambda session: render_changes(get_changes(session, user_id, since, limit)))
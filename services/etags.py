@@ -0,0 +1,79 @@
+import hashlib
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Note, TagVersion, UserChangeSeq
+from database import dialect_insert
+
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts) -> str:
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, so W/"x" matches "x".
+    candidates = (candidate.strip().removeprefix("W/") for candidate in if_none_match.split(","))
+    return etag in candidates
+
+# If-Match uses strong comparison: weak validators never match.
+def if_match_satisfied(if_match: str, etag: str) -> bool:
+    if if_match.strip() == "*":
+        return True
+    return etag in (candidate.strip() for candidate in if_match.split(","))
+
+def not_modified(request: Request, etag: str):
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    return None
+
+def etag_headers(etag: str):
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+# Called in the same transaction as a tag rename or delete.
+def bump_tag_version(db: Session):
+    statement = (
+        dialect_insert(db)(TagVersion)
+        .values(id=1, version=1)
+        .on_conflict_do_update(index_elements=["id"], set_={"version": TagVersion.version + 1})
+    )
+    db.execute(statement)
+
+def tag_version():
+    return select(TagVersion.version).where(TagVersion.id == 1).scalar_subquery()
+
+# Every note write bumps the owner's change sequence, so it stands in for
+# the whole list. Note responses embed tag names, so the tag version is
+# included too. Both are primary-key reads.
+def notes_list_etag(db: Session, user_id: int, *params):
+    seq = select(UserChangeSeq.seq).where(UserChangeSeq.user_id == user_id).scalar_subquery()
+    state = db.execute(select(seq, tag_version())).one()
+    return make_etag("notes", user_id, tuple(state), params)
+
+def current_tag_version(db: Session) -> int:
+    return db.scalar(select(tag_version())) or 0
+
+# A note renders its tag names, so its ETag covers the tag version as well as
+# the note's own version.
+def note_version_etag(note_id: int, version: int, tag_version: int):
+    return make_etag("note", note_id, version, tag_version or 0)
+
+def note_etag(db: Session, note_id: int, user_id: int):
+    row = db.execute(
+        select(Note.version, tag_version())
+        .where(Note.id == note_id, Note.user_id == user_id, Note.deleted_at.is_(None))
+    ).first()
+    if row is None:
+        return None
+    return note_version_etag(note_id, *row)
+
+async def notes_list_etag_async(db: AsyncSession, user_id: int, *params):
+    return await db.run_sync(notes_list_etag, user_id, *params)
+
+async def note_etag_async(db: AsyncSession, note_id: int, user_id: int):
+    return await db.run_sync(note_etag, note_id, user_id)
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import logging
+import threading
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import config
+
+logger = logging.getLogger("notes.events")
+
+RESYNC = {"type": "resync"}
+
+
+class Subscription:
+    # One stream connection. When its queue fills up the backlog is replaced
+    # by a single resync message and nothing more is queued, so a slow client
+    # costs at most queue_size messages and is told to catch up through
+    # /api/notes/changes instead.
+    def __init__(self, user_id: int, queue_size: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def offer(self, message: dict) -> bool:
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            return False
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InMemoryBackend:
+    # Single-process fan-out: whatever is published is delivered right back.
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, message: dict):
+        self._deliver(message)
+
+    async def stop(self):
+        pass
+
+
+class PostgresBackend:
+    # Shares events between workers with LISTEN/NOTIFY. Every worker, the
+    # publisher included, receives each message through its listener.
+    def __init__(self, dsn: str, channel: str):
+        self.dsn = dsn
+        self.channel = channel
+        self._outbox = None
+        self._listener = None
+        self._publisher = None
+        self._sender = None
+
+    async def start(self, deliver):
+        import asyncpg
+
+        self._deliver = deliver
+        self._outbox = asyncio.Queue()
+        self._listener = await asyncpg.connect(self.dsn)
+        await self._listener.add_listener(self.channel, self._on_notify)
+        self._publisher = await asyncpg.connect(self.dsn)
+        self._sender = asyncio.create_task(self._send())
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._deliver(json.loads(payload))
+
+    def publish(self, message: dict):
+        self._outbox.put_nowait(json.dumps(message))
+
+    async def _send(self):
+        # One connection runs one statement at a time, so NOTIFYs go out in order.
+        while True:
+            payload = await self._outbox.get()
+            try:
+                await self._publisher.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            except Exception:
+                logger.exception("event=events.publish_failed channel=%s", self.channel)
+
+    async def stop(self):
+        if self._sender is not None:
+            self._sender.cancel()
+        for connection in (self._listener, self._publisher):
+            if connection is not None:
+                await connection.close()
+
+
+def make_backend(name: str):
+    if name == "memory":
+        return InMemoryBackend()
+    if name == "postgres":
+        return PostgresBackend(config.DATABASE_URL, config.EVENT_CHANNEL)
+    raise ValueError(f"Unknown event backend: {name}")
+
+
+class EventHub:
+    # Messages carry a userId; those without one (tag changes) go to every
+    # connection. publish() may be called from any thread, and delivery always
+    # happens on the event loop that owns the subscriptions.
+    def __init__(self, backend, queue_size: int):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self._subscriptions = {}
+        self._loop = None
+        self._start_lock = threading.Lock()
+
+    async def start(self):
+        with self._start_lock:
+            if self._loop is not None and not self._loop.is_closed():
+                return
+            # Subscriptions of a loop that has gone away cannot be served.
+            self._subscriptions = {}
+            self._loop = asyncio.get_running_loop()
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        if self._loop is None:
+            return
+        await self.backend.stop()
+        self._loop = None
+        self._subscriptions.clear()
+
+    async def subscribe(self, user_id: int) -> Subscription:
+        await self.start()
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+
+    def publish(self, messages):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        messages = list(messages)
+        if not messages:
+            return
+        self.published += len(messages)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._publish(messages)
+        else:
+            loop.call_soon_threadsafe(self._publish, messages)
+
+    def _publish(self, messages):
+        for message in messages:
+            self.backend.publish(message)
+
+    def _deliver(self, message: dict):
+        user_id = message.get("userId")
+        if user_id is None:
+            targets = [s for subscriptions in self._subscriptions.values() for s in subscriptions]
+        else:
+            targets = list(self._subscriptions.get(user_id, ()))
+        for subscription in targets:
+            already_overflowed = subscription.overflowed
+            if subscription.offer(message):
+                self.delivered += 1
+            elif not already_overflowed:
+                self.overflows += 1
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "users": len(self._subscriptions),
+            "connections": sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+event_hub = EventHub(make_backend(config.EVENT_BACKEND), config.EVENT_QUEUE_SIZE)
+
+# Events are recorded on the session and only published once it commits.
+def record_event(db: Session, message: dict):
+    db.info.setdefault("events", []).append(message)
+
+@event.listens_for(Session, "after_commit")
+def _publish_events(session):
+    messages = session.info.pop("events", None)
+    if messages:
+        event_hub.publish(messages)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_events(session):
+    session.info.pop("events", None)
@@ -0,0 +1,86 @@
+import argparse
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Note, NoteTags, Tag, UserTagCount
+from database import dialect_insert
+
+# Counter maintenance runs inside the caller's transaction, next to the
+# note_tags writes it mirrors, so both commit or roll back together.
+def adjust_tag_counts(db: Session, user_id: int, added=(), removed=()):
+    if added:
+        statement = dialect_insert(db)(UserTagCount).values(
+            [{"user_id": user_id, "tag_id": tag_id, "count": 1} for tag_id in added]
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["user_id", "tag_id"],
+            set_={"count": UserTagCount.count + 1},
+        ))
+    if removed:
+        db.execute(
+            update(UserTagCount)
+            .where(UserTagCount.user_id == user_id, UserTagCount.tag_id.in_(removed))
+            .values(count=UserTagCount.count - 1),
+            execution_options={"synchronize_session": False},
+        )
+
+def drop_tag_counts(db: Session, tag_id: int):
+    db.execute(delete(UserTagCount).where(UserTagCount.tag_id == tag_id), execution_options={"synchronize_session": False})
+
+def get_tag_facets(db: Session, user_id: int):
+    rows = db.execute(
+        select(Tag.id, Tag.name, UserTagCount.count)
+        .join(UserTagCount, UserTagCount.tag_id == Tag.id)
+        .where(UserTagCount.user_id == user_id, UserTagCount.count > 0)
+        .order_by(UserTagCount.count.desc(), Tag.name)
+    ).all()
+    return [{"id": tag_id, "name": name, "count": count} for tag_id, name, count in rows]
+
+async def get_tag_facets_async(db: AsyncSession, user_id: int):
+    return await db.run_sync(get_tag_facets, user_id)
+
+
+# Rebuilds user_tag_counts from note_tags. Returns the drifted entries as
+# (user_id, tag_id, stored, actual); with apply=False nothing is written.
+# Notes written while it runs can show up as drift, so run it off-peak.
+def reconcile_tag_counts(db: Session, apply: bool = True):
+    actual = {
+        (user_id, tag_id): count
+        for user_id, tag_id, count in db.execute(
+            select(Note.user_id, NoteTags.tag_id, func.count())
+            .join(Note, Note.id == NoteTags.note_id)
+            .where(Note.user_id.is_not(None), Note.deleted_at.is_(None))
+            .group_by(Note.user_id, NoteTags.tag_id)
+        )
+    }
+    stored = {
+        (user_id, tag_id): count
+        for user_id, tag_id, count in db.execute(select(UserTagCount.user_id, UserTagCount.tag_id, UserTagCount.count))
+    }
+    drift = sorted(
+        (user_id, tag_id, stored.get((user_id, tag_id), 0), actual.get((user_id, tag_id), 0))
+        for user_id, tag_id in actual.keys() | stored.keys()
+        if stored.get((user_id, tag_id), 0) != actual.get((user_id, tag_id), 0)
+    )
+    if apply:
+        db.execute(delete(UserTagCount).where(UserTagCount.count <= 0))
+        for user_id, tag_id, _, count in drift:
+            if count:
+                db.merge(UserTagCount(user_id=user_id, tag_id=tag_id, count=count))
+            else:
+                db.execute(delete(UserTagCount).where(UserTagCount.user_id == user_id, UserTagCount.tag_id == tag_id))
+        db.commit()
+    return drift
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild user_tag_counts from note_tags and report drift.")
+    parser.add_argument("--dry-run", action="store_true", help="report drift without fixing it")
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        drift = reconcile_tag_counts(db, apply=not args.dry_run)
+    for user_id, tag_id, stored, actual in drift:
+        print(f"user_id={user_id} tag_id={tag_id} stored={stored} actual={actual}")
+    print(f"{len(drift)} drifted counters{' (not fixed)' if args.dry_run else ' fixed'}")
@@ -1,9 +1,165 @@
-from sqlalchemy.orm import Session
-from models import Note
-
-def update_null_locked_fields(db: Session):
-    notes = db.query(Note).filter(Note.locked.is_(None)).all()
-    for note in notes:
-        note.locked = False
-    db.commit()
-
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+import anyio
+from sqlalchemy import select, update, text, func, bindparam, cast, LargeBinary
+from sqlalchemy.orm import Session
+from models import Note, DataFixup, FORMAT_MARKER
+from database import SessionLocal
+import config
+
+logger = logging.getLogger("notes.migrations")
+
+# Arbitrary application-wide keys for pg_try_advisory_lock, one per registry
+# so the background runner never makes startup skip its own fixups.
+FIXUP_LOCK_KEY = 581_204_117
+BACKGROUND_FIXUP_LOCK_KEY = 581_204_118
+
+# name -> fn(db, batch_size) returning the number of rows handled in one batch.
+# Each call must be set-based and touch at most batch_size rows; the runner
+# commits after every batch and stops once a batch comes back short.
+# fixups run at startup, before the worker serves requests; background_fixups
+# run afterwards while requests are being served, so they must be safe against
+# concurrent writes.
+fixups = {}
+background_fixups = {}
+
+def data_fixup(name: str, background: bool = False):
+    def register(fn):
+        (background_fixups if background else fixups)[name] = fn
+        return fn
+    return register
+
+@data_fixup("notes_locked_not_null")
+def update_null_locked_fields(db: Session, batch_size: int):
+    batch = select(Note.id).where(Note.locked.is_(None)).limit(batch_size).scalar_subquery()
+    result = db.execute(
+        update(Note).where(Note.id.in_(batch)).values(locked=False),
+        execution_options={"synchronize_session": False},
+    )
+    return result.rowcount
+
+def _byte_length(db: Session, column):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.octet_length(column)
+    return func.length(cast(column, LargeBinary))
+
+# Content written before compression existed is still plain text. Each batch
+# reads rows over the threshold (in UTF-8 bytes, like the threshold itself)
+# that carry no format tag and writes them back through Note.content's type,
+# which compresses (or tags) them, so converted rows drop out of the next
+# batch. Runs in the background: a row is only rewritten if its version is
+# still the one read, so a concurrent edit is never overwritten, and that edit
+# has stored its own content compressed anyway. Versions and updated_at are
+# left alone: the text is unchanged.
+@data_fixup("notes_compress_content", background=True)
+def compress_note_content(db: Session, batch_size: int):
+    notes = Note.__table__
+    rows = db.execute(
+        select(notes.c.id, notes.c.content, notes.c.version)
+        .where(
+            _byte_length(db, notes.c.content) > config.NOTE_COMPRESS_THRESHOLD_BYTES,
+            func.substr(notes.c.content, 1, 1) != FORMAT_MARKER,
+        )
+        .order_by(notes.c.id)
+        .limit(batch_size)
+    ).all()
+    if rows:
+        db.execute(
+            update(notes)
+            .where(notes.c.id == bindparam("note_id"), notes.c.version == bindparam("note_version"))
+            .values(content=bindparam("note_content"), updated_at=notes.c.updated_at),
+            [{"note_id": note_id, "note_version": version, "note_content": content} for note_id, content, version in rows],
+        )
+    return len(rows)
+
+def pending_fixups(db: Session, registry: dict = None):
+    registry = fixups if registry is None else registry
+    completed = set(db.scalars(select(DataFixup.name)))
+    return [name for name in registry if name not in completed]
+
+@contextmanager
+def _advisory_lock(db: Session, key: int):
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        yield True
+        return
+    with bind.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar()
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+                conn.commit()
+
+def run_pending_fixups(db: Session, batch_size: int = None, background: bool = False,
+                       pause_seconds: float = 0.0, stop: threading.Event = None):
+    # With background=True, runs background_fixups instead, waiting
+    # pause_seconds between batches and giving up (unrecorded, to resume
+    # later) once stop is set.
+    registry, lock_key = (background_fixups, BACKGROUND_FIXUP_LOCK_KEY) if background else (fixups, FIXUP_LOCK_KEY)
+    batch_size = batch_size or config.DATA_FIXUP_BATCH_SIZE
+    stop = stop or threading.Event()
+    pending = pending_fixups(db, registry)
+    db.commit()
+    if not pending:
+        return []
+
+    applied = []
+    with _advisory_lock(db, lock_key) as acquired:
+        # Another worker holds the lock and is applying the same fixups.
+        if not acquired:
+            return []
+        for name in pending_fixups(db, registry):
+            while registry[name](db, batch_size) >= batch_size:
+                db.commit()
+                if stop.wait(pause_seconds):
+                    return applied
+            db.add(DataFixup(name=name))
+            db.commit()
+            applied.append(name)
+    return applied
+
+
+class BackgroundFixupRunner:
+    # Applies background_fixups once per process start, on a worker thread
+    # with its own session, after the app has started serving.
+    def __init__(self, session_factory, batch_size: int, pause_seconds: float):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.pause_seconds = pause_seconds
+        self.applied = []
+        self._stop = threading.Event()
+        self._task = None
+
+    def run(self):
+        with self.session_factory() as db:
+            self.applied += run_pending_fixups(
+                db, self.batch_size, background=True, pause_seconds=self.pause_seconds, stop=self._stop
+            )
+        return self.applied
+
+    async def _run(self):
+        try:
+            await anyio.to_thread.run_sync(self.run)
+        except Exception:
+            logger.exception("event=migrations.background_fixup_failed")
+
+    def start(self):
+        if self._task is None:
+            self._stop.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # The thread finishes its current batch and returns.
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+background_fixup_runner = BackgroundFixupRunner(
+    SessionLocal, config.DATA_FIXUP_BATCH_SIZE, config.DATA_FIXUP_PAUSE_SECONDS
+)
@@ -1,67 +1,288 @@
-from http.client import HTTPException
-from sqlalchemy.orm import Session
+import base64
+import json
+from functools import lru_cache
+from typing import List, Optional
+from fastapi import HTTPException
+from sqlalchemy import tuple_, select, func, case, type_coerce, Text
+from sqlalchemy.orm import Session, selectinload, load_only, with_expression
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from models import Note, NoteTags, Tag
-from schemas import NoteCreate
+from sqlalchemy.orm.exc import StaleDataError
+from models import Note, NoteTags, Tag, FORMAT_MARKER, TextPreview
+from pydantic import TypeAdapter, ConfigDict, create_model, field_validator
+from schemas import NoteCreate, NoteResponse, NotePage, tag_names
 from datetime import datetime, UTC
-from .migrations import update_null_locked_fields
+from .migrations import run_pending_fixups
+from .facets import adjust_tag_counts
+from .changes import next_change_seq
+from .events import record_event
+from .etags import note_version_etag, current_tag_version, if_match_satisfied
+from .search import index_note, unindex_note, search_notes
+from .tags import normalize_tag_names, resolve_tag_ids, set_note_tags
 
 def initialize_db(db: Session):
-    update_null_locked_fields(db)
+    run_pending_fixups(db)
+
+note_adapter = TypeAdapter(NoteResponse)
+note_page_adapter = TypeAdapter(NotePage)
+
+def note_to_response(note: Note) -> NoteResponse:
+    return note_adapter.validate_python(note, from_attributes=True)
+
+# Validates straight from ORM attributes and dumps JSON bytes in pydantic-core,
+# so routers can return the body without re-validation or json.dumps.
+def render_note(note: Note) -> bytes:
+    return note_adapter.dump_json(note_to_response(note))
+
+def render_note_page(notes, next_cursor: str = None) -> bytes:
+    page = note_page_adapter.validate_python({"items": notes, "nextCursor": next_cursor}, from_attributes=True)
+    return note_page_adapter.dump_json(page)
+
+# Note attribute behind each response field that ?fields= can select.
+NOTE_FIELDS = {
+    "title": Note.title, "content": Note.content, "locked": Note.locked, "tags": Note.tags,
+    "id": Note.id, "createdAt": Note.created_at, "updatedAt": Note.updated_at,
+}
+
+def parse_note_fields(fields: str):
+    names = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = names - NOTE_FIELDS.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not names:
+        raise ValueError("No fields requested")
+    return tuple(name for name in NOTE_FIELDS if name in names)
+
+@lru_cache(maxsize=256)
+def projected_page_adapter(fields: tuple, snippet: bool):
+    definitions = {name: (NoteResponse.model_fields[name].annotation, NoteResponse.model_fields[name]) for name in fields}
+    if snippet:
+        definitions["snippet"] = (Optional[str], None)
+    validators = {}
+    if "tags" in fields:
+        validators["tag_names"] = field_validator("tags", mode="before")(lambda cls, tags: tag_names(tags))
+    item = create_model("NoteFields", __config__=ConfigDict(from_attributes=True), __validators__=validators, **definitions)
+    return TypeAdapter(create_model("NoteFieldsPage", items=(List[item], ...), nextCursor=(Optional[str], None)))
+
+# Plain content is cut down in SQL. Stored values carrying the format marker
+# come back whole and TextPreview inflates just their first characters.
+def snippet_expression(length: int):
+    stored = type_coerce(Note.content, Text)
+    preview = case((func.substr(stored, 1, 1) == FORMAT_MARKER, stored), else_=func.substr(stored, 1, length))
+    return type_coerce(preview, TextPreview(length))
+
+# Loader options for a projected list: columns outside the projection are
+# deferred with raiseload, so they are never selected or lazily fetched.
+def projection_options(fields: tuple, snippet: int = None):
+    columns = [Note.id, Note.updated_at]
+    columns += [NOTE_FIELDS[name] for name in fields if name not in ("id", "updatedAt", "tags")]
+    options = [load_only(*columns, raiseload=True)]
+    if "tags" in fields:
+        options.append(selectinload(Note.tags))
+    if snippet:
+        options.append(with_expression(Note.snippet, snippet_expression(snippet)))
+    return options
+
+def render_projected_page(notes, next_cursor: str, fields: tuple, snippet: int = None) -> bytes:
+    adapter = projected_page_adapter(fields, bool(snippet))
+    return adapter.dump_json(adapter.validate_python({"items": notes, "nextCursor": next_cursor}, from_attributes=True))
+
+def note_event(kind: str, note: Note):
+    return {"type": f"note.{kind}", "userId": note.user_id, "id": note.id, "seq": note.change_seq, "version": note.version}
+
 def create_note(db: Session, note_data: NoteCreate, user_id: int):
     if note_data.locked is None:
         note_data.locked = False
-    note = Note(**note_data.model_dump(), user_id=user_id)
+    tag_names = normalize_tag_names(note_data.tags)
+    note = Note(**note_data.model_dump(exclude={"tags"}), user_id=user_id, change_seq=next_change_seq(db, user_id))
     db.add(note)
-    db.commit()
-    db.refresh(note)
-    for tag_name in note_data.tags:
-        tag = db.query(Tag).filter(Tag.name == tag_name).first()
-        if not tag:
-            tag = Tag(name=tag_name)
-            db.add(tag)
-            db.commit()
-            db.refresh(tag)
-        note_tag = NoteTags(note_id=note.id, tag_id=tag.id)
-        db.add(note_tag)
-    db.commit()
+    try:
+        db.flush()
+        tag_ids = resolve_tag_ids(db, tag_names)
+        added, _ = set_note_tags(db, note.id, tag_ids.values(), current_tag_ids=set())
+        adjust_tag_counts(db, user_id, added)
+        index_note(db, note)
+        record_event(db, note_event("created", note))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Error al crear la nota")
     return note
 
-def get_notes(db: Session, user_id: int):
-    notes = db.query(Note).filter(Note.user_id == user_id).all()
-    for note in notes:
-        note.tags = db.query(Tag).join(NoteTags).filter(NoteTags.note_id == note.id).all()
-    return notes
+def encode_cursor(note: Note) -> str:
+    raw = json.dumps([note.updated_at.isoformat(), note.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, note_id = json.loads(raw)
+        return datetime.fromisoformat(updated_at), int(note_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+# Ids of the user's notes carrying all (or any) of the named tags. The user
+# filter sits inside the grouped query so the planner can start from either
+# the user's notes or the (tag_id, note_id) index, whichever is smaller.
+def tagged_note_ids(user_id: int, tag_names, match: str = "all"):
+    query = (
+        select(NoteTags.note_id)
+        .join(Tag, Tag.id == NoteTags.tag_id)
+        .join(Note, Note.id == NoteTags.note_id)
+        .where(Tag.name.in_(tag_names), Note.user_id == user_id)
+        .group_by(NoteTags.note_id)
+    )
+    if match == "all":
+        query = query.having(func.count(NoteTags.tag_id) == len(tag_names))
+    return query
+
+def get_notes(db: Session, user_id: int, limit: int = None, after=None, tags=None, match: str = "all",
+              fields: tuple = None, snippet: int = None):
+    if fields is None and snippet is None:
+        options = [selectinload(Note.tags)]
+    else:
+        options = projection_options(fields or tuple(NOTE_FIELDS), snippet)
+    query = (
+        db.query(Note)
+        .options(*options)
+        .filter(Note.user_id == user_id, Note.deleted_at.is_(None))
+    )
+    if tags:
+        query = query.filter(Note.id.in_(tagged_note_ids(user_id, tags, match)))
+    if after is not None:
+        query = query.filter(tuple_(Note.updated_at, Note.id) < tuple_(*after))
+    query = query.order_by(Note.updated_at.desc(), Note.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+def get_notes_page(db: Session, user_id: int, limit: int, cursor: str = None, tags=None, match: str = "all",
+                   fields: tuple = None, snippet: int = None):
+    after = decode_cursor(cursor) if cursor else None
+    notes = get_notes(db, user_id, limit=limit + 1, after=after, tags=normalize_tag_names(tags or []), match=match,
+                      fields=fields, snippet=snippet)
+    next_cursor = encode_cursor(notes[limit - 1]) if len(notes) > limit else None
+    return notes[:limit], next_cursor
 
 def get_note_by_id(db: Session, note_id: int, user_id: int):
-    note = db.query(Note).filter(Note.id == note_id, Note.user_id == user_id).with_for_update().first()
+    note = (
+        db.query(Note)
+        .options(selectinload(Note.tags))
+        .filter(Note.id == note_id, Note.user_id == user_id, Note.deleted_at.is_(None))
+        .first()
+    )
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
-    note.tags = db.query(Tag).join(NoteTags).filter(NoteTags.note_id == note.id).all()
     return note
 
-def update_note(db: Session, note_id: int, user_id: int, note_data: NoteCreate):
-    note = db.query(Note).filter(Note.id == note_id, Note.user_id == user_id).with_for_update().first()
-    if not note:
-        raise HTTPException(status_code=404, detail="Note not found")
-    
-    note.title = note_data.title
-    note.content = note_data.content
-    note.locked = note_data.locked
-    note.updated_at = datetime.now(UTC)
+def _live_note(db: Session, note_id: int, user_id: int):
+    return db.query(Note).filter(Note.id == note_id, Note.user_id == user_id, Note.deleted_at.is_(None)).first()
 
-    try:
-        db.commit()
-    except IntegrityError:
+def _check_if_match(db: Session, note: Note, if_match: str):
+    if if_match is None:
+        return
+    if not if_match_satisfied(if_match, note_version_etag(note.id, note.version, current_tag_version(db))):
         db.rollback()
-        raise HTTPException(status_code=500, detail="Error al actualizar la nota")
+        raise HTTPException(status_code=412, detail="Note has been modified")
 
-    return note
+# Writes first take the owner's next change sequence number. That upsert
+# locks the user's counter row until commit, so writes to one user's notes
+# queue behind each other and the note read after it is the latest version.
+# The UPDATE or DELETE is still compare-and-swap on Note.version (the
+# mapper's version_id_col) as a guard: a miss raises StaleDataError, which is
+# a 412 with If-Match and otherwise a retry against the fresh row. Only an
+# If-Match mismatch makes a write fail.
+def update_note(db: Session, note_id: int, user_id: int, note_data: NoteCreate, if_match: str = None):
+    while True:
+        change_seq = next_change_seq(db, user_id)
+        note = _live_note(db, note_id, user_id)
+        if not note:
+            db.rollback()
+            raise HTTPException(status_code=404, detail="Note not found")
+        _check_if_match(db, note, if_match)
 
-def delete_note(db: Session, note_id: int, user_id: int):
-    note = db.query(Note).filter(Note.id == note_id, Note.user_id == user_id).with_for_update().first()
-    if note:
-        db.delete(note)
-        db.commit()
+        tag_names = normalize_tag_names(note_data.tags)
+        note.title = note_data.title
+        note.content = note_data.content
+        note.locked = note_data.locked
+        note.updated_at = datetime.now(UTC)
+        note.change_seq = change_seq
+
+        try:
+            # The versioned UPDATE goes first so a losing writer stops before
+            # touching note_tags.
+            db.flush()
+            tag_ids = resolve_tag_ids(db, tag_names)
+            added, removed = set_note_tags(db, note.id, tag_ids.values())
+            adjust_tag_counts(db, user_id, added, removed)
+            index_note(db, note)
+            record_event(db, note_event("updated", note))
+            db.commit()
+        except StaleDataError:
+            db.rollback()
+            if if_match is not None:
+                raise HTTPException(status_code=412, detail="Note has been modified")
+            continue
+        except IntegrityError:
+            db.rollback()
+            raise HTTPException(status_code=500, detail="Error al actualizar la nota")
+        return note
+
+# Deleting leaves a tombstone: the row keeps its id and takes a new change
+# sequence number so delta sync can report it, while its tags, facet counts
+# and search entry go away as before.
+def delete_note(db: Session, note_id: int, user_id: int, if_match: str = None):
+    while True:
+        change_seq = next_change_seq(db, user_id)
+        note = _live_note(db, note_id, user_id)
+        if not note:
+            db.rollback()
+            return False
+        _check_if_match(db, note, if_match)
+        tag_ids = {tag.id for tag in note.tags}
+        note.deleted_at = note.updated_at = datetime.now(UTC)
+        note.change_seq = change_seq
+        try:
+            db.flush()
+            set_note_tags(db, note.id, (), current_tag_ids=tag_ids)
+            adjust_tag_counts(db, user_id, removed=tag_ids)
+            unindex_note(db, note.id)
+            record_event(db, note_event("deleted", note))
+            db.commit()
+        except StaleDataError:
+            db.rollback()
+            if if_match is not None:
+                raise HTTPException(status_code=412, detail="Note has been modified")
+            continue
         return True
-    return False
+
+
+# Async versions run the functions above on the AsyncSession's connection via
+# run_sync, and serialize inside the same greenlet so lazy loads stay legal.
+
+async def create_note_async(db: AsyncSession, note_data: NoteCreate, user_id: int):
+    return await db.run_sync(lambda session: render_note(create_note(session, note_data, user_id)))
+
+async def get_notes_page_async(db: AsyncSession, user_id: int, limit: int, cursor: str = None, tags=None, match: str = "all",
+                               fields: str = None, snippet: int = None):
+    if fields is None and snippet is None:
+        return await db.run_sync(lambda session: render_note_page(*get_notes_page(session, user_id, limit, cursor, tags, match)))
+    fields = parse_note_fields(fields) if fields is not None else tuple(NOTE_FIELDS)
+    return await db.run_sync(lambda session: render_projected_page(
+        *get_notes_page(session, user_id, limit, cursor, tags, match, fields, snippet), fields, snippet
+    ))
+
+async def get_note_by_id_async(db: AsyncSession, note_id: int, user_id: int):
+    return await db.run_sync(lambda session: render_note(get_note_by_id(session, note_id, user_id)))
+
+def _render_with_etag(db: Session, note: Note):
+    return render_note(note), note_version_etag(note.id, note.version, current_tag_version(db))
+
+async def update_note_async(db: AsyncSession, note_id: int, user_id: int, note_data: NoteCreate, if_match: str = None):
+    return await db.run_sync(lambda session: _render_with_etag(session, update_note(session, note_id, user_id, note_data, if_match)))
+
+async def delete_note_async(db: AsyncSession, note_id: int, user_id: int, if_match: str = None):
+    return await db.run_sync(delete_note, note_id, user_id, if_match)
+
+async def search_notes_async(db: AsyncSession, user_id: int, q: str, limit: int, offset: int = 0):
+    return await db.run_sync(search_notes, user_id, q, limit, offset)
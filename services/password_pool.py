@@ -0,0 +1,113 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import anyio
+from passlib.context import CryptContext
+import config
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _hash(password: str):
+    return pwd_context.hash(password)
+
+def _verify(plain_password: str, hashed_password: str):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordPool:
+    # Runs bcrypt in worker processes so it never holds the GIL or the request
+    # threadpool for long. At most workers + queue_depth jobs may be in flight;
+    # anything beyond that is rejected immediately with PasswordPoolBusy.
+    # With workers == 0 jobs run inline in the caller, still subject to the limit.
+    def __init__(self, workers: int, queue_depth: int):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy("Password hashing capacity exhausted")
+
+    def submit(self, fn, *args):
+        self._acquire()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def run(self, fn, *args):
+        if self.workers <= 0:
+            self._acquire()
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        if self.workers <= 0:
+            self._acquire()
+            try:
+                return await anyio.to_thread.run_sync(fn, *args)
+            finally:
+                self._slots.release()
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+password_pool = PasswordPool(config.BCRYPT_POOL_WORKERS, config.BCRYPT_POOL_QUEUE_DEPTH)
+
+def hash_password(password: str):
+    return password_pool.run(_hash, password)
+
+def verify_password(plain_password, hashed_password):
+    return password_pool.run(_verify, plain_password, hashed_password)
+
+async def hash_password_async(password: str):
+    return await password_pool.run_async(_hash, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await password_pool.run_async(_verify, plain_password, hashed_password)
+
+# Checked against when a login names an unknown user, so a failed login costs
+# one bcrypt verification either way and timing does not reveal which users
+# exist. Made once, through the pool like any other hash; the app warms it at
+# startup so no login has to wait for it.
+DUMMY_PASSWORD = "not a real password"
+_dummy_hash = None
+
+def dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(DUMMY_PASSWORD)
+    return _dummy_hash
+
+async def dummy_hash_async():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password_async(DUMMY_PASSWORD)
+    return _dummy_hash
@@ -0,0 +1,185 @@
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict
+import anyio
+from fastapi import HTTPException, Request
+from sqlalchemy import case, delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from models import RateLimitBucket
+import config
+
+# Database stores drop buckets that have refilled completely (and so behave
+# like absent ones) every this many takes.
+PRUNE_EVERY = 1000
+PRUNE_BATCH_SIZE = 1000
+
+
+class RateLimit:
+    def __init__(self, name: str, capacity: int, per_minute: float):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = per_minute / 60
+
+
+class MemoryBucketStore:
+    # One (tokens, updated_at) pair per key, at most max_keys of them; the
+    # least recently used key is evicted first and starts over with a full
+    # bucket if it comes back.
+    blocking = False
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * refill_per_second)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / refill_per_second
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class DatabaseBucketStore:
+    # Buckets shared by every worker through the rate_limit_buckets table. A
+    # take is one upsert that only succeeds while a token is available.
+    blocking = True
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._takes = 0
+
+    def _insert(self):
+        return postgresql.insert if self.engine.dialect.name == "postgresql" else sqlite.insert
+
+    def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = time.time()
+        table = RateLimitBucket.__table__
+        grown = table.c.tokens + (now - table.c.updated_at) * refill_per_second
+        refilled = case((grown > capacity, capacity), else_=grown)
+        statement = self._insert()(table).values(
+            key=key, tokens=capacity - 1, updated_at=now, full_at=now + 1 / refill_per_second,
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                "tokens": refilled - 1,
+                "updated_at": now,
+                "full_at": now + (capacity - refilled + 1) / refill_per_second,
+            },
+            where=refilled >= 1,
+        ).returning(table.c.key)
+        self._takes += 1
+        with self.engine.begin() as conn:
+            if self._takes % PRUNE_EVERY == 0:
+                self.prune(conn, now)
+            if conn.execute(statement).first() is not None:
+                return 0.0
+            tokens, updated_at = conn.execute(select(table.c.tokens, table.c.updated_at).where(table.c.key == key)).one()
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        return max((1 - tokens) / refill_per_second, 0.0)
+
+    def prune(self, conn, now: float):
+        table = RateLimitBucket.__table__
+        full = select(table.c.key).where(table.c.full_at < now).limit(PRUNE_BATCH_SIZE).scalar_subquery()
+        return conn.execute(delete(table).where(table.c.key.in_(full))).rowcount
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.execute(delete(RateLimitBucket.__table__))
+
+    def __len__(self):
+        return 0
+
+
+def make_store(name: str):
+    if name == "memory":
+        return MemoryBucketStore(config.RATE_LIMIT_MAX_KEYS)
+    if name == "database":
+        from database import engine
+        return DatabaseBucketStore(engine)
+    raise ValueError(f"Unknown rate limit backend: {name}")
+
+
+class RateLimiter:
+    def __init__(self, store, enabled: bool = True):
+        self.store = store
+        self.enabled = enabled
+        self.rejected = 0
+
+    def check(self, *checks):
+        # checks are (RateLimit, key) pairs; each takes a token in turn, so
+        # the first one that is exhausted stops the request.
+        if not self.enabled:
+            return
+        for limit, key in checks:
+            wait = self.store.take(f"{limit.name}:{key}", limit.capacity, limit.refill_per_second)
+            if wait > 0:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many attempts, try again later",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+
+    async def check_async(self, *checks):
+        if self.enabled and self.store.blocking:
+            await anyio.to_thread.run_sync(self.check, *checks)
+        else:
+            self.check(*checks)
+
+    def clear(self):
+        self.store.clear()
+        self.rejected = 0
+
+    def stats(self):
+        return {"backend": type(self.store).__name__, "keys": len(self.store), "rejected": self.rejected, "enabled": self.enabled}
+
+LOGIN_BY_USERNAME = RateLimit("login:user", config.LOGIN_USERNAME_BURST, config.LOGIN_USERNAME_PER_MINUTE)
+LOGIN_BY_IP = RateLimit("login:ip", config.LOGIN_IP_BURST, config.LOGIN_IP_PER_MINUTE)
+REGISTER_BY_IP = RateLimit("register:ip", config.REGISTER_IP_BURST, config.REGISTER_IP_PER_MINUTE)
+
+auth_limiter = RateLimiter(make_store(config.RATE_LIMIT_BACKEND), config.RATE_LIMIT_ENABLED)
+
+trusted_proxies = [ipaddress.ip_network(value, strict=False) for value in config.TRUSTED_PROXIES]
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+# Each proxy appends the address it received the request from, so
+# X-Forwarded-For is read from the right and the first entry not added by a
+# trusted proxy is the client. Entries further left came from the client
+# itself and are ignored.
+def client_ip(request: Request) -> str:
+    address = request.client.host if request.client else "unknown"
+    if not _is_trusted_proxy(address):
+        return address
+    hops = [hop.strip() for header in request.headers.getlist("x-forwarded-for") for hop in header.split(",")]
+    for hop in reversed(hops):
+        if not hop:
+            continue
+        if not _is_trusted_proxy(hop):
+            return hop
+        address = hop
+    return address
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import logging
+import secrets
+import uuid
+from datetime import datetime, timedelta, UTC
+import anyio
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import RefreshToken, User
+from database import SessionLocal
+import config
+
+logger = logging.getLogger("notes.auth")
+
+# A refresh token is 32 random bytes; the database only ever sees its SHA-256,
+# which is enough to look it up through a unique index without bcrypt.
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _add_token(db: Session, user_id: int, family_id: str, now: datetime) -> str:
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        token_hash=hash_token(token),
+        family_id=family_id,
+        user_id=user_id,
+        created_at=now,
+        expires_at=now + timedelta(days=config.REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+def issue_refresh_token(db: Session, user_id: int) -> str:
+    # Starts a new family: one per login.
+    token = _add_token(db, user_id, uuid.uuid4().hex, datetime.now(UTC))
+    db.commit()
+    return token
+
+def rotate_refresh_token(db: Session, token: str):
+    # Marks the presented token used and issues its successor in the same
+    # family. The conditional update is the only check, so of two requests
+    # racing with one token exactly one wins; the other is treated as reuse.
+    now = datetime.now(UTC)
+    token_hash = hash_token(token)
+    claimed = db.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.token_hash == token_hash,
+            RefreshToken.used_at.is_(None),
+            RefreshToken.revoked_at.is_(None),
+            RefreshToken.expires_at > now,
+        )
+        .values(used_at=now)
+        .returning(RefreshToken.user_id, RefreshToken.family_id),
+        execution_options={"synchronize_session": False},
+    ).first()
+    if claimed is None:
+        _detect_reuse(db, token_hash, now)
+        raise ValueError("Invalid refresh token")
+    username = db.scalar(select(User.username).where(User.id == claimed.user_id))
+    if username is None:
+        db.rollback()
+        raise ValueError("Invalid refresh token")
+    new_token = _add_token(db, claimed.user_id, claimed.family_id, now)
+    db.commit()
+    return username, new_token
+
+def _detect_reuse(db: Session, token_hash: str, now: datetime):
+    # A token that was already exchanged has most likely been copied; whoever
+    # holds its successor may be the attacker, so the whole family goes.
+    stale = db.execute(
+        select(RefreshToken.family_id, RefreshToken.user_id)
+        .where(RefreshToken.token_hash == token_hash, RefreshToken.used_at.is_not(None), RefreshToken.revoked_at.is_(None))
+    ).first()
+    if stale is None:
+        db.rollback()
+        return
+    revoked = _revoke_family(db, stale.family_id, now)
+    db.commit()
+    logger.warning("event=auth.refresh_reuse user_id=%s family=%s revoked=%s", stale.user_id, stale.family_id, revoked)
+
+def _revoke_family(db: Session, family_id: str, now: datetime) -> int:
+    return db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    # Logging out ends the session the token belongs to, including any
+    # successor that might already have been issued.
+    family_id = db.scalar(select(RefreshToken.family_id).where(RefreshToken.token_hash == hash_token(token)))
+    if family_id is None:
+        return False
+    _revoke_family(db, family_id, datetime.now(UTC))
+    db.commit()
+    return True
+
+def delete_expired_refresh_tokens(db: Session, batch_size: int, now: datetime = None) -> int:
+    # One batch; the sweeper commits after each and stops once one comes back short.
+    now = now or datetime.now(UTC)
+    batch = select(RefreshToken.id).where(RefreshToken.expires_at <= now).limit(batch_size).scalar_subquery()
+    return db.execute(
+        delete(RefreshToken).where(RefreshToken.id.in_(batch)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+async def issue_refresh_token_async(db: AsyncSession, user_id: int) -> str:
+    return await db.run_sync(issue_refresh_token, user_id)
+
+async def rotate_refresh_token_async(db: AsyncSession, token: str):
+    return await db.run_sync(rotate_refresh_token, token)
+
+async def revoke_refresh_token_async(db: AsyncSession, token: str) -> bool:
+    return await db.run_sync(revoke_refresh_token, token)
+
+
+class RefreshTokenSweeper:
+    # Deletes expired tokens in the background, batch by batch, so neither the
+    # refresh endpoint nor a single large DELETE has to do it. Runs on a worker
+    # thread with its own sessions.
+    def __init__(self, session_factory, interval_seconds: int, batch_size: int):
+        self.session_factory = session_factory
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.runs = 0
+        self.deleted = 0
+        self.last_run_at = None
+        self._task = None
+
+    def sweep(self) -> int:
+        deleted = 0
+        with self.session_factory() as db:
+            while True:
+                count = delete_expired_refresh_tokens(db, self.batch_size)
+                db.commit()
+                deleted += count
+                if count < self.batch_size:
+                    break
+        self.runs += 1
+        self.deleted += deleted
+        self.last_run_at = datetime.now(UTC).isoformat()
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await anyio.to_thread.run_sync(self.sweep)
+            except Exception:
+                logger.exception("event=auth.refresh_sweep_failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None and self.interval_seconds > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return {
+            "running": self._task is not None,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "last_run_at": self.last_run_at,
+        }
+
+refresh_token_sweeper = RefreshTokenSweeper(
+    SessionLocal, config.REFRESH_TOKEN_SWEEP_SECONDS, config.REFRESH_TOKEN_SWEEP_BATCH_SIZE
+)
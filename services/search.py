@@ -0,0 +1,109 @@
+import html
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from models import Note, FORMAT_MARKER, decompress_text
+
+# Matches are marked with two private-use characters, removed from the text
+# beforehand, so the text can be HTML-escaped before they become <mark> tags.
+MARK_START, MARK_STOP = "\ue000", "\ue001"
+PG_MARKS = f"chr({ord(MARK_START)}) || chr({ord(MARK_STOP)})"
+PG_SNIPPET_OPTIONS = f"StartSel={MARK_START}, StopSel={MARK_STOP}, MaxFragments=2, MaxWords=24, MinWords=8"
+
+# Stored content that starts with the format marker may be compressed, so its
+# snippet is built from the decompressed text in a second statement.
+PG_SEARCH_SQL = text(f"""
+    SELECT ranked.id, ranked.rank,
+           ts_headline('simple', translate(coalesce(notes.title, ''), {PG_MARKS}, ''), ranked.query,
+                       'StartSel={MARK_START}, StopSel={MARK_STOP}, HighlightAll=true') AS title,
+           CASE WHEN left(notes.content, 1) = chr({ord(FORMAT_MARKER)}) THEN NULL
+                ELSE ts_headline('simple', translate(coalesce(notes.content, ''), {PG_MARKS}, ''), ranked.query,
+                                 '{PG_SNIPPET_OPTIONS}')
+           END AS snippet,
+           CASE WHEN left(notes.content, 1) = chr({ord(FORMAT_MARKER)}) THEN notes.content END AS stored_content
+    FROM (
+        SELECT notes.id, query, ts_rank(notes.search_vector, query) AS rank
+        FROM notes, websearch_to_tsquery('simple', :q) AS query
+        WHERE notes.user_id = :user_id AND notes.deleted_at IS NULL AND notes.search_vector @@ query
+        ORDER BY rank DESC, notes.id DESC
+        LIMIT :limit OFFSET :offset
+    ) AS ranked
+    JOIN notes ON notes.id = ranked.id
+    ORDER BY ranked.rank DESC, ranked.id DESC
+""")
+
+PG_HEADLINE_SQL = text(f"""
+    SELECT ts_headline('simple', :content, websearch_to_tsquery('simple', :q), '{PG_SNIPPET_OPTIONS}')
+""")
+
+PG_INDEX_SQL = text("""
+    UPDATE notes SET search_vector =
+        setweight(to_tsvector('simple', :title), 'A') || setweight(to_tsvector('simple', :content), 'B')
+    WHERE id = :id
+""")
+
+# notes_fts holds the text with the mark characters already removed.
+SQLITE_SEARCH_SQL = text(f"""
+    SELECT notes_fts.rowid AS id, bm25(notes_fts, 10.0, 1.0) AS rank,
+           highlight(notes_fts, 0, char({ord(MARK_START)}), char({ord(MARK_STOP)})) AS title,
+           snippet(notes_fts, 1, char({ord(MARK_START)}), char({ord(MARK_STOP)}), '…', 24) AS snippet
+    FROM notes_fts
+    WHERE notes_fts MATCH :q AND notes_fts.user_id = :user_id
+    ORDER BY rank, notes_fts.rowid DESC
+    LIMIT :limit OFFSET :offset
+""")
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+def _unmarked(value: str) -> str:
+    return value.replace(MARK_START, "").replace(MARK_STOP, "")
+
+# Escapes the highlighted text, then turns the marks into <mark> tags.
+def _highlight_html(value: str) -> str:
+    return html.escape(value).replace(MARK_START, "<mark>").replace(MARK_STOP, "</mark>")
+
+def _fts5_query(q: str) -> str:
+    # Quote every term so user input is never parsed as FTS5 query syntax.
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+def index_note(db: Session, note: Note):
+    if _dialect(db) == "postgresql":
+        db.execute(PG_INDEX_SQL, {"id": note.id, "title": note.title or "", "content": note.content or ""})
+        return
+    if _dialect(db) != "sqlite":
+        return
+    db.execute(text("DELETE FROM notes_fts WHERE rowid = :id"), {"id": note.id})
+    db.execute(
+        text("INSERT INTO notes_fts (rowid, title, content, user_id) VALUES (:id, :title, :content, :user_id)"),
+        {"id": note.id, "title": _unmarked(note.title or ""), "content": _unmarked(note.content or ""), "user_id": note.user_id},
+    )
+
+def unindex_note(db: Session, note_id: int):
+    if _dialect(db) == "postgresql":
+        db.execute(text("UPDATE notes SET search_vector = NULL WHERE id = :id"), {"id": note_id})
+        return
+    if _dialect(db) != "sqlite":
+        return
+    db.execute(text("DELETE FROM notes_fts WHERE rowid = :id"), {"id": note_id})
+
+def search_notes(db: Session, user_id: int, q: str, limit: int, offset: int = 0):
+    if not q.strip():
+        return []
+    if _dialect(db) == "postgresql":
+        statement, query = PG_SEARCH_SQL, q
+    else:
+        statement, query = SQLITE_SEARCH_SQL, _fts5_query(q)
+    rows = db.execute(
+        statement, {"q": query, "user_id": user_id, "limit": limit, "offset": offset}
+    ).mappings().all()
+    return [
+        {"id": row["id"], "title": _highlight_html(row["title"]), "snippet": _highlight_html(_snippet(db, row, query)),
+         "rank": abs(row["rank"])}
+        for row in rows
+    ]
+
+def _snippet(db: Session, row, query: str):
+    stored = row.get("stored_content")
+    if stored is None:
+        return row["snippet"]
+    return db.execute(PG_HEADLINE_SQL, {"content": _unmarked(decompress_text(stored)), "q": query}).scalar()
@@ -0,0 +1,126 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Tag, NoteTags
+import config
+
+# Prefixes matching more tags than this keep their top results memoized until
+# a tag under them changes.
+MEMO_MIN_MATCHES = 256
+_PREFIX_END = chr(0x10FFFF)
+
+
+class TagSuggestIndex:
+    # Tags sorted by casefolded name, so a prefix is a contiguous slice found
+    # with bisect, plus per-tag note counts for ranking.
+    def __init__(self, max_limit: int, reload_seconds: int):
+        self.max_limit = max_limit
+        self.reload_seconds = reload_seconds
+        self._keys = []
+        self._tags = {}
+        self._memo = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_seconds
+
+    def load(self, db: Session):
+        rows = db.execute(
+            select(Tag.id, Tag.name, func.count(NoteTags.note_id))
+            .outerjoin(NoteTags, NoteTags.tag_id == Tag.id)
+            .group_by(Tag.id, Tag.name)
+        ).all()
+        tags = {tag_id: [name, name.casefold(), count] for tag_id, name, count in rows}
+        keys = sorted((key, tag_id) for tag_id, (_, key, _) in tags.items())
+        # Changes committed after the query above and applied before the swap
+        # are lost until the next reload.
+        with self._lock:
+            self._tags = tags
+            self._keys = keys
+            self._memo = {}
+            self._loaded_at = time.monotonic()
+
+    def suggest(self, prefix: str, limit: int):
+        key = prefix.casefold()
+        with self._lock:
+            low = bisect_left(self._keys, (key,))
+            high = bisect_left(self._keys, (key + _PREFIX_END,), low)
+            if high - low <= MEMO_MIN_MATCHES:
+                return self._top(low, high, limit)
+            top = self._memo.get(key)
+            if top is None:
+                top = self._memo[key] = self._top(low, high, self.max_limit)
+            return top[:limit]
+
+    def _top(self, low: int, high: int, limit: int):
+        best = heapq.nsmallest(
+            limit, (tag_id for _, tag_id in self._keys[low:high]),
+            key=lambda tag_id: (-self._tags[tag_id][2], self._tags[tag_id][1], tag_id),
+        )
+        return [{"id": tag_id, "name": self._tags[tag_id][0], "noteCount": self._tags[tag_id][2]} for tag_id in best]
+
+    # changes are ("saved", id, name), ("deleted", id) and ("usage", ids, delta)
+    # tuples recorded by services.tags and applied once their session commits.
+    def apply(self, changes):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for change in changes:
+                if change[0] == "saved":
+                    self._save(change[1], change[2])
+                elif change[0] == "deleted":
+                    self._remove(change[1])
+                elif change[0] == "usage":
+                    for tag_id in change[1]:
+                        tag = self._tags.get(tag_id)
+                        if tag is not None:
+                            tag[2] = max(tag[2] + change[2], 0)
+                            self._forget(tag[1])
+
+    def _save(self, tag_id: int, name: str):
+        count = self._remove(tag_id)
+        key = name.casefold()
+        self._tags[tag_id] = [name, key, count]
+        insort(self._keys, (key, tag_id))
+        self._forget(key)
+
+    def _remove(self, tag_id: int):
+        tag = self._tags.pop(tag_id, None)
+        if tag is None:
+            return 0
+        index = bisect_left(self._keys, (tag[1], tag_id))
+        if index < len(self._keys) and self._keys[index] == (tag[1], tag_id):
+            del self._keys[index]
+        self._forget(tag[1])
+        return tag[2]
+
+    def _forget(self, key: str):
+        for end in range(len(key) + 1):
+            self._memo.pop(key[:end], None)
+
+    def clear(self):
+        with self._lock:
+            self._keys = []
+            self._tags = {}
+            self._memo = {}
+            self._loaded_at = None
+
+    def __len__(self):
+        return len(self._tags)
+
+tag_suggest_index = TagSuggestIndex(config.TAG_SUGGEST_MAX_LIMIT, config.TAG_SUGGEST_RELOAD_SECONDS)
+
+def suggest_tags(db: Session, prefix: str, limit: int):
+    if tag_suggest_index.is_stale():
+        tag_suggest_index.load(db)
+    return tag_suggest_index.suggest(prefix, limit)
+
+async def suggest_tags_async(db: AsyncSession, prefix: str, limit: int):
+    if tag_suggest_index.is_stale():
+        await db.run_sync(tag_suggest_index.load)
+    return tag_suggest_index.suggest(prefix, limit)
@@ -1,11 +1,166 @@
-from http.client import HTTPException
+import threading
+import time
+from typing import List
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy import select, delete, insert, event
 from sqlalchemy.orm import Session
-from models import Tag
-from schemas import TagCreate
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Tag, NoteTags, utcnow
+from database import dialect_insert
+from schemas import TagCreate, Tag as TagSchema
+from services.etags import make_etag, bump_tag_version
+from services.suggest import tag_suggest_index
+from services.facets import drop_tag_counts
+from services.events import event_hub
+from services.changes import touch_tagged_notes
+import config
+
+tag_list_adapter = TypeAdapter(List[TagSchema])
+
+
+class TagListCache:
+    # The serialized GET /tags/ body. Writers bump the version after they
+    # commit; the next read rebuilds if the cached copy is older.
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+        self.max_rebuild_ms = 0.0
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            entry = self._entry
+            if entry is None or entry[0] != self.version or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def rebuild(self, db: Session):
+        started = time.perf_counter()
+        version = self.version
+        rows = db.execute(select(Tag.id, Tag.name).order_by(Tag.id)).all()
+        body = tag_list_adapter.dump_json(tag_list_adapter.validate_python(rows, from_attributes=True))
+        etag = make_etag("tags", body)
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.rebuilds += 1
+            self.last_rebuild_ms = elapsed
+            self.max_rebuild_ms = max(self.max_rebuild_ms, elapsed)
+            # A bump that landed during the query leaves this entry stale, so
+            # it is stored under the version read before the query.
+            self._entry = (version, time.monotonic() + self.ttl_seconds, body, etag)
+        return body, etag
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entry = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "rebuilds": self.rebuilds,
+                "last_rebuild_ms": self.last_rebuild_ms,
+                "max_rebuild_ms": self.max_rebuild_ms,
+                "size_bytes": len(self._entry[2]) if self._entry else 0,
+            }
+
+tag_list_cache = TagListCache(config.TAG_LIST_CACHE_TTL_SECONDS)
+
+# Tag writes are recorded on the session and applied to the in-process caches
+# only once that session commits; see TagSuggestIndex.apply for the format.
+def record_tag_changes(db: Session, *changes):
+    db.info.setdefault("tag_changes", []).extend(changes)
+
+def record_tag_usage(db: Session, added=(), removed=()):
+    if added:
+        record_tag_changes(db, ("usage", tuple(added), 1))
+    if removed:
+        record_tag_changes(db, ("usage", tuple(removed), -1))
+
+@event.listens_for(Session, "after_commit")
+def _apply_tag_changes(session):
+    changes = session.info.pop("tag_changes", None)
+    if not changes:
+        return
+    if any(change[0] != "usage" for change in changes):
+        tag_list_cache.invalidate()
+    tag_suggest_index.apply(changes)
+    # Tags are shared, so their events go to every stream connection.
+    event_hub.publish(
+        {"type": "tag.saved", "id": change[1], "name": change[2]} if change[0] == "saved" else {"type": "tag.deleted", "id": change[1]}
+        for change in changes if change[0] != "usage"
+    )
+
+@event.listens_for(Session, "after_rollback")
+def _forget_tag_changes(session):
+    session.info.pop("tag_changes", None)
+
+def normalize_tag_names(names):
+    return list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+
+# Returns {name: id}, creating missing tags with a single INSERT ... ON CONFLICT.
+# Ids are always read in the writing transaction: tags can be renamed by other
+# workers, so a remembered name -> id mapping could attach the wrong tag.
+def resolve_tag_ids(db: Session, names):
+    if not names:
+        return {}
+    ids = dict(db.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    missing = [name for name in names if name not in ids]
+    if missing:
+        now = utcnow()
+        statement = (
+            dialect_insert(db)(Tag)
+            .values([{"name": name, "created_at": now, "updated_at": now} for name in missing])
+            .on_conflict_do_nothing(index_elements=["name"])
+            .returning(Tag.name, Tag.id)
+        )
+        created = db.execute(statement).all()
+        record_tag_changes(db, *(("saved", tag_id, name) for name, tag_id in created))
+        ids.update(created)
+        missing = [name for name in names if name not in ids]
+    if missing:
+        # Inserted by a concurrent transaction between our SELECT and INSERT.
+        ids.update(db.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+    return ids
+
+def set_note_tags(db: Session, note_id: int, tag_ids, current_tag_ids=None):
+    if current_tag_ids is None:
+        current_tag_ids = set(db.scalars(select(NoteTags.tag_id).where(NoteTags.note_id == note_id)))
+    wanted = set(tag_ids)
+    removed = current_tag_ids - wanted
+    added = wanted - current_tag_ids
+    if removed:
+        db.execute(delete(NoteTags).where(NoteTags.note_id == note_id, NoteTags.tag_id.in_(removed)))
+    if added:
+        db.execute(insert(NoteTags), [{"note_id": note_id, "tag_id": tag_id} for tag_id in added])
+    record_tag_usage(db, added, removed)
+    return added, removed
+
+def tag_to_response(tag: Tag):
+    return {"id": tag.id, "name": tag.name}
 
 def create_tag(db: Session, tag_data: TagCreate):
     tag = Tag(**tag_data.dict())
     db.add(tag)
+    db.flush()
+    record_tag_changes(db, ("saved", tag.id, tag.name))
     db.commit()
     db.refresh(tag)
     return tag
@@ -13,6 +168,10 @@ def create_tag(db: Session, tag_data: TagCreate):
 def get_tags(db: Session):
     return db.query(Tag).all()
 
+# Returns (body, etag) for GET /tags/, querying only when the cache is stale.
+def get_tag_list(db: Session):
+    return tag_list_cache.get() or tag_list_cache.rebuild(db)
+
 def get_tag_by_id(db: Session, tag_id: int):
     tag = db.query(Tag).filter(Tag.id == tag_id).first()
     if not tag:
@@ -24,14 +183,41 @@ def update_tag(db: Session, tag_id: int, tag_data: TagCreate):
     if not tag:
         raise HTTPException(404, "Tag not found")
 
+    # Before the tag itself, so the notes' counters are locked first.
+    touch_tagged_notes(db, tag_id)
     tag.name = tag_data.name
+    bump_tag_version(db)
+    record_tag_changes(db, ("saved", tag.id, tag.name))
     db.commit()
     return tag
 
 def delete_tag(db: Session, tag_id: int):
     tag = db.query(Tag).filter(Tag.id == tag_id).first()
     if tag:
+        touch_tagged_notes(db, tag_id)
+        drop_tag_counts(db, tag_id)
         db.delete(tag)
+        bump_tag_version(db)
+        record_tag_changes(db, ("deleted", tag_id))
         db.commit()
         return True
     return False
+
+
+async def create_tag_async(db: AsyncSession, tag_data: TagCreate):
+    return await db.run_sync(lambda session: tag_to_response(create_tag(session, tag_data)))
+
+async def get_tags_async(db: AsyncSession):
+    return await db.run_sync(lambda session: [tag_to_response(tag) for tag in get_tags(session)])
+
+async def get_tag_list_async(db: AsyncSession):
+    return tag_list_cache.get() or await db.run_sync(tag_list_cache.rebuild)
+
+async def get_tag_by_id_async(db: AsyncSession, tag_id: int):
+    return await db.run_sync(lambda session: tag_to_response(get_tag_by_id(session, tag_id)))
+
+async def update_tag_async(db: AsyncSession, tag_id: int, tag_data: TagCreate):
+    return await db.run_sync(lambda session: tag_to_response(update_tag(session, tag_id, tag_data)))
+
+async def delete_tag_async(db: AsyncSession, tag_id: int):
+    return await db.run_sync(delete_tag, tag_id)
@@ -0,0 +1,9 @@
+import pytest
+from monitoring import query_budget as _query_budget
+
+
+# `with query_budget(engine, 3): ...` fails the test, listing the statements,
+# when the block issues more than three statements against engine.
+@pytest.fixture
+def query_budget():
+    return _query_budget
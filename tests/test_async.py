@@ -0,0 +1,301 @@
+import json
+import pytest
+import config
+import pytest_asyncio
+import httpx
+from datetime import timedelta
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+from main import app
+from database import Base, get_async_db
+from schemas import NoteCreate, UserCreate
+from services.auth import (
+    register_user_async,
+    authenticate_user_async,
+    get_current_user_async,
+    create_access_token,
+    principal_cache
+)
+from services.tags import tag_list_cache
+from services.suggest import tag_suggest_index
+from services.rate_limit import auth_limiter
+from services.notes import create_note_async, get_notes_page_async, get_note_by_id_async, update_note_async, delete_note_async
+
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite+aiosqlite://"
+
+@pytest_asyncio.fixture(scope="function")
+async def db():
+    engine = create_async_engine(SQLALCHEMY_TEST_DATABASE_URL, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    TestingSessionLocal = async_sessionmaker(autoflush=False, bind=engine)
+    async with TestingSessionLocal() as session:
+        yield session
+    await engine.dispose()
+
+@pytest_asyncio.fixture(scope="function")
+async def client():
+    engine = create_async_engine(SQLALCHEMY_TEST_DATABASE_URL, poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    TestingSessionLocal = async_sessionmaker(autoflush=False, bind=engine)
+
+    async def override_get_async_db():
+        async with TestingSessionLocal() as session:
+            yield session
+
+    previous_override = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    tag_list_cache.clear()
+    tag_suggest_index.clear()
+    auth_limiter.clear()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as test_client:
+        yield test_client
+    if previous_override is None:
+        app.dependency_overrides.pop(get_async_db, None)
+    else:
+        app.dependency_overrides[get_async_db] = previous_override
+    await engine.dispose()
+
+@pytest.mark.asyncio
+async def test_note_crud_async(db):
+    user_id = 1
+    created = json.loads(await create_note_async(db, NoteCreate(title="Async", content="Content", tags=["a"]), user_id))
+    assert created["tags"] == ["a"]
+
+    fetched = json.loads(await get_note_by_id_async(db, created["id"], user_id))
+    assert fetched["title"] == "Async"
+
+    body, etag = await update_note_async(db, created["id"], user_id, NoteCreate(title="Renamed", content="Content", tags=["b"]))
+    updated = json.loads(body)
+    assert etag.startswith('"')
+    assert updated["title"] == "Renamed"
+    assert updated["tags"] == ["b"]
+
+    page = json.loads(await get_notes_page_async(db, user_id, 10))
+    assert [item["id"] for item in page["items"]] == [created["id"]]
+    assert page["nextCursor"] is None
+
+    assert await delete_note_async(db, created["id"], user_id) is True
+
+@pytest.mark.asyncio
+async def test_register_and_authenticate_async(db):
+    principal_cache.clear()
+    user = await register_user_async(db, UserCreate(username="async", password="testpass123", name="Async User"))
+    with pytest.raises(ValueError):
+        await register_user_async(db, UserCreate(username="async", password="other", name="Other"))
+
+    assert (await authenticate_user_async(db, "async", "testpass123")).id == user.id
+    assert await authenticate_user_async(db, "async", "wrongpass") is None
+
+    token = create_access_token({"sub": "async"}, timedelta(minutes=5))
+    principal = await get_current_user_async(token, db)
+    assert principal == {"id": user.id, "name": "Async User", "username": "async"}
+
+@pytest.mark.asyncio
+async def test_notes_api_async(client):
+    response = await client.post("/api/auth/register", json={"name": "Api", "username": "api", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    response = await client.post("/api/notes/", json={"title": "Hello", "content": "World", "tags": ["x"]}, headers=headers)
+    assert response.status_code == 200
+    note_id = response.json()["id"]
+
+    response = await client.get("/api/notes/", headers=headers)
+    assert [item["id"] for item in response.json()["items"]] == [note_id]
+
+    response = await client.get("/tags/")
+    assert [tag["name"] for tag in response.json()] == ["x"]
+
+    response = await client.get("/api/notes/999", headers=headers)
+    assert response.status_code == 404
+
+@pytest.mark.asyncio
+async def test_conditional_get_returns_304(client):
+    response = await client.post("/api/auth/register", json={"name": "Etag", "username": "etag", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    note_id = (await client.post("/api/notes/", json={"title": "Hello", "content": "World"}, headers=headers)).json()["id"]
+
+    for path in ("/api/notes/", f"/api/notes/{note_id}", "/tags/"):
+        first = await client.get(path, headers=headers)
+        etag = first.headers["ETag"]
+        second = await client.get(path, headers={**headers, "If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.content == b""
+        assert second.headers["ETag"] == etag
+
+    list_etag = (await client.get("/api/notes/", headers=headers)).headers["ETag"]
+    note_etag = (await client.get(f"/api/notes/{note_id}", headers=headers)).headers["ETag"]
+    await client.put(f"/api/notes/{note_id}", json={"title": "Changed", "content": "World", "tags": ["new"]}, headers=headers)
+    assert (await client.get("/api/notes/", headers={**headers, "If-None-Match": list_etag})).status_code == 200
+    assert (await client.get(f"/api/notes/{note_id}", headers={**headers, "If-None-Match": note_etag})).status_code == 200
+
+    # Renaming a tag changes the rendered notes without touching them.
+    list_etag = (await client.get("/api/notes/", headers=headers)).headers["ETag"]
+    note_etag = (await client.get(f"/api/notes/{note_id}", headers=headers)).headers["ETag"]
+    tag_id = (await client.get("/tags/")).json()[0]["id"]
+    await client.put(f"/tags/{tag_id}", json={"name": "renamed"})
+    assert (await client.get("/api/notes/", headers={**headers, "If-None-Match": list_etag})).status_code == 200
+    response = await client.get(f"/api/notes/{note_id}", headers={**headers, "If-None-Match": note_etag})
+    assert response.status_code == 200
+    assert response.json()["tags"] == ["renamed"]
+    response = await client.put(f"/api/notes/{note_id}", json={"title": "Again", "content": "World", "tags": []},
+                                headers={**headers, "If-Match": response.headers["ETag"]})
+    assert response.status_code == 200
+
+@pytest.mark.asyncio
+async def test_tag_list_served_from_cache(client, monkeypatch):
+    monkeypatch.setattr(config, "INTERNAL_TOKEN", "ops-secret")
+    await client.post("/tags/", json={"name": "cached"})
+    first = await client.get("/tags/")
+    rebuilds = tag_list_cache.stats()["rebuilds"]
+    second = await client.get("/tags/")
+    assert second.json() == first.json() == [{"id": 1, "name": "cached"}]
+    assert tag_list_cache.stats()["rebuilds"] == rebuilds
+
+    await client.put("/tags/1", json={"name": "renamed"})
+    assert (await client.get("/tags/")).json() == [{"id": 1, "name": "renamed"}]
+
+    stats = (await client.get("/internal/caches", headers={"X-Internal-Token": "ops-secret"})).json()
+    assert stats["tag_list"]["hits"] >= 1
+    assert stats["tag_list"]["rebuilds"] == rebuilds + 1
+
+@pytest.mark.asyncio
+async def test_internal_endpoints_require_token(client, monkeypatch):
+    monkeypatch.setattr(config, "INTERNAL_TOKEN", None)
+    assert (await client.get("/internal/caches")).status_code == 404
+    monkeypatch.setattr(config, "INTERNAL_TOKEN", "ops-secret")
+    assert (await client.get("/internal/caches")).status_code == 403
+    assert (await client.get("/internal/pool", headers={"X-Internal-Token": "wrong"})).status_code == 403
+    assert (await client.get("/internal/pool", headers={"X-Internal-Token": "ops-secret"})).status_code == 200
+
+@pytest.mark.asyncio
+async def test_tag_suggest_endpoint(client):
+    response = await client.post("/api/auth/register", json={"name": "Sug", "username": "sug", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    await client.post("/api/notes/", json={"title": "A", "content": "B", "tags": ["work", "workout"]}, headers=headers)
+    await client.post("/api/notes/", json={"title": "C", "content": "D", "tags": ["workout"]}, headers=headers)
+
+    response = await client.get("/tags/suggest", params={"prefix": "Wor", "limit": 5})
+    assert response.status_code == 200
+    assert [(tag["name"], tag["noteCount"]) for tag in response.json()] == [("workout", 2), ("work", 1)]
+    assert (await client.get("/tags/suggest", params={"limit": 0})).status_code == 422
+
+@pytest.mark.asyncio
+async def test_list_notes_filtered_by_tags(client):
+    response = await client.post("/api/auth/register", json={"name": "Tagged", "username": "tagged", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    both = (await client.post("/api/notes/", json={"title": "A", "content": "B", "tags": ["work", "urgent"]}, headers=headers)).json()["id"]
+    work = (await client.post("/api/notes/", json={"title": "C", "content": "D", "tags": ["work"]}, headers=headers)).json()["id"]
+
+    response = await client.get("/api/notes/", params={"tags": "work,urgent"}, headers=headers)
+    assert [item["id"] for item in response.json()["items"]] == [both]
+    all_etag = response.headers["ETag"]
+    response = await client.get("/api/notes/", params={"tags": "work,urgent", "match": "any"}, headers=headers)
+    assert [item["id"] for item in response.json()["items"]] == [work, both]
+    assert response.headers["ETag"] != all_etag
+    assert (await client.get("/api/notes/", params={"tags": "work", "match": "some"}, headers=headers)).status_code == 422
+
+@pytest.mark.asyncio
+async def test_list_notes_with_fields_and_snippet(client):
+    response = await client.post("/api/auth/register", json={"name": "Fields", "username": "fields", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    note_id = (await client.post("/api/notes/", json={"title": "A", "content": "Long content here", "tags": ["work"]}, headers=headers)).json()["id"]
+
+    response = await client.get("/api/notes/", params={"fields": "id,title,updatedAt,tags", "snippet": 4}, headers=headers)
+    assert response.status_code == 200
+    [item] = response.json()["items"]
+    assert set(item) == {"id", "title", "updatedAt", "tags", "snippet"}
+    assert (item["id"], item["tags"], item["snippet"]) == (note_id, ["work"], "Long")
+    full = await client.get("/api/notes/", headers=headers)
+    assert full.headers["ETag"] != response.headers["ETag"]
+    assert (await client.get("/api/notes/", params={"fields": "id,body"}, headers=headers)).status_code == 400
+
+@pytest.mark.asyncio
+async def test_tag_facets_endpoint(client):
+    response = await client.post("/api/auth/register", json={"name": "Facets", "username": "facets", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    await client.post("/api/notes/", json={"title": "A", "content": "B", "tags": ["work", "home"]}, headers=headers)
+    await client.post("/api/notes/", json={"title": "C", "content": "D", "tags": ["work"]}, headers=headers)
+
+    response = await client.get("/api/notes/facets", headers=headers)
+    assert response.status_code == 200
+    assert [(facet["name"], facet["count"]) for facet in response.json()] == [("work", 2), ("home", 1)]
+
+@pytest.mark.asyncio
+async def test_if_match_guards_note_writes(client):
+    response = await client.post("/api/auth/register", json={"name": "Cas", "username": "cas", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    note_id = (await client.post("/api/notes/", json={"title": "Hello", "content": "World"}, headers=headers)).json()["id"]
+    etag = (await client.get(f"/api/notes/{note_id}", headers=headers)).headers["ETag"]
+
+    response = await client.put(f"/api/notes/{note_id}", json={"title": "First", "content": "World"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 200
+    new_etag = response.headers["ETag"]
+    assert new_etag != etag
+    assert (await client.get(f"/api/notes/{note_id}", headers=headers)).headers["ETag"] == new_etag
+
+    response = await client.put(f"/api/notes/{note_id}", json={"title": "Stale", "content": "World"}, headers={**headers, "If-Match": etag})
+    assert response.status_code == 412
+    assert (await client.delete(f"/api/notes/{note_id}", headers={**headers, "If-Match": etag})).status_code == 412
+    assert (await client.get(f"/api/notes/{note_id}", headers=headers)).json()["title"] == "First"
+    assert (await client.delete(f"/api/notes/{note_id}", headers={**headers, "If-Match": f"W/{new_etag}"})).status_code == 412
+    assert (await client.delete(f"/api/notes/{note_id}", headers={**headers, "If-Match": new_etag})).json() is True
+
+@pytest.mark.asyncio
+async def test_changes_endpoint(client):
+    response = await client.post("/api/auth/register", json={"name": "Sync", "username": "sync", "password": "testpass123"})
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    kept = (await client.post("/api/notes/", json={"title": "Keep", "content": "B"}, headers=headers)).json()["id"]
+    gone = (await client.post("/api/notes/", json={"title": "Drop", "content": "D"}, headers=headers)).json()["id"]
+    cursor = (await client.get("/api/notes/changes", headers=headers)).json()["cursor"]
+    list_etag = (await client.get("/api/notes/", headers=headers)).headers["ETag"]
+
+    await client.delete(f"/api/notes/{gone}", headers=headers)
+    response = await client.get("/api/notes/changes", params={"since": cursor}, headers=headers)
+    assert response.json()["items"] == []
+    assert response.json()["deleted"] == [gone]
+    listed = await client.get("/api/notes/", headers={**headers, "If-None-Match": list_etag})
+    assert [item["id"] for item in listed.json()["items"]] == [kept]
+    assert (await client.get(f"/api/notes/{gone}", headers=headers)).status_code == 404
+    assert (await client.get("/api/notes/changes", params={"since": "bogus"}, headers=headers)).status_code == 400
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client):
+    await client.post("/api/auth/register", json={"name": "Metrics", "username": "metrics", "password": "testpass123"})
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'route="/api/auth/register",status="200"' in response.text
+
+@pytest.mark.asyncio
+async def test_login_is_rate_limited(client, monkeypatch):
+    await client.post("/api/auth/register", json={"name": "Limited", "username": "limited", "password": "testpass123"})
+    for _ in range(config.LOGIN_USERNAME_BURST):
+        response = await client.post("/api/auth/login", json={"username": "Limited", "password": "wrong"})
+        assert response.status_code == 400
+    response = await client.post("/api/auth/login", json={"username": "limited", "password": "testpass123"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Other accounts are still reachable from the same address.
+    response = await client.post("/api/auth/login", json={"username": "someone-else", "password": "x"})
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_refresh_token_rotation_and_logout(client):
+    await client.post("/api/auth/register", json={"name": "Refresh", "username": "refresh", "password": "testpass123"})
+    response = await client.post("/api/auth/login", json={"username": "refresh", "password": "testpass123"})
+    first = response.json()["refresh_token"]
+
+    response = await client.post("/api/auth/refresh", json={"refresh_token": first})
+    assert response.status_code == 200
+    second = response.json()["refresh_token"]
+    assert second != first
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    assert (await client.get("/api/notes/", headers=headers)).status_code == 200
+
+    response = await client.post("/api/auth/logout", json={"refresh_token": second})
+    assert response.status_code == 204
+    response = await client.post("/api/auth/refresh", json={"refresh_token": second})
+    assert response.status_code == 401
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import tempfile
+import threading
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from starlette.websockets import WebSocketDisconnect
+from main import app
+from database import Base, get_async_db
+from services.events import EventHub, InMemoryBackend, RESYNC
+from services.rate_limit import auth_limiter
+
+
+@pytest.mark.asyncio
+async def test_hub_routes_user_events_and_broadcasts():
+    hub = EventHub(InMemoryBackend(), queue_size=10)
+    alice, alice_other_device, bob = await hub.subscribe(1), await hub.subscribe(1), await hub.subscribe(2)
+
+    hub.publish([{"type": "note.updated", "userId": 1, "id": 7}, {"type": "tag.deleted", "id": 3}])
+    assert [alice.queue.get_nowait()["type"] for _ in range(2)] == ["note.updated", "tag.deleted"]
+    assert alice_other_device.queue.qsize() == 2
+    assert bob.queue.get_nowait()["type"] == "tag.deleted"
+    assert bob.queue.empty()
+
+    hub.unsubscribe(alice)
+    hub.publish([{"type": "note.deleted", "userId": 1, "id": 7}])
+    assert alice.queue.empty()
+    assert hub.stats()["connections"] == 2
+
+@pytest.mark.asyncio
+async def test_hub_replaces_backlog_of_slow_consumer_with_resync():
+    hub = EventHub(InMemoryBackend(), queue_size=3)
+    slow = await hub.subscribe(1)
+    hub.publish({"type": "note.updated", "userId": 1, "id": i} for i in range(5))
+    assert slow.queue.qsize() == 1
+    assert await slow.get() is RESYNC
+    assert hub.stats()["overflows"] == 1
+
+@pytest.mark.asyncio
+async def test_hub_publish_from_another_thread():
+    hub = EventHub(InMemoryBackend(), queue_size=10)
+    subscription = await hub.subscribe(1)
+    thread = threading.Thread(target=hub.publish, args=([{"type": "note.created", "userId": 1, "id": 1}],))
+    thread.start()
+    thread.join()
+    assert (await asyncio.wait_for(subscription.get(), 1))["id"] == 1
+
+
+@pytest.fixture(scope="function")
+def client():
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    # Each TestClient request and WebSocket session runs on its own event
+    # loop, so connections must not be shared between them.
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    TestingSessionLocal = async_sessionmaker(autoflush=False, bind=async_engine)
+
+    async def override_get_async_db():
+        async with TestingSessionLocal() as session:
+            yield session
+
+    previous_override = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    auth_limiter.clear()
+    yield TestClient(app)
+    if previous_override is None:
+        app.dependency_overrides.pop(get_async_db, None)
+    else:
+        app.dependency_overrides[get_async_db] = previous_override
+    engine.dispose()
+    os.remove(path)
+
+def test_stream_pushes_note_and_tag_events(client):
+    token = client.post("/api/auth/register", json={"name": "Ws", "username": "ws", "password": "testpass123"}).json()["access_token"]
+    other = client.post("/api/auth/register", json={"name": "Other", "username": "other", "password": "testpass123"}).json()["access_token"]
+
+    with client.websocket_connect(f"/api/notes/stream?token={token}") as websocket:
+        client.post("/api/notes/", json={"title": "Hidden", "content": "x"}, headers={"Authorization": f"Bearer {other}"})
+        note_id = client.post("/api/notes/", json={"title": "Hi", "content": "x", "tags": ["live"]}, headers={"Authorization": f"Bearer {token}"}).json()["id"]
+        received = [websocket.receive_json(), websocket.receive_json()]
+        assert {message["type"] for message in received} == {"note.created", "tag.saved"}
+        created = next(message for message in received if message["type"] == "note.created")
+        assert created["id"] == note_id
+
+        client.delete(f"/api/notes/{note_id}", headers={"Authorization": f"Bearer {token}"})
+        assert websocket.receive_json()["type"] == "note.deleted"
+
+def test_stream_rejects_invalid_token(client):
+    with pytest.raises(WebSocketDisconnect) as excinfo:
+        with client.websocket_connect("/api/notes/stream?token=invalid"):
+            pass
+    assert excinfo.value.code == 1008
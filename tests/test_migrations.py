@@ -0,0 +1,95 @@
+import pytest
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.orm import sessionmaker
+from models import Note, DataFixup
+from database import Base
+from services.migrations import run_pending_fixups, pending_fixups, background_fixups, BackgroundFixupRunner
+
+SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_TEST_DATABASE_URL)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+
+def test_locked_fixup_runs_in_batches(db):
+    db.execute(insert(Note.__table__), [{"title": f"Note {i}", "content": "Content", "user_id": 1, "locked": None} for i in range(7)])
+    db.add(Note(title="Locked", content="Content", user_id=1, locked=True))
+    db.commit()
+
+    commits = []
+    def count_commit(session):
+        commits.append(session)
+    event.listen(db, "after_commit", count_commit)
+    try:
+        assert run_pending_fixups(db, batch_size=3) == ["notes_locked_not_null"]
+    finally:
+        event.remove(db, "after_commit", count_commit)
+
+    assert db.query(Note).filter(Note.locked.is_(None)).count() == 0
+    assert db.query(Note).filter(Note.locked.is_(True)).count() == 1
+    assert db.query(DataFixup).filter(DataFixup.name == "notes_locked_not_null").count() == 1
+    # one commit ending the pending check, two full batches, then the last batch
+    # with its record
+    assert len(commits) == 4
+
+def test_compress_fixup_converts_plain_rows_in_batches(db):
+    body = "Plain text written before compression. " * 200
+    # Fewer characters than the threshold, but more UTF-8 bytes.
+    multibyte = "Año ñandú " * 400
+    # Inserted as literal SQL so the rows bypass Note.content's type.
+    for i, content in enumerate([body] * 4 + [multibyte]):
+        db.execute(text("INSERT INTO notes (title, content, user_id, locked, version, change_seq) VALUES (:t, :c, 1, 0, 1, 0)"),
+                   {"t": f"Note {i}", "c": content})
+    db.execute(text("INSERT INTO notes (title, content, user_id, locked, version, change_seq) VALUES ('Short', 'short', 1, 0, 1, 0)"))
+    db.commit()
+
+    # Not a startup fixup any more.
+    assert "notes_compress_content" not in pending_fixups(db)
+    assert run_pending_fixups(db, batch_size=2, background=True) == ["notes_compress_content"]
+
+    stored = db.execute(text("SELECT title, content, version, updated_at FROM notes ORDER BY id")).all()
+    assert all(content.startswith("\x01z") for _, content, _, _ in stored[:5])
+    assert stored[5].content == "short"
+    # Neither the version nor updated_at moves: the text itself is unchanged.
+    assert {(version, updated_at) for _, _, version, updated_at in stored} == {(1, None)}
+    db.expire_all()
+    assert [note.content for note in db.query(Note).filter(Note.title != "Short").order_by(Note.id)] == [body] * 4 + [multibyte]
+
+def test_compress_fixup_skips_rows_edited_since_they_were_read(db, monkeypatch):
+    db.execute(text("INSERT INTO notes (title, content, user_id, locked, version, change_seq) VALUES ('Old', :c, 1, 0, 1, 0)"),
+               {"c": "Plain text written before compression. " * 200})
+    db.commit()
+    edited = "Edited while the fixup ran. " * 200
+    original_execute = db.execute
+
+    def execute_then_edit(statement, *args, **kwargs):
+        result = original_execute(statement, *args, **kwargs)
+        if statement.is_select and not getattr(execute_then_edit, "done", False):
+            execute_then_edit.done = True
+            original_execute(text("UPDATE notes SET content = :c, version = 2"), {"c": edited})
+        return result
+    monkeypatch.setattr(db, "execute", execute_then_edit)
+    assert background_fixups["notes_compress_content"](db, 10) == 1
+    monkeypatch.undo()
+    db.commit()
+    assert db.execute(text("SELECT content, version FROM notes")).one() == (edited, 2)
+
+def test_background_runner_records_fixups(db):
+    runner = BackgroundFixupRunner(TestingSessionLocal, batch_size=2, pause_seconds=0)
+    assert runner.run() == ["notes_compress_content"]
+    assert pending_fixups(db, background_fixups) == []
+
+def test_completed_fixups_are_skipped(db, query_budget):
+    run_pending_fixups(db)
+    assert pending_fixups(db) == []
+
+    with query_budget(engine, 1):
+        assert run_pending_fixups(db) == []
@@ -1,10 +1,23 @@
+import base64
+import json
+import random
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from services.notes import create_note, get_notes, get_note_by_id, update_note, delete_note
-from models import Note
-from schemas import NoteCreate
+from fastapi import HTTPException
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.exc import InvalidRequestError
+from services.notes import create_note, get_notes, get_notes_page, get_note_by_id, update_note, delete_note
+from models import Note, Tag
+from services.notes import note_to_response, render_projected_page
+from services.search import search_notes
+from services.suggest import tag_suggest_index, suggest_tags
+from services.facets import get_tag_facets, reconcile_tag_counts
+from services.changes import get_changes
+from models import UserTagCount, compress_text, decompress_text
+from services.tags import tag_list_cache, get_tag_list, create_tag, update_tag, delete_tag
+from schemas import NoteCreate, TagCreate
 from database import Base
 
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
@@ -14,6 +27,7 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 @pytest.fixture(scope="function")
 def db():
     Base.metadata.create_all(bind=engine)
+    tag_suggest_index.clear()
     db = TestingSessionLocal()
     try:
         yield db
@@ -21,48 +35,395 @@ def db():
         db.close()
         Base.metadata.drop_all(bind=engine)
 
-def test_create_note(db):
+def test_create_note(db, query_budget):
     note_data = NoteCreate(title="Test Note", content="This is a test note.")
     user_id = 1
-    note = create_note(db, note_data, user_id)
+    with query_budget(engine, 5):
+        note = create_note(db, note_data, user_id)
     assert note.id is not None
     assert note.title == "Test Note"
     assert note.content == "This is a test note."
     assert note.user_id == user_id
 
-def test_get_notes(db):
+def test_get_notes(db, query_budget):
     user_id = 1
     note_data_1 = NoteCreate(title="Note 1", content="Content 1")
     note_data_2 = NoteCreate(title="Note 2", content="Content 2")
     create_note(db, note_data_1, user_id)
     create_note(db, note_data_2, user_id)
-    notes = get_notes(db, user_id)
+    db.expire_all()
+    with query_budget(engine, 2):
+        notes = get_notes(db, user_id)
     assert len(notes) == 2
-    assert notes[0].title == "Note 1"
-    assert notes[1].title == "Note 2"
+    assert notes[0].title == "Note 2"
+    assert notes[1].title == "Note 1"
+
+def test_get_notes_page_walks_every_note_once(db):
+    user_id = 1
+    for i in range(7):
+        create_note(db, NoteCreate(title=f"Note {i}", content=f"Content {i}"), user_id)
+    create_note(db, NoteCreate(title="Other user", content="Content"), 2)
+
+    seen, cursor = [], None
+    while True:
+        notes, cursor = get_notes_page(db, user_id, 3, cursor)
+        seen.extend(note.title for note in notes)
+        if cursor is None:
+            break
+    assert seen == [f"Note {i}" for i in reversed(range(7))]
 
-def test_get_note_by_id(db):
+def test_get_notes_page_rejects_invalid_cursor(db):
+    with pytest.raises(ValueError):
+        get_notes_page(db, 1, 10, "not-a-cursor")
+
+def test_get_note_by_id(db, query_budget):
     user_id = 1
     note_data = NoteCreate(title="Test Note", content="This is a test note.")
     note = create_note(db, note_data, user_id)
-    fetched_note = get_note_by_id(db, note.id, user_id)
-    assert fetched_note.id == note.id
+    note_id = note.id
+    db.expire_all()
+    with query_budget(engine, 2):
+        fetched_note = get_note_by_id(db, note_id, user_id)
+    assert fetched_note.id == note_id
     assert fetched_note.title == note.title
 
-def test_update_note(db):
+def test_update_note(db, query_budget):
     user_id = 1
-    note_data = NoteCreate(title="Old Title", content="Old Content")
+    note_data = NoteCreate(title="Old Title", content="Old Content", tags=["old"])
     note = create_note(db, note_data, user_id)
-    updated_data = NoteCreate(title="New Title", content="New Content")
-    updated_note = update_note(db, note.id, user_id, updated_data)
+    updated_data = NoteCreate(title="New Title", content="New Content", tags=["new"])
+    with query_budget(engine, 13):
+        updated_note = update_note(db, note.id, user_id, updated_data)
     assert updated_note.title == "New Title"
     assert updated_note.content == "New Content"
 
-def test_delete_note(db):
+def test_delete_note(db, query_budget):
     user_id = 1
-    note_data = NoteCreate(title="Test Note", content="This is a test note.")
+    note_data = NoteCreate(title="Test Note", content="This is a test note.", tags=["work"])
     note = create_note(db, note_data, user_id)
-    result = delete_note(db, note.id, user_id)
+    with query_budget(engine, 8):
+        result = delete_note(db, note.id, user_id)
     assert result is True
     notes = get_notes(db, user_id)
-    assert len(notes) == 0
\ No newline at end of file
+    assert len(notes) == 0
+
+def test_get_notes_statement_count_is_constant(db, query_budget):
+    user_id = 1
+    work, home = Tag(name="work"), Tag(name="home")
+    db.add(Note(title="Note 0", content="Content 0", user_id=user_id, tags=[work]))
+    db.commit()
+    db.expire_all()
+    with query_budget(engine, 2):
+        [note_to_response(note) for note in get_notes(db, user_id)]
+
+    for i in range(1, 25):
+        db.add(Note(title=f"Note {i}", content=f"Content {i}", user_id=user_id, tags=[work, home]))
+    db.commit()
+    db.expire_all()
+    with query_budget(engine, 2):
+        [note_to_response(note) for note in get_notes(db, user_id)]
+
+def test_note_response_includes_tags(db):
+    user_id = 1
+    note = Note(title="Tagged", content="Content", user_id=user_id, tags=[Tag(name="work"), Tag(name="home")])
+    db.add(note)
+    db.commit()
+    fetched_note = get_note_by_id(db, note.id, user_id)
+    assert sorted(note_to_response(fetched_note).tags) == ["home", "work"]
+
+def test_search_notes_ranks_and_highlights(db):
+    user_id = 1
+    create_note(db, NoteCreate(title="Grocery list", content="milk, eggs and bread"), user_id)
+    create_note(db, NoteCreate(title="Bread recipe", content="flour, water, bread yeast"), user_id)
+    create_note(db, NoteCreate(title="Bread for another user", content="bread"), 2)
+
+    results = search_notes(db, user_id, "bread", limit=10)
+    assert [result["title"] for result in results] == ["<mark>Bread</mark> recipe", "Grocery list"]
+    assert "<mark>bread</mark>" in results[1]["snippet"]
+
+def test_search_escapes_note_text_around_highlights(db):
+    user_id = 1
+    create_note(db, NoteCreate(title="<b>Bread</b> & \ue000butter", content='bread <script>alert("x")</script>'), user_id)
+
+    [result] = search_notes(db, user_id, "bread", limit=10)
+    assert result["title"] == "&lt;b&gt;<mark>Bread</mark>&lt;/b&gt; &amp; butter"
+    assert result["snippet"] == "<mark>bread</mark> &lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt;"
+
+def test_search_index_follows_updates_and_deletes(db):
+    user_id = 1
+    note = create_note(db, NoteCreate(title="Draft", content="quarterly report"), user_id)
+    assert [r["id"] for r in search_notes(db, user_id, "quarterly", limit=10)] == [note.id]
+
+    update_note(db, note.id, user_id, NoteCreate(title="Draft", content="annual summary"))
+    assert search_notes(db, user_id, "quarterly", limit=10) == []
+    assert [r["id"] for r in search_notes(db, user_id, "annual", limit=10)] == [note.id]
+
+    delete_note(db, note.id, user_id)
+    assert search_notes(db, user_id, "annual", limit=10) == []
+
+def test_search_notes_paginates(db):
+    user_id = 1
+    for i in range(5):
+        create_note(db, NoteCreate(title=f"Meeting {i}", content="agenda"), user_id)
+    first = search_notes(db, user_id, "agenda", limit=2)
+    second = search_notes(db, user_id, "agenda", limit=2, offset=2)
+    assert len(first) == len(second) == 2
+    assert not {r["id"] for r in first} & {r["id"] for r in second}
+
+def test_create_note_with_tags_uses_bulk_statements(db, query_budget):
+    user_id = 1
+    db.add(Tag(name="existing"))
+    db.commit()
+
+    with query_budget(engine, 8) as statements:
+        note = create_note(db, NoteCreate(title="Tagged", content="Content", tags=["existing"] + [f"new-{i}" for i in range(10)]), user_id)
+
+    assert sorted(tag.name for tag in note.tags) == sorted(["existing"] + [f"new-{i}" for i in range(10)])
+    assert sum("INSERT INTO tags" in statement for statement in statements) == 1
+    assert sum("INSERT INTO note_tags" in statement for statement in statements) == 1
+
+def test_create_note_reuses_existing_tags(db):
+    user_id = 1
+    create_note(db, NoteCreate(title="First", content="Content", tags=["work", "work", " home "]), user_id)
+    second = create_note(db, NoteCreate(title="Second", content="Content", tags=["work", "home"]), user_id)
+    assert sorted(tag.name for tag in second.tags) == ["home", "work"]
+    assert db.query(Tag).count() == 2
+
+def test_update_note_reconciles_tags(db):
+    user_id = 1
+    note = create_note(db, NoteCreate(title="Note", content="Content", tags=["a", "b"]), user_id)
+    updated = update_note(db, note.id, user_id, NoteCreate(title="Note", content="Content", tags=["b", "c"]))
+    assert sorted(tag.name for tag in updated.tags) == ["b", "c"]
+
+def test_tag_renamed_elsewhere_is_not_reattached_by_old_name(db):
+    user_id = 1
+    note = create_note(db, NoteCreate(title="Note", content="Content", tags=["work"]), user_id)
+    tag_id = note.tags[0].id
+    # As another worker would: straight to the database, no local bookkeeping.
+    db.execute(text("UPDATE tags SET name = 'job' WHERE id = :id"), {"id": tag_id})
+    db.commit()
+    again = create_note(db, NoteCreate(title="Again", content="Content", tags=["work"]), user_id)
+    assert again.tags[0].name == "work" and again.tags[0].id != tag_id
+
+    update_tag(db, tag_id, TagCreate(name="renamed"))
+    delete_tag(db, tag_id)
+    recreated = create_note(db, NoteCreate(title="Other", content="Content", tags=["old"]), user_id)
+    assert recreated.tags[0].name == "old"
+
+def test_tag_list_cache_served_from_memory_until_tags_change(db, query_budget):
+    user_id = 1
+    tag_list_cache.clear()
+    create_tag(db, TagCreate(name="first"))
+    body, etag = get_tag_list(db)
+    assert json.loads(body) == [{"id": 1, "name": "first"}]
+
+    with query_budget(engine, 0):
+        assert get_tag_list(db) == (body, etag)
+
+    version = tag_list_cache.version
+    create_note(db, NoteCreate(title="Note", content="Content", tags=["first"]), user_id)
+    assert tag_list_cache.version == version
+    create_note(db, NoteCreate(title="Note", content="Content", tags=["second"]), user_id)
+    assert tag_list_cache.version == version + 1
+    body, new_etag = get_tag_list(db)
+    assert [tag["name"] for tag in json.loads(body)] == ["first", "second"]
+    assert new_etag != etag
+
+    update_tag(db, 1, TagCreate(name="renamed"))
+    assert [tag["name"] for tag in json.loads(get_tag_list(db)[0])] == ["renamed", "second"]
+    delete_tag(db, 2)
+    assert [tag["name"] for tag in json.loads(get_tag_list(db)[0])] == ["renamed"]
+
+def test_suggest_tags_ranks_by_usage_and_tracks_changes(db):
+    user_id = 1
+    create_tag(db, TagCreate(name="Python"))
+    create_note(db, NoteCreate(title="A", content="Content", tags=["python", "pytest"]), user_id)
+    create_note(db, NoteCreate(title="B", content="Content", tags=["pytest"]), user_id)
+    assert suggest_tags(db, "py", 10) == [
+        {"id": 3, "name": "pytest", "noteCount": 2},
+        {"id": 2, "name": "python", "noteCount": 1},
+        {"id": 1, "name": "Python", "noteCount": 0},
+    ]
+
+    # Index is loaded now; later writes update it without reloading.
+    note = create_note(db, NoteCreate(title="C", content="Content", tags=["Python", "pydantic"]), user_id)
+    assert [tag["name"] for tag in suggest_tags(db, "PY", 2)] == ["pytest", "pydantic"]
+    update_tag(db, 3, TagCreate(name="unit"))
+    assert [tag["name"] for tag in suggest_tags(db, "py", 10)] == ["pydantic", "Python", "python"]
+    assert suggest_tags(db, "un", 10) == [{"id": 3, "name": "unit", "noteCount": 2}]
+    delete_note(db, note.id, user_id)
+    delete_tag(db, 2)
+    assert suggest_tags(db, "py", 10) == [{"id": 4, "name": "pydantic", "noteCount": 0}, {"id": 1, "name": "Python", "noteCount": 0}]
+
+def test_suggest_tags_memoized_prefix_is_invalidated(db, monkeypatch):
+    import services.suggest
+    monkeypatch.setattr(services.suggest, "MEMO_MIN_MATCHES", 1)
+    create_note(db, NoteCreate(title="A", content="Content", tags=["alpha", "alps"]), 1)
+    assert [tag["name"] for tag in suggest_tags(db, "al", 1)] == ["alpha"]
+    create_note(db, NoteCreate(title="B", content="Content", tags=["alps"]), 1)
+    assert [tag["name"] for tag in suggest_tags(db, "al", 1)] == ["alps"]
+
+def test_get_notes_filtered_by_tags(db):
+    user_id = 1
+    both = create_note(db, NoteCreate(title="Both", content="Content", tags=["work", "urgent"]), user_id)
+    work = create_note(db, NoteCreate(title="Work", content="Content", tags=["work"]), user_id)
+    create_note(db, NoteCreate(title="Home", content="Content", tags=["home"]), user_id)
+    create_note(db, NoteCreate(title="Other user", content="Content", tags=["work", "urgent"]), 2)
+
+    assert [note.id for note in get_notes(db, user_id, tags=["work", "urgent"])] == [both.id]
+    assert [note.id for note in get_notes(db, user_id, tags=["work", "urgent"], match="any")] == [work.id, both.id]
+    assert get_notes(db, user_id, tags=["work", "missing"]) == []
+
+    notes, next_cursor = get_notes_page(db, user_id, 1, tags=["work", " work", "urgent", ""], match="any")
+    assert [note.id for note in notes] == [work.id]
+    notes, _ = get_notes_page(db, user_id, 1, next_cursor, tags=["work", "urgent"], match="any")
+    assert [note.id for note in notes] == [both.id]
+
+def test_tag_facets_follow_note_writes(db):
+    user_id = 1
+    first = create_note(db, NoteCreate(title="A", content="Content", tags=["work", "home"]), user_id)
+    second = create_note(db, NoteCreate(title="B", content="Content", tags=["work"]), user_id)
+    create_note(db, NoteCreate(title="C", content="Content", tags=["work"]), 2)
+    assert [(f["name"], f["count"]) for f in get_tag_facets(db, user_id)] == [("work", 2), ("home", 1)]
+
+    update_note(db, second.id, user_id, NoteCreate(title="B", content="Content", tags=["home", "errands"]))
+    assert [(f["name"], f["count"]) for f in get_tag_facets(db, user_id)] == [("home", 2), ("errands", 1), ("work", 1)]
+
+    delete_note(db, first.id, user_id)
+    delete_tag(db, db.query(Tag).filter(Tag.name == "errands").one().id)
+    assert [(f["name"], f["count"]) for f in get_tag_facets(db, user_id)] == [("home", 1)]
+    assert [(f["name"], f["count"]) for f in get_tag_facets(db, 2)] == [("work", 1)]
+    assert reconcile_tag_counts(db) == []
+
+def test_reconcile_tag_counts_reports_and_fixes_drift(db):
+    user_id = 1
+    note = create_note(db, NoteCreate(title="A", content="Content", tags=["work"]), user_id)
+    work_id = note.tags[0].id
+    db.query(UserTagCount).filter(UserTagCount.tag_id == work_id).update({"count": 5})
+    db.add(UserTagCount(user_id=user_id, tag_id=999, count=1))
+    db.commit()
+
+    assert reconcile_tag_counts(db, apply=False) == [(user_id, work_id, 5, 1), (user_id, 999, 1, 0)]
+    assert reconcile_tag_counts(db) == [(user_id, work_id, 5, 1), (user_id, 999, 1, 0)]
+    assert reconcile_tag_counts(db, apply=False) == []
+    assert get_tag_facets(db, user_id) == [{"id": work_id, "name": "work", "count": 1}]
+
+def test_update_note_is_compare_and_swap_on_version(db):
+    user_id = 1
+    note = create_note(db, NoteCreate(title="Note", content="Content", tags=["a"]), user_id)
+    assert note.version == 1
+    other = TestingSessionLocal()
+    try:
+        # A second session commits between our read and our write.
+        stale = other.query(Note).filter(Note.id == note.id).one()
+        update_note(db, note.id, user_id, NoteCreate(title="Winner", content="Content", tags=["b"]))
+        stale.title = "Loser"
+        with pytest.raises(StaleDataError):
+            other.commit()
+    finally:
+        other.close()
+
+    with pytest.raises(HTTPException) as excinfo:
+        update_note(db, note.id, user_id, NoteCreate(title="Late", content="Content"), if_match='"stale"')
+    assert excinfo.value.status_code == 412
+    updated = get_note_by_id(db, note.id, user_id)
+    assert (updated.title, updated.version, [tag.name for tag in updated.tags]) == ("Winner", 2, ["b"])
+
+def test_tag_rename_and_delete_reach_delta_sync(db):
+    first = create_note(db, NoteCreate(title="First", content="alpha", tags=["x", "y"]), 1)
+    second = create_note(db, NoteCreate(title="Second", content="beta", tags=["x"]), 1)
+    untagged = create_note(db, NoteCreate(title="Untagged", content="gamma"), 1)
+    other = create_note(db, NoteCreate(title="Other user", content="delta", tags=["x"]), 2)
+    cursors = {user_id: get_changes(db, user_id)["cursor"] for user_id in (1, 2)}
+    updated_at = {note.id: note.updated_at for note in (first, second, other)}
+    tag_id = first.tags[0].id if first.tags[0].name == "x" else first.tags[1].id
+
+    update_tag(db, tag_id, TagCreate(name="renamed"))
+    delta = get_changes(db, 1, cursors[1])
+    assert [(note.id, sorted(tag.name for tag in note.tags)) for note in delta["items"]] == [
+        (first.id, ["renamed", "y"]), (second.id, ["renamed"]),
+    ]
+    assert [note.id for note in get_changes(db, 2, cursors[2])["items"]] == [other.id]
+    # Each user's sequence stays gap-free and strictly increasing.
+    assert [note.change_seq for note in delta["items"]] == [4, 5]
+    db.expire_all()
+    assert {note.id: note.updated_at for note in db.query(Note).filter(Note.id.in_(updated_at))} == updated_at
+
+    delete_tag(db, tag_id)
+    after_delete = get_changes(db, 1, delta["cursor"])
+    assert [(note.id, [tag.name for tag in note.tags]) for note in after_delete["items"]] == [(first.id, ["y"]), (second.id, [])]
+    assert untagged.id not in [note.id for note in after_delete["items"]]
+    assert create_note(db, NoteCreate(title="Next", content="epsilon"), 1).change_seq == 8
+
+def test_changes_since_cursor_include_tombstones(db):
+    user_id = 1
+    first = create_note(db, NoteCreate(title="First", content="alpha"), user_id)
+    second = create_note(db, NoteCreate(title="Second", content="beta", tags=["x"]), user_id)
+    create_note(db, NoteCreate(title="Other user", content="gamma"), 2)
+
+    full = get_changes(db, user_id)
+    assert [note.id for note in full["items"]] == [first.id, second.id]
+    assert full["deleted"] == [] and full["hasMore"] is False
+
+    update_note(db, first.id, user_id, NoteCreate(title="First edited", content="alpha"))
+    delete_note(db, second.id, user_id)
+    delta = get_changes(db, user_id, full["cursor"])
+    assert [note.title for note in delta["items"]] == ["First edited"]
+    assert delta["deleted"] == [second.id]
+    assert get_changes(db, user_id, delta["cursor"]) == {"items": [], "deleted": [], "cursor": delta["cursor"], "hasMore": False}
+
+    paged = get_changes(db, user_id, full["cursor"], limit=1)
+    assert [note.id for note in paged["items"]] == [first.id] and paged["hasMore"] is True
+    assert get_changes(db, user_id, paged["cursor"], limit=1)["deleted"] == [second.id]
+
+    # The tombstone is invisible everywhere else.
+    assert [note.id for note in get_notes(db, user_id)] == [first.id]
+    assert search_notes(db, user_id, "beta", limit=10) == []
+    assert get_tag_facets(db, user_id) == []
+    with pytest.raises(HTTPException):
+        get_note_by_id(db, second.id, user_id)
+    with pytest.raises(HTTPException):
+        update_note(db, second.id, user_id, NoteCreate(title="Back", content="beta"))
+    assert delete_note(db, second.id, user_id) is False
+    with pytest.raises(ValueError):
+        get_changes(db, user_id, "not-a-cursor")
+
+def test_large_note_content_is_stored_compressed(db):
+    user_id = 1
+    body = "Meeting notes about the quarterly roadmap. " * 500
+    large = create_note(db, NoteCreate(title="Roadmap", content=body), user_id)
+    small = create_note(db, NoteCreate(title="Short", content="\x01starts with the marker"), user_id)
+
+    stored = dict(db.execute(text("SELECT id, content FROM notes")).all())
+    assert stored[large.id].startswith("\x01z") and len(stored[large.id]) < len(body) // 10
+    assert stored[small.id] == "\x01r\x01starts with the marker"
+
+    db.expire_all()
+    assert get_note_by_id(db, large.id, user_id).content == body
+    assert get_note_by_id(db, small.id, user_id).content == "\x01starts with the marker"
+    assert [r["id"] for r in search_notes(db, user_id, "roadmap", limit=10)] == [large.id]
+
+def test_compress_text_round_trips(db):
+    for value in (None, "", "plain", "\x01z not really compressed", "é" * 3000, "x" * 10000):
+        assert decompress_text(compress_text(value, threshold=4096)) == value
+    # Text that does not shrink keeps the raw tag so the backfill skips it.
+    noise = base64.b64encode(random.Random(0).randbytes(3000)).decode()
+    assert compress_text(noise, threshold=16).startswith("\x01r")
+
+def test_projected_notes_leave_content_in_the_database(db, query_budget):
+    user_id = 1
+    body = "Quarterly roadmap draft. " * 400
+    compressed_id = create_note(db, NoteCreate(title="Long", content=body, tags=["work"]), user_id).id
+    create_note(db, NoteCreate(title="Short", content="Buy bread and milk"), user_id)
+    db.expunge_all()
+
+    with query_budget(engine, 2) as statements:
+        notes = get_notes(db, user_id, fields=("title", "tags", "id"), snippet=10)
+    note_columns = statements[0].split(" FROM ")[0]
+    assert "notes.content AS" not in note_columns and "notes.locked" not in note_columns
+    assert [note.snippet for note in notes] == ["Buy bread ", "Quarterly "]
+
+    page = json.loads(render_projected_page(notes, None, ("title", "tags", "id"), 10))
+    assert page["items"][1] == {"title": "Long", "tags": ["work"], "id": compressed_id, "snippet": "Quarterly "}
+    with pytest.raises(InvalidRequestError):
+        notes[0].content
@@ -0,0 +1,128 @@
+import logging
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from monitoring import (
+    PoolStats, instrumented_pool_class, instrument_engine, current_request,
+    MetricsMiddleware, RequestMetrics, instrument_queries,
+    RepeatedQueryMiddleware, instrument_statement_shapes, statement_shape, query_budget, QueryBudgetExceeded
+)
+
+@pytest.fixture(scope="function")
+def instrumented(tmp_path):
+    stats = PoolStats("test")
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=instrumented_pool_class(QueuePool, stats),
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    instrument_engine(engine, stats)
+    try:
+        yield engine, stats
+    finally:
+        engine.dispose()
+
+def test_pool_stats_track_checkouts(instrumented):
+    engine, stats = instrumented
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        assert stats.snapshot()["checked_out"] == 1
+    snapshot = stats.snapshot()
+    assert snapshot["checked_out"] == 0
+    assert snapshot["checkouts"] == snapshot["checkins"] == 1
+    assert snapshot["connects"] == 1
+
+def test_pool_timeout_is_counted_and_attributed(instrumented, caplog):
+    engine, stats = instrumented
+
+    class Route:
+        path = "/api/notes/{id}"
+
+    token = current_request.set({"type": "http", "path": "/api/notes/7", "route": Route()})
+    try:
+        with engine.connect():
+            with caplog.at_level(logging.ERROR, logger="notes.pool"):
+                with pytest.raises(PoolTimeoutError):
+                    engine.connect()
+    finally:
+        current_request.reset(token)
+
+    assert stats.snapshot()["checkout_timeouts"] == 1
+    assert "event=db.pool.checkout_timeout" in caplog.text
+    assert "route=/api/notes/{id}" in caplog.text
+
+@pytest.mark.asyncio
+async def test_metrics_middleware_attributes_queries_to_routes(instrumented):
+    engine, _ = instrumented
+    instrument_queries(engine)
+    metrics = RequestMetrics()
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get("/items/{id}")
+    def item(id: int):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        return {"id": id}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for id in (1, 2):
+            assert (await client.get(f"/items/{id}")).status_code == 200
+        assert (await client.get("/missing")).status_code == 404
+    # Outside a request nothing is attributed.
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 3"))
+
+    body = metrics.render()
+    assert 'notes_http_requests_total{method="GET",route="/items/{id}",status="200"} 2' in body
+    assert 'notes_http_requests_total{method="GET",route="<unmatched>",status="404"} 1' in body
+    assert 'notes_http_request_db_queries_sum{method="GET",route="/items/{id}"} 4' in body
+    assert 'notes_http_request_db_queries_bucket{method="GET",route="/items/{id}",le="2"} 2' in body
+    assert 'notes_http_request_duration_seconds_count{method="GET",route="/items/{id}"} 2' in body
+    assert "notes_http_requests_in_flight 0" in body
+
+@pytest.mark.asyncio
+async def test_repeated_statements_are_reported_per_request(instrumented, caplog):
+    engine, _ = instrumented
+    instrument_statement_shapes(engine)
+    app = FastAPI()
+    app.add_middleware(RepeatedQueryMiddleware, threshold=3)
+
+    @app.get("/items/{id}")
+    def item(id: int, n: int):
+        with engine.connect() as conn:
+            for i in range(n):
+                conn.execute(text("SELECT :value"), {"value": i})
+        return {"id": id}
+
+    transport = httpx.ASGITransport(app=app)
+    with caplog.at_level(logging.WARNING, logger="notes.queries"):
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.get("/items/1", params={"n": 3})
+            assert caplog.records == []
+            await client.get("/items/1", params={"n": 4})
+    [record] = caplog.records
+    assert "route=/items/{id} count=4 statement=SELECT ?" in record.getMessage()
+
+def test_statement_shape_ignores_parameters():
+    assert statement_shape("SELECT * FROM t WHERE id IN (?, ?, ?)\n AND a = ?") == "SELECT * FROM t WHERE id IN (?) AND a = ?"
+    assert statement_shape("SELECT * FROM t WHERE id IN (%(id_1)s, %(id_2)s)") == "SELECT * FROM t WHERE id IN (?)"
+    assert statement_shape("SELECT $1::text") == "SELECT ?::text"
+
+def test_query_budget_lists_statements_when_exceeded(instrumented):
+    engine, _ = instrumented
+    with query_budget(engine, 1):
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    with pytest.raises(QueryBudgetExceeded, match="2 statements issued, budget is 1"):
+        with query_budget(engine, 1):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
@@ -2,9 +2,14 @@ import pytest
 from fastapi.testclient import TestClient
 from main import app
 from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+from database import get_db, get_async_db
+import config
 from models import Tag
 from schemas import TagCreate
+from services.tags import tag_list_cache
+from services.suggest import tag_suggest_index
 
 client = TestClient(app)
 
@@ -18,14 +23,37 @@ def override_get_db():
 
 app.dependency_overrides[get_db] = override_get_db
 
+# Each TestClient request runs on its own event loop, and asyncpg connections
+# cannot move between loops, so the async side gets a fresh one per session.
+async_engine = create_async_engine(config.ASYNC_DATABASE_URL, poolclass=NullPool)
+AsyncTestingSessionLocal = async_sessionmaker(autoflush=False, bind=async_engine)
+
+async def override_get_async_db():
+    async with AsyncTestingSessionLocal() as db:
+        yield db
+
+# Installed per test: other modules' fixtures swap this override in and out.
+@pytest.fixture(autouse=True)
+def async_db_override():
+    previous = app.dependency_overrides.get(get_async_db)
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield
+    if previous is None:
+        app.dependency_overrides.pop(get_async_db, None)
+    else:
+        app.dependency_overrides[get_async_db] = previous
+
 def setup_function():
     # Clear the tags table before each test
     db = next(get_db())
     db.query(Tag).delete()
     db.commit()
+    tag_list_cache.clear()
+    tag_suggest_index.clear()
 
-def test_add_tag():
-    response = client.post("/tags/", json={"name": "Test Tag"})
+def test_add_tag(query_budget):
+    with query_budget(async_engine, 2):
+        response = client.post("/tags/", json={"name": "Test Tag"})
     assert response.status_code == 200
     assert response.json()["name"] == "Test Tag"
 
@@ -33,10 +61,14 @@ def test_add_tag_invalid():
     response = client.post("/tags/", json={})  # Missing required fields
     assert response.status_code == 422
 
-def test_list_tags():
-    response = client.get("/tags/")
+def test_list_tags(query_budget):
+    with query_budget(async_engine, 1):
+        response = client.get("/tags/")
     assert response.status_code == 200
     assert isinstance(response.json(), list)
+    # Served from the tag list cache until a tag changes.
+    with query_budget(async_engine, 0):
+        assert client.get("/tags/").status_code == 200
 
 def test_get_tag():
     response = client.post("/tags/", json={"name": "Another Tag"})
@@ -49,10 +81,13 @@ def test_get_tag_not_found():
     response = client.get("/tags/999")  # Non-existent tag ID
     assert response.status_code == 404
 
-def test_update_tag():
+def test_update_tag(query_budget):
     response = client.post("/tags/", json={"name": "Tag to Update"})
     tag_id = response.json()["id"]
-    response = client.put(f"/tags/{tag_id}", json={"name": "Updated Tag"})
+    # Includes finding the tagged notes for delta sync and bumping the tag
+    # version that note ETags depend on.
+    with query_budget(async_engine, 5):
+        response = client.put(f"/tags/{tag_id}", json={"name": "Updated Tag"})
     assert response.status_code == 200
     assert response.json()["name"] == "Updated Tag"
 
@@ -60,10 +95,11 @@ def test_update_tag_not_found():
     response = client.put("/tags/999", json={"name": "Non-existent Tag"})
     assert response.status_code == 404
 
-def test_delete_tag():
+def test_delete_tag(query_budget):
     response = client.post("/tags/", json={"name": "Tag to Delete"})
     tag_id = response.json()["id"]
-    response = client.delete(f"/tags/{tag_id}")
+    with query_budget(async_engine, 6):
+        response = client.delete(f"/tags/{tag_id}")
     assert response.status_code == 200
     assert response.json()["detail"] == "Tag deleted successfully"
 
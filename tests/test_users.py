@@ -1,8 +1,11 @@
+import ipaddress
 import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from datetime import timedelta, UTC
+import time
+from datetime import datetime, timedelta, UTC
 from jose import jwt, JWTError
+from fastapi import HTTPException, Request
 from models import User
 from schemas import UserCreate
 from database import Base
@@ -11,8 +14,22 @@ from services.auth import (
     verify_password,
     authenticate_user,
     create_access_token,
-    register_user
+    register_user,
+    get_current_user,
+    principal_cache
 )
+from services.password_pool import PasswordPool, PasswordPoolBusy, dummy_hash, dummy_hash_async
+import services.password_pool as password_pool_module
+from services.rate_limit import MemoryBucketStore, DatabaseBucketStore, RateLimiter, RateLimit, client_ip
+from services.refresh_tokens import (
+    issue_refresh_token,
+    rotate_refresh_token,
+    revoke_refresh_token,
+    RefreshTokenSweeper,
+)
+from models import RefreshToken
+import services.auth as auth_module
+import services.rate_limit as rate_limit_module
 import config
 
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
@@ -101,15 +118,17 @@ def test_register_user_duplicate_username(db):
         register_user(db, user_data)
     assert "Username already registered" in str(exc_info.value)
 
-def test_login_user_success(db):
+def test_login_user_success(db, query_budget):
     user_data = UserCreate(
         username="logintest",
         password="testpass123",
         name="Login Test User"
     )
-    register_user(db, user_data)
+    with query_budget(engine, 3):
+        register_user(db, user_data)
     
-    authenticated_user = authenticate_user(db, "logintest", "testpass123")
+    with query_budget(engine, 1):
+        authenticated_user = authenticate_user(db, "logintest", "testpass123")
     assert authenticated_user is not None
     assert authenticated_user.username == "logintest"
     assert authenticated_user.name == "Login Test User"
@@ -128,3 +147,171 @@ def test_login_user_invalid_credentials(db):
 def test_login_user_nonexistent_user(db):
     authenticated_user = authenticate_user(db, "nonexistentuser", "anypassword")
     assert authenticated_user is None
+
+def test_get_current_user_caches_principal(db, query_budget):
+    principal_cache.clear()
+    user = register_user(db, UserCreate(username="cached", password="testpass123", name="Cached User"))
+    token = create_access_token({"sub": user.username}, timedelta(minutes=5))
+
+    with query_budget(engine, 1):
+        first = get_current_user(token, db)
+    hits = principal_cache.stats()["hits"]
+    db.close()
+    with query_budget(engine, 0):
+        second = get_current_user(token, None)
+    assert first == second == {"id": user.id, "name": "Cached User", "username": "cached"}
+    assert principal_cache.stats()["hits"] == hits + 1
+
+def test_principal_cache_invalidated_on_rename_and_delete(db):
+    principal_cache.clear()
+    user = register_user(db, UserCreate(username="renamed", password="testpass123", name="Before"))
+    token = create_access_token({"sub": user.username}, timedelta(minutes=5))
+    get_current_user(token, db)
+
+    user.name = "After"
+    db.commit()
+    assert principal_cache.get(token) is None
+    assert get_current_user(token, db)["name"] == "After"
+
+    db.delete(user)
+    db.commit()
+    assert principal_cache.get(token) is None
+
+def test_principal_cache_expires_with_token():
+    principal_cache.clear()
+    principal_cache.put("expired", {"id": 1, "name": "x", "username": "x"}, time.time() - 1)
+    assert principal_cache.get("expired") is None
+    principal_cache.put("short", {"id": 1, "name": "x", "username": "x"}, time.time() + 0.05)
+    assert principal_cache.get("short") is not None
+    time.sleep(0.06)
+    assert principal_cache.get("short") is None
+
+def test_password_pool_rejects_when_full():
+    pool = PasswordPool(workers=1, queue_depth=0)
+    try:
+        running = pool.submit(time.sleep, 0.5)
+        with pytest.raises(PasswordPoolBusy):
+            pool.submit(time.sleep, 0)
+        running.result()
+        pool.run(time.sleep, 0)
+        assert pool.rejected == 1
+    finally:
+        pool.shutdown()
+
+def test_memory_bucket_store_refills_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit_module.time, "monotonic", lambda: now[0])
+    store = MemoryBucketStore(max_keys=2)
+    assert [store.take("a", 2, 1.0) for _ in range(3)] == [0, 0, 1.0]
+    now[0] += 0.5
+    assert store.take("a", 2, 1.0) == 0.5
+    now[0] += 0.5
+    assert store.take("a", 2, 1.0) == 0
+
+    store.take("b", 2, 1.0)
+    store.take("c", 2, 1.0)
+    assert len(store) == 2
+    # "a" was least recently used, so it was evicted and starts out full.
+    assert store.take("a", 2, 1.0) == 0 and store.take("a", 2, 1.0) == 0
+
+def test_database_bucket_store_shares_buckets(db):
+    store = DatabaseBucketStore(engine)
+    assert [store.take("login:user:x", 2, 1 / 60) for _ in range(2)] == [0, 0]
+    wait = store.take("login:user:x", 2, 1 / 60)
+    assert 59 < wait <= 60
+    assert DatabaseBucketStore(engine).take("login:user:x", 2, 1 / 60) > 0
+    assert store.take("login:user:y", 2, 1 / 60) == 0
+
+def test_rate_limiter_reports_retry_after():
+    limiter = RateLimiter(MemoryBucketStore(max_keys=10))
+    limit = RateLimit("login:ip", 1, 6)
+    limiter.check((limit, "10.0.0.1"))
+    with pytest.raises(HTTPException) as exc_info:
+        limiter.check((limit, "10.0.0.1"))
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers == {"Retry-After": "10"}
+    limiter.check((limit, "10.0.0.2"))
+    assert limiter.stats()["rejected"] == 1
+
+def _request_from(host, forwarded_for=()):
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded_for]
+    return Request({"type": "http", "client": (host, 50000), "headers": headers})
+
+def test_client_ip_trusts_forwarded_for_only_from_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(rate_limit_module, "trusted_proxies", [ipaddress.ip_network("10.0.0.0/8")])
+    # Direct clients cannot pick their own bucket.
+    assert client_ip(_request_from("203.0.113.7", ["198.51.100.1"])) == "203.0.113.7"
+    # Behind the proxy, the nearest untrusted hop is the client; the spoofed
+    # entry it sent along is ignored.
+    assert client_ip(_request_from("10.0.0.2", ["1.2.3.4, 198.51.100.9, 10.0.0.5"])) == "198.51.100.9"
+    assert client_ip(_request_from("10.0.0.2", ["1.2.3.4", "198.51.100.9"])) == "198.51.100.9"
+    assert client_ip(_request_from("10.0.0.2")) == "10.0.0.2"
+    monkeypatch.setattr(rate_limit_module, "trusted_proxies", [])
+    assert client_ip(_request_from("10.0.0.2", ["198.51.100.9"])) == "10.0.0.2"
+
+def test_authenticate_unknown_user_still_verifies_a_hash(db, monkeypatch):
+    checked = []
+    monkeypatch.setattr(auth_module, "verify_password", lambda password, hashed: checked.append(hashed) or False)
+    assert authenticate_user(db, "nobody", "anypassword") is None
+    assert checked == [dummy_hash()]
+
+@pytest.mark.asyncio
+async def test_dummy_hash_is_made_through_the_pool_once(monkeypatch):
+    made = []
+    async def fake_hash(password):
+        made.append(password)
+        return "dummy"
+    monkeypatch.setattr(password_pool_module, "_dummy_hash", None)
+    monkeypatch.setattr(password_pool_module, "hash_password_async", fake_hash)
+    assert [await dummy_hash_async(), await dummy_hash_async()] == ["dummy", "dummy"]
+    assert len(made) == 1
+
+def _refresh_user(db):
+    return register_user(db, UserCreate(username="refresh", password="testpass123", name="Refresh"))
+
+def test_refresh_token_rotates(db, query_budget):
+    user = _refresh_user(db)
+    token = issue_refresh_token(db, user.id)
+    stored = db.query(RefreshToken).one()
+    assert stored.token_hash != token and len(stored.token_hash) == 64
+
+    with query_budget(engine, 3):
+        username, new_token = rotate_refresh_token(db, token)
+    assert username == "refresh"
+    assert new_token != token
+    assert db.query(RefreshToken).filter(RefreshToken.family_id == stored.family_id).count() == 2
+
+    with pytest.raises(ValueError):
+        rotate_refresh_token(db, "not-a-token")
+
+def test_refresh_token_reuse_revokes_family(db):
+    user = _refresh_user(db)
+    token = issue_refresh_token(db, user.id)
+    other_session = issue_refresh_token(db, user.id)
+    _, successor = rotate_refresh_token(db, token)
+
+    with pytest.raises(ValueError):
+        rotate_refresh_token(db, token)
+    # The legitimate-looking successor is gone too; other logins are not.
+    with pytest.raises(ValueError):
+        rotate_refresh_token(db, successor)
+    assert rotate_refresh_token(db, other_session)[0] == "refresh"
+
+def test_revoke_refresh_token(db):
+    user = _refresh_user(db)
+    token = issue_refresh_token(db, user.id)
+    assert revoke_refresh_token(db, token) is True
+    assert revoke_refresh_token(db, "unknown") is False
+    with pytest.raises(ValueError):
+        rotate_refresh_token(db, token)
+
+def test_sweeper_deletes_expired_tokens_in_batches(db, monkeypatch):
+    user = _refresh_user(db)
+    for _ in range(5):
+        issue_refresh_token(db, user.id)
+    db.query(RefreshToken).filter(RefreshToken.id <= 4).update({"expires_at": datetime(2000, 1, 1)})
+    db.commit()
+    sweeper = RefreshTokenSweeper(TestingSessionLocal, interval_seconds=60, batch_size=2)
+    assert sweeper.sweep() == 4
+    assert db.query(RefreshToken).count() == 1
+    assert sweeper.stats()["runs"] == 1